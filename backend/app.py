@@ -1,22 +1,147 @@
 # backend/app.py
-from flask import Flask, request, jsonify
+import time
+_import_started = time.monotonic()  # 用于统计应用导入耗时 (见 backend/warmup.py)
+from flask import Flask, request, jsonify, g, send_file, Response
 from flask_cors import CORS
 import backend.database as db # 使用相对导入
 import backend.llm_service as llm # 使用相对导入
+from backend.menu_search import menu_index
+from backend.order_intake import order_intake
+from backend.idempotency import idempotent
+from backend.rate_limit import rate_limited, admission_controlled, too_many_requests
+import backend.archiver as archiver
+import backend.write_behind as write_behind
+import backend.auth_tokens as auth_tokens
+import backend.image_cache as image_cache
+import backend.menu_prefilter as menu_prefilter
+import backend.recommender as recommender
+import backend.order_states as order_states
+import backend.frontend_assets as frontend_assets
+import backend.warmup as warmup
+import backend.profiler as profiler
+import backend.menu_import as menu_import
+import backend.menu_snapshot as menu_snapshot
 from datetime import datetime, timedelta 
 import jwt 
 import bcrypt 
 from functools import wraps
-import logging
+import json
+import os
+import threading
+import backend.log_config as log_config
+from backend.db_config import DEFAULT_TENANT_ID, GROUP_ADMIN_TENANT_IDS
 
 # --- 应用配置 ---
 app = Flask(__name__)
-CORS(app) 
+CORS(app, expose_headers=['X-Menu-Version', 'X-DB-Checkouts'])  # 允许前端读取菜单版本号和连接池取用次数响应头
 
 app.config['SECRET_KEY'] = 'your-very-secret-and-strong-key' 
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 
+# --- 租户 (餐厅) 绑定 ---
+# 未登录请求通过 X-Tenant-ID 请求头或 tenant_id 查询参数指定餐厅，缺省为默认餐厅；
+# 已登录请求以访问令牌中的 tenant_id 为准 (见 token_required)
+# --- 后台任务：每个工作进程在处理首个请求时启动 (预分叉部署下 __main__ 不会执行，且线程不会随 fork 复制) ---
+_background_started_pid = None
+_background_lock = threading.Lock()
+
+@app.before_request
+def start_background_services():
+    global _background_started_pid
+    if _background_started_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_started_pid != os.getpid():
+            log_config.configure_logging() # 请求线程只入队，JSON 格式化和控制台/文件写入由后台线程完成
+            warmup.start() # 后台预热连接池和缓存，完成前 /readyz 返回 503
+            archiver.start_archive_scheduler() # 多进程部署时只有一个进程实际执行归档
+            menu_snapshot.start_refresher() # 多进程部署时只有一个进程实际刷新共享菜单快照
+            order_intake.start() # 恢复本进程及已退出进程遗留的排队订单，并启动提交线程
+            _background_started_pid = os.getpid()
+
+# --- 冷启动统计：记录启动后的首个请求和首个快速请求 ---
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+@app.after_request
+def record_request_timing(response):
+    started = g.get('request_started')
+    if started is not None:
+        warmup.record_request(request.path, time.monotonic() - started)
+    return response
+
+# --- 按需剖析：管理员开启后，带 X-Profile 请求头或被抽样的请求记录调用栈和 SQL (见 backend/profiler.py) ---
+@app.before_request
+def start_profiling():
+    if profiler.request_profiler.armed:
+        g.profile = profiler.request_profiler.start_request(
+            request.method, request.path, request.headers.get(profiler.PROFILE_HEADER))
+
+@app.after_request
+def record_profile_status(response):
+    profile = g.get('profile')
+    if profile is not None:
+        profile.status = response.status_code
+        response.headers['X-Profile-ID'] = profile.id
+    return response
+
+@app.teardown_request
+def finish_profiling(exc=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.request_profiler.finish_request(profile, profile.status if exc is None else 500)
+
+@app.before_request
+def bind_tenant():
+    tenant_id = request.headers.get('X-Tenant-ID') or request.args.get('tenant_id') or DEFAULT_TENANT_ID
+    try:
+        g.tenant_token = db.set_current_tenant(tenant_id)
+    except (db.UnknownTenantError, ValueError) as e:
+        return jsonify({"error": "餐厅ID无效", "message": str(e)}), 400
+
+@app.teardown_request
+def unbind_tenant(exc=None):
+    tenant_token = g.pop('tenant_token', None)
+    if tenant_token is not None:
+        db.reset_current_tenant(tenant_token)
+
+# --- 请求级数据库会话：db.transaction() 内的数据库函数复用一个连接；请求结束时提交 (出错时回滚) 并归还仍未归还的连接 ---
+# 调用多个数据库函数的端点把这些调用放进 db.transaction()，整个代码块只从连接池取一次连接；
+# 每个请求从连接池取连接的次数通过 X-DB-Checkouts 响应头返回，并记录在 debug 日志中
+@app.before_request
+def begin_db_session():
+    g.db_session_token = db.begin_session()
+
+@app.after_request
+def report_db_checkouts(response):
+    session = db.current_session()
+    if session is not None:
+        response.headers['X-DB-Checkouts'] = str(session.checkouts)
+        app.logger.debug(f"{request.method} {request.path} 从连接池取用连接 {session.checkouts} 次")
+    return response
+
+@app.teardown_request
+def end_db_session(exc=None):
+    db_session_token = g.pop('db_session_token', None)
+    if db_session_token is not None:
+        db.end_session(db_session_token, commit=exc is None)
+
+# --- 共享菜单快照：修改菜单或分类的请求成功后发布新快照，所有工作进程随之切换 (见 backend/menu_snapshot.py) ---
+def _mark_menu_changed():
+    g.menu_changed = True
+
+@app.after_request
+def publish_menu_snapshot(response):
+    if g.pop('menu_changed', False):
+        try:
+            # 在 fan_out 工作线程中发布：不使用本请求的数据库会话，只读取已提交的数据
+            db.fan_out(menu_snapshot.publish, tenant_ids=[db.current_tenant_id()])
+        except Exception as e:
+            app.logger.error(f"发布菜单快照失败: {e}", exc_info=True)
+    return response
+
 # --- 辅助函数：JWT 和 权限装饰器 ---
 def token_required(f):
     """装饰器：检查请求头中是否包含有效的JWT"""
@@ -33,14 +158,21 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = db.get_user_by_id(data['user_id'])
+            db.set_current_tenant(data.get('tenant_id', DEFAULT_TENANT_ID))
+            current_user = db.get_user_for_token(data['user_id'], data.get('jti'))
             if not current_user:
                 return jsonify({"message": "Token is invalid, user not found!"}), 401
+            if auth_tokens.is_revoked(data, current_user):
+                return jsonify({"message": "Token has been revoked!"}), 401
+            current_user.pop('tokens_valid_after', None)
+            current_user.pop('token_revoked', None)
         except jwt.ExpiredSignatureError:
             return jsonify({"message": "Token has expired!"}), 401
-        except jwt.InvalidTokenError:
+        except (jwt.InvalidTokenError, db.UnknownTenantError):
             return jsonify({"message": "Token is invalid!"}), 401
         
+        g.current_user = current_user
+        g.token_payload = data
         return f(current_user, *args, **kwargs)
     return decorated
 
@@ -54,14 +186,26 @@ def admin_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+def group_admin_required(f):
+    """装饰器：检查用户是否为集团管理员 (集团总部餐厅的管理员可查看所有餐厅的汇总数据)"""
+    @wraps(f)
+    @admin_required
+    def decorated(current_user, *args, **kwargs):
+        if current_user.get('tenant_id', DEFAULT_TENANT_ID) not in GROUP_ADMIN_TENANT_IDS:
+            return jsonify({"message": "Group admin privilege required!"}), 403
+        return f(current_user, *args, **kwargs)
+    return decorated
+
 # --- API 端点 ---
 
-@app.route('/')
+@app.route('/api')
 def home():
-    return "欢迎来到餐饮管理系统后端API！ (v2)"
+    return "欢迎来到餐饮管理系统后端API！ (v2)"  # 根路径 / 由前端首页 (frontend_index) 提供
 
 # == 用户认证API ==
 @app.route('/api/auth/register', methods=['POST'])
+@rate_limited('register')
+@admission_controlled()
 def register_user():
     """用户注册"""
     data = request.get_json()
@@ -75,10 +219,12 @@ def register_user():
     email = data.get('email')
     phone = data.get('phone')
 
-    if db.get_user_by_username(username):
-        return jsonify({"error": "用户名已存在"}), 409
-    if email and db.execute_query("SELECT id FROM users WHERE email = %s", (email,), fetch_one=True):
-        return jsonify({"error": "邮箱已被注册"}), 409
+    with db.transaction():  # 两项重复检查共用一个连接 (create_user 中的密码哈希较慢，不在事务内进行)
+        if db.get_user_by_username(username):
+            return jsonify({"error": "用户名已存在"}), 409
+        if email and db.execute_query("SELECT id FROM users WHERE email = %s AND tenant_id = %s",
+                                      (email, db.current_tenant_id()), fetch_one=True):
+            return jsonify({"error": "邮箱已被注册"}), 409
 
     user_id = db.create_user(username, password, role, full_name, email, phone)
     if user_id:
@@ -88,6 +234,8 @@ def register_user():
         return jsonify({"error": "用户注册失败，请稍后再试"}), 500
 
 @app.route('/api/auth/login', methods=['POST'])
+@rate_limited('login')
+@admission_controlled()
 def login_user():
     """用户登录，成功则返回JWT"""
     data = request.get_json()
@@ -102,19 +250,15 @@ def login_user():
     if not user or not db.verify_password(password, user['password_hash']):
         return jsonify({"error": "用户名或密码错误"}), 401
 
-    db.update_user_last_login(user['id'])
+    write_behind.record_last_login(user['id']) # 非关键写入，由写后缓冲批量落库
 
-    token_payload = {
-        'user_id': user['id'],
-        'username': user['username'],
-        'role': user['role'],
-        'exp': datetime.utcnow() + app.config['JWT_ACCESS_TOKEN_EXPIRES']
-    }
-    access_token = jwt.encode(token_payload, app.config['SECRET_KEY'], algorithm="HS256")
+    access_token = auth_tokens.issue_access_token(user, app.config['SECRET_KEY'], app.config['JWT_ACCESS_TOKEN_EXPIRES'])
+    refresh_token = auth_tokens.issue_refresh_token(user['id'], app.config['JWT_REFRESH_TOKEN_EXPIRES'])
     
     return jsonify({
         "message": "登录成功",
         "access_token": access_token,
+        "refresh_token": refresh_token,
         "user": { 
             "id": user['id'],
             "username": user['username'],
@@ -123,6 +267,57 @@ def login_user():
         }
     }), 200
 
+@app.route('/api/auth/refresh', methods=['POST'])
+def refresh_access_token():
+    """使用刷新令牌换取新的访问令牌和新的刷新令牌 (旧刷新令牌随即失效)，无需再次校验密码"""
+    data = request.get_json(silent=True)
+    if not data or not data.get('refresh_token'):
+        return jsonify({"error": "缺少刷新令牌 (refresh_token)"}), 400
+
+    # 刷新令牌前缀中的租户决定查询哪个分片
+    tenant_id = auth_tokens.refresh_token_tenant(data['refresh_token'])
+    try:
+        db.set_current_tenant(tenant_id if tenant_id is not None else DEFAULT_TENANT_ID)
+    except db.UnknownTenantError:
+        return jsonify({"error": "刷新令牌无效"}), 401
+
+    try:
+        with db.transaction():  # 轮换刷新令牌和查询用户共用一个连接
+            user_id, new_refresh_token, error = auth_tokens.rotate_refresh_token(
+                data['refresh_token'], app.config['JWT_REFRESH_TOKEN_EXPIRES'])
+            if error:
+                return jsonify({"error": error}), 401
+
+            user = db.get_user_by_id(user_id)
+            if not user:
+                return jsonify({"error": "用户不存在"}), 401
+
+        access_token = auth_tokens.issue_access_token(user, app.config['SECRET_KEY'], app.config['JWT_ACCESS_TOKEN_EXPIRES'])
+        return jsonify({
+            "message": "令牌刷新成功",
+            "access_token": access_token,
+            "refresh_token": new_refresh_token
+        }), 200
+    except Exception as e:
+        app.logger.error(f"刷新令牌失败: {e}", exc_info=True)
+        return jsonify({"error": "刷新令牌时发生服务器错误", "message": str(e)}), 500
+
+@app.route('/api/auth/logout', methods=['POST'])
+@token_required
+def logout_user(current_user):
+    """登出：吊销当前访问令牌，以及请求体中提供的刷新令牌所属的会话"""
+    try:
+        payload = g.token_payload
+        if payload.get('jti') and not auth_tokens.revoke_access_token(payload):
+            return jsonify({"error": "登出失败，请稍后重试"}), 500
+        data = request.get_json(silent=True) or {}
+        if data.get('refresh_token'):
+            auth_tokens.revoke_refresh_token(data['refresh_token'])
+        return jsonify({"message": "已登出"}), 200
+    except Exception as e:
+        app.logger.error(f"用户 {current_user['username']} 登出失败: {e}", exc_info=True)
+        return jsonify({"error": "登出时发生服务器错误", "message": str(e)}), 500
+
 @app.route('/api/auth/me', methods=['GET'])
 @token_required
 def get_current_user_profile(current_user):
@@ -136,6 +331,9 @@ def get_current_user_profile(current_user):
 def get_categories():
     """获取所有菜品分类"""
     try:
+        snapshot = menu_snapshot.fresh()
+        if snapshot is not None:
+            return Response(snapshot.segment('categories'), mimetype='application/json'), 200
         categories = db.get_all_categories()
         return jsonify(categories), 200
     except Exception as e:
@@ -148,18 +346,140 @@ def get_menu():
     try:
         include_unavailable_str = request.args.get('include_unavailable', 'false').lower()
         include_unavailable = include_unavailable_str == 'true'
+
+        try:
+            fields = db.parse_fields_param(request.args.get('fields'), db.MENU_ITEM_FIELDS)
+        except ValueError as ve:
+            return jsonify({"error": "fields 参数无效", "message": str(ve)}), 400
         
-        menu_items = db.get_all_menu_items(include_unavailable=include_unavailable)
-        return jsonify(menu_items), 200
+        # 未指定字段投影时直接返回共享菜单快照中预先序列化好的菜单
+        snapshot = menu_snapshot.fresh() if fields is None else None
+        if snapshot is not None:
+            response = Response(snapshot.segment('all' if include_unavailable else 'available'),
+                                mimetype='application/json')
+            response.headers['X-Menu-Version'] = str(snapshot.version)
+            return response, 200
+
+        # 先取版本号再查询菜品：期间发生的变更会在下一次增量同步时再次下发，不会丢失
+        with db.transaction():
+            menu_version = db.get_menu_version()
+            menu_items = db.get_all_menu_items(include_unavailable=include_unavailable, fields=fields,
+                                               with_thumbnails=True)
+        response = jsonify(menu_items)
+        if menu_version is not None:
+            response.headers['X-Menu-Version'] = str(menu_version)
+        return response, 200
     except Exception as e:
         app.logger.error(f"获取菜单失败: {e}")
         return jsonify({"error": "获取菜单失败", "message": str(e)}), 500
 
+@app.route('/api/menu/changes', methods=['GET'])
+def get_menu_changes():
+    """
+    菜单增量同步：since 为客户端持有的菜单版本号 (来自 /api/menu 的 X-Menu-Version 响应头或上一次增量同步)。
+    没有变化时返回 304 (无响应体)；否则返回变化的菜品/分类、需要移除的菜品ID和新的版本号。
+    full_resync 为 true 时客户端应重新获取完整菜单。
+    """
+    since = request.args.get('since', '').strip()
+    if not since.isdigit():
+        return jsonify({"error": "缺少或无效的 since 参数 (菜单版本号)"}), 400
+    include_unavailable = request.args.get('include_unavailable', 'false').lower() == 'true'
+
+    try:
+        changes = db.get_menu_changes(int(since), include_unavailable=include_unavailable)
+        if changes is None:
+            return jsonify({"error": "获取菜单变更失败"}), 500
+        if not changes['full_resync'] and not changes['items'] and not changes['removed_item_ids'] \
+                and not changes['categories']:
+            response = app.response_class(status=304)
+            response.headers['X-Menu-Version'] = str(changes['version'])
+            return response
+        return jsonify(changes), 200
+    except Exception as e:
+        app.logger.error(f"获取菜单变更失败 (since={since}): {e}")
+        return jsonify({"error": "获取菜单变更失败", "message": str(e)}), 500
+
+@app.route('/api/images/<string:image_key>/<string:variant>', methods=['GET'])
+def get_menu_image(image_key, variant):
+    """
+    菜品图片代理：variant 为 'original' 或 '<规格>.<格式>' (例如 medium.webp / small.jpg)。
+    同一图片键的内容不会变化，响应带长期 immutable 缓存头，并支持 If-None-Match 条件请求。
+    """
+    try:
+        path, mimetype, etag = image_cache.get_image(image_key, variant)
+    except KeyError:
+        return jsonify({"error": "图片未找到"}), 404
+    except ValueError as ve:
+        return jsonify({"error": "图片规格无效", "message": str(ve)}), 400
+    except image_cache.ImageFetchError as fe:
+        app.logger.warning(f"图片代理抓取 {image_key} 失败: {fe}")
+        return jsonify({"error": "获取源图片失败", "message": str(fe)}), 502
+
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True,
+                         max_age=image_cache.IMAGE_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f"public, max-age={image_cache.IMAGE_CACHE_MAX_AGE}, immutable"
+    return response
+
+@app.route('/api/menu/search', methods=['GET'])
+def search_menu():
+    """搜索可供应菜品 (内存倒排索引)，支持 q / category / max_price / limit 参数"""
+    try:
+        query = request.args.get('q', '').strip()
+        category = request.args.get('category')
+        max_price = request.args.get('max_price', type=float)
+        limit = request.args.get('limit', 20, type=int)
+        if limit < 1: limit = 1
+        if limit > 100: limit = 100
+
+        if category is not None:
+            category = category.strip()
+            category = int(category) if category.isdigit() else (category or None)
+
+        results, total = menu_index.search(query, category=category, max_price=max_price, limit=limit)
+        return jsonify({"query": query, "results": results, "total": total}), 200
+    except Exception as e:
+        app.logger.error(f"搜索菜品失败: {e}")
+        return jsonify({"error": "搜索菜品失败", "message": str(e)}), 500
+
+def _resolve_dish_ids(dishes):
+    """把菜品ID或菜名列表转换为菜品ID列表 (无法识别的菜名忽略)"""
+    by_name = None
+    item_ids = []
+    for dish in dishes:
+        dish = str(dish).strip()
+        if dish.isdigit():
+            item_ids.append(int(dish))
+            continue
+        if by_name is None:
+            by_name = menu_prefilter.get_catalog().by_name
+        if dish in by_name:
+            item_ids.append(by_name[dish]['item']['id'])
+    return item_ids
+
+@app.route('/api/recommendations', methods=['GET'])
+def get_recommendations():
+    """
+    "常与之搭配" 推荐：dishes 为逗号分隔的菜品ID或菜名，基于历史订单的菜品共现统计，本地计算。
+    没有共现数据时返回热门菜品。
+    """
+    try:
+        dishes = [d for d in request.args.get('dishes', '').split(',') if d.strip()]
+        limit = request.args.get('limit', recommender.DEFAULT_LIMIT, type=int)
+        if limit < 1: limit = 1
+        if limit > 20: limit = 20
+
+        results, source = recommender.recommend(_resolve_dish_ids(dishes), limit=limit)
+        return jsonify({"recommendations": results, "source": source}), 200
+    except Exception as e:
+        app.logger.error(f"获取推荐菜品失败: {e}", exc_info=True)
+        return jsonify({"error": "获取推荐菜品失败", "message": str(e)}), 500
+
 @app.route('/api/menu/<int:item_id>', methods=['GET'])
 def get_menu_item(item_id):
     """获取单个菜品详情"""
     try:
-        item = db.get_menu_item_by_id(item_id)
+        snapshot = menu_snapshot.fresh()
+        item = snapshot.get_item(item_id) if snapshot is not None else db.get_menu_item_by_id(item_id)
         if item:
             return jsonify(item), 200
         else:
@@ -194,77 +514,154 @@ def admin_add_new_menu_item(current_admin_user):
         except ValueError as ve:
             return jsonify({"error": "价格或分类ID格式无效", "message": str(ve)}), 400
 
-        if not db.get_category_by_id(category_id):
-            return jsonify({"error": f"分类ID {category_id} 不存在"}), 404
+        if image_url:
+            try:
+                image_cache.validate_source_url(image_url)
+            except ValueError as ve:
+                return jsonify({"error": "图片链接无效", "message": str(ve)}), 400
 
-        item_id = db.add_menu_item(name, description, price, category_id, image_url, is_available)
-        if item_id:
-            app.logger.info(f"管理员 {current_admin_user['username']} 添加菜品成功, ID: {item_id}")
-            return jsonify({"message": "菜品添加成功", "item_id": item_id}), 201
-        else:
-            return jsonify({"error": "添加菜品失败"}), 500
+        with db.transaction():  # 分类检查、插入和重新查询在同一个事务中
+            if not db.get_category_by_id(category_id):
+                return jsonify({"error": f"分类ID {category_id} 不存在"}), 404
+
+            item_id = db.add_menu_item(name, description, price, category_id, image_url, is_available)
+            if item_id:
+                app.logger.info(f"管理员 {current_admin_user['username']} 添加菜品成功, ID: {item_id}")
+                menu_index.upsert(db.get_menu_item_by_id(item_id))
+                _mark_menu_changed()
+                return jsonify({"message": "菜品添加成功", "item_id": item_id}), 201
+            else:
+                return jsonify({"error": "添加菜品失败"}), 500
     except Exception as e:
         app.logger.error(f"管理员 {current_admin_user.get('username', 'N/A')} 添加菜品失败: {e}", exc_info=True)
         return jsonify({"error": "添加菜品时发生服务器错误", "message": str(e)}), 500
 
+def _read_bulk_menu_rows():
+    """读取批量导入请求中的原始行：上传的 CSV/JSON 文件 (file 字段)、text/csv 请求体或 JSON 请求体"""
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+        if (upload.filename or '').lower().endswith('.json'):
+            return menu_import.parse_json(json.loads(text))
+        return menu_import.parse_csv(text)
+    if request.mimetype in ('text/csv', 'application/csv'):
+        return menu_import.parse_csv(request.get_data().decode('utf-8-sig'))
+    data = request.get_json(silent=True)
+    if data is None:
+        raise ValueError("请求体必须是 JSON 或 CSV")
+    return menu_import.parse_json(data)
+
+@app.route('/api/admin/menu/bulk', methods=['POST'])
+@admin_required
+def admin_bulk_upsert_menu_items(current_admin_user):
+    """
+    管理员批量新增/修改菜品 (CSV 或 JSON)，在一个事务中基于同一份分类快照校验并用多行语句写入，逐行报告错误。
+    查询参数: partial=true 时只写入校验通过的行 (默认任意一行有错误就全部不写入)；dry_run=true 时只校验不写入
+    """
+    partial = request.args.get('partial', 'false').lower() == 'true'
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+    try:
+        raw_rows = _read_bulk_menu_rows()
+    except (ValueError, UnicodeDecodeError) as ve:
+        return jsonify({"error": "批量导入数据无效", "message": str(ve)}), 400
+    if not raw_rows:
+        return jsonify({"error": "没有需要导入的菜品"}), 400
+
+    try:
+        rows, format_errors = [], []
+        for number, raw in enumerate(raw_rows, start=1):
+            row, errors = menu_import.normalize_row(raw)
+            if errors:
+                format_errors.extend({"row": number, "message": message} for message in errors)
+            else:
+                rows.append({"row": number, **row})
+
+        rejected = bool(format_errors) and not partial
+        result = db.bulk_upsert_menu_items(rows, apply_valid_rows=partial, dry_run=dry_run or rejected)
+        if result is None:
+            return jsonify({"error": "批量导入菜品失败，数据库操作错误"}), 500
+        result["errors"] = sorted(format_errors + result["errors"], key=lambda error: error["row"])
+        result["dry_run"] = dry_run
+        result["summary"] = {key: len(result[key]) for key in ('created', 'updated', 'unchanged', 'errors')}
+
+        if result["applied"] and (result["created"] or result["updated"]):
+            menu_index.invalidate()  # 整批只失效一次，下次查询时重建索引 (依赖目录版本号的缓存随之失效)
+            _mark_menu_changed()
+            app.logger.info(f"管理员 {current_admin_user['username']} 批量导入菜品: {result['summary']}")
+        if result["errors"] and not partial and not dry_run:
+            return jsonify({**result, "error": "部分行校验失败，未写入任何菜品"}), 422
+        return jsonify(result), 200
+    except Exception as e:
+        app.logger.error(f"管理员 {current_admin_user.get('username', 'N/A')} 批量导入菜品失败: {e}", exc_info=True)
+        return jsonify({"error": "批量导入菜品时发生服务器错误", "message": str(e)}), 500
+
 @app.route('/api/admin/menu/<int:item_id>', methods=['PUT'])
 @admin_required
 def admin_update_menu_item(current_admin_user, item_id):
     """管理员修改现有菜品"""
     try:
-        existing_item = db.get_menu_item_by_id(item_id)
-        if not existing_item:
-            app.logger.warning(f"管理员 {current_admin_user['username']} 尝试更新不存在的菜品ID: {item_id}")
-            return jsonify({"error": "菜品未找到，无法更新"}), 404
-
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "请求体不能为空"}), 400
-
-        name = data.get('name', existing_item['name'])
-        description = data.get('description', existing_item['description'])
-        price_str = data.get('price')
-        category_id_str = data.get('category_id')
-        image_url = data.get('image_url', existing_item['image_url'])
-        is_available = data.get('is_available', existing_item['is_available'])
-
-        if not name:
-            return jsonify({"error": "菜品名称不能为空"}), 400
+        with db.transaction():  # 存在性检查、分类检查、更新和重新查询在同一个事务中
+            existing_item = db.get_menu_item_by_id(item_id)
+            if not existing_item:
+                app.logger.warning(f"管理员 {current_admin_user['username']} 尝试更新不存在的菜品ID: {item_id}")
+                return jsonify({"error": "菜品未找到，无法更新"}), 404
+
+            data = request.get_json()
+            if not data:
+                return jsonify({"error": "请求体不能为空"}), 400
+
+            name = data.get('name', existing_item['name'])
+            description = data.get('description', existing_item['description'])
+            price_str = data.get('price')
+            category_id_str = data.get('category_id')
+            image_url = data.get('image_url', existing_item['image_url'])
+            is_available = data.get('is_available', existing_item['is_available'])
+
+            if not name:
+                return jsonify({"error": "菜品名称不能为空"}), 400
+
+            if data.get('image_url'):
+                try:
+                    image_cache.validate_source_url(data['image_url'])
+                except ValueError as ve:
+                    return jsonify({"error": "图片链接无效", "message": str(ve)}), 400
         
-        try:
-            price = float(price_str)
-            if price <= 0:
-                raise ValueError("价格必须为正数")
-        except (ValueError, TypeError):
-            return jsonify({"error": "价格格式无效或未提供", "message": "价格必须是正数。"}), 400
+            try:
+                price = float(price_str)
+                if price <= 0:
+                    raise ValueError("价格必须为正数")
+            except (ValueError, TypeError):
+                return jsonify({"error": "价格格式无效或未提供", "message": "价格必须是正数。"}), 400
 
-        try:
-            category_id = int(category_id_str)
-            if not db.get_category_by_id(category_id):
-                return jsonify({"error": f"分类ID {category_id} 不存在"}), 404
-        except (ValueError, TypeError):
-            return jsonify({"error": "分类ID格式无效或未提供", "message": "分类ID必须是整数。"}), 400
-
-        if not isinstance(is_available, bool):
-             if str(is_available).lower() == 'true':
-                 is_available = True
-             elif str(is_available).lower() == 'false':
-                 is_available = False
-             else:
-                return jsonify({"error": "is_available 字段必须是布尔值 (true/false)"}), 400
-
-        affected_rows = db.update_menu_item(item_id, name, description, price, category_id, image_url, is_available)
-
-        if affected_rows is not None and affected_rows > 0:
-            app.logger.info(f"管理员 {current_admin_user['username']} 成功更新菜品ID: {item_id}")
-            updated_item = db.get_menu_item_by_id(item_id)
-            return jsonify({"message": "菜品更新成功", "item": updated_item}), 200
-        elif affected_rows == 0:
-            app.logger.warning(f"管理员 {current_admin_user['username']} 更新菜品ID: {item_id} 时，数据未发生变化或未找到。")
-            return jsonify({"message": "菜品数据未发生变化", "item": existing_item}), 200
-        else:
-            app.logger.error(f"管理员 {current_admin_user['username']} 更新菜品ID: {item_id} 时发生数据库错误。")
-            return jsonify({"error": "更新菜品失败，数据库操作错误"}), 500
+            try:
+                category_id = int(category_id_str)
+                if not db.get_category_by_id(category_id):
+                    return jsonify({"error": f"分类ID {category_id} 不存在"}), 404
+            except (ValueError, TypeError):
+                return jsonify({"error": "分类ID格式无效或未提供", "message": "分类ID必须是整数。"}), 400
+
+            if not isinstance(is_available, bool):
+                 if str(is_available).lower() == 'true':
+                     is_available = True
+                 elif str(is_available).lower() == 'false':
+                     is_available = False
+                 else:
+                    return jsonify({"error": "is_available 字段必须是布尔值 (true/false)"}), 400
+
+            affected_rows = db.update_menu_item(item_id, name, description, price, category_id, image_url, is_available)
+
+            if affected_rows is not None and affected_rows > 0:
+                app.logger.info(f"管理员 {current_admin_user['username']} 成功更新菜品ID: {item_id}")
+                updated_item = db.get_menu_item_by_id(item_id)
+                menu_index.upsert(updated_item)
+                _mark_menu_changed()
+                return jsonify({"message": "菜品更新成功", "item": updated_item}), 200
+            elif affected_rows == 0:
+                app.logger.warning(f"管理员 {current_admin_user['username']} 更新菜品ID: {item_id} 时，数据未发生变化或未找到。")
+                return jsonify({"message": "菜品数据未发生变化", "item": existing_item}), 200
+            else:
+                app.logger.error(f"管理员 {current_admin_user['username']} 更新菜品ID: {item_id} 时发生数据库错误。")
+                return jsonify({"error": "更新菜品失败，数据库操作错误"}), 500
 
     except Exception as e:
         app.logger.error(f"管理员 {current_admin_user.get('username', 'N/A')} 更新菜品ID {item_id} 时发生服务器内部错误: {e}", exc_info=True)
@@ -275,54 +672,90 @@ def admin_update_menu_item(current_admin_user, item_id):
 def admin_delete_menu_item(current_admin_user, item_id):
     """管理员删除菜品"""
     try:
-        item = db.get_menu_item_by_id(item_id)
-        if not item:
-            app.logger.warning(f"管理员 {current_admin_user['username']} 尝试删除不存在的菜品ID: {item_id}")
-            return jsonify({"error": "菜品未找到"}), 404
-
-        deleted_rows = db.delete_menu_item(item_id)
-
-        if deleted_rows == -1:
-            app.logger.warning(f"管理员 {current_admin_user['username']} 尝试删除的菜品ID {item_id} 因被订单引用而无法删除")
-            return jsonify({"error": "无法删除菜品，该菜品可能已被订单引用。"}), 409
-        elif deleted_rows and deleted_rows > 0:
-            app.logger.info(f"管理员 {current_admin_user['username']} 成功删除菜品ID: {item_id}")
-            return jsonify({"message": f"菜品ID {item_id} 已成功删除"}), 200
-        elif deleted_rows == 0:
-            app.logger.warning(f"管理员 {current_admin_user['username']} 尝试删除菜品ID {item_id}，但未找到或未删除任何行")
-            return jsonify({"error": "删除菜品失败，菜品可能已被删除或不存在"}), 404
-        else:
-            app.logger.error(f"管理员 {current_admin_user['username']} 删除菜品ID {item_id} 时发生未知数据库错误")
-            return jsonify({"error": "删除菜品时发生未知错误"}), 500
+        with db.transaction():  # 存在性检查和删除在同一个事务中
+            item = db.get_menu_item_by_id(item_id)
+            if not item:
+                app.logger.warning(f"管理员 {current_admin_user['username']} 尝试删除不存在的菜品ID: {item_id}")
+                return jsonify({"error": "菜品未找到"}), 404
+
+            deleted_rows = db.delete_menu_item(item_id)
+
+            if deleted_rows == -1:
+                app.logger.warning(f"管理员 {current_admin_user['username']} 尝试删除的菜品ID {item_id} 因被订单引用而无法删除")
+                return jsonify({"error": "无法删除菜品，该菜品可能已被订单引用。"}), 409
+            elif deleted_rows and deleted_rows > 0:
+                app.logger.info(f"管理员 {current_admin_user['username']} 成功删除菜品ID: {item_id}")
+                menu_index.remove(item_id)
+                _mark_menu_changed()
+                return jsonify({"message": f"菜品ID {item_id} 已成功删除"}), 200
+            elif deleted_rows == 0:
+                app.logger.warning(f"管理员 {current_admin_user['username']} 尝试删除菜品ID {item_id}，但未找到或未删除任何行")
+                return jsonify({"error": "删除菜品失败，菜品可能已被删除或不存在"}), 404
+            else:
+                app.logger.error(f"管理员 {current_admin_user['username']} 删除菜品ID {item_id} 时发生未知数据库错误")
+                return jsonify({"error": "删除菜品时发生未知错误"}), 500
 
     except Exception as e:
         app.logger.error(f"管理员 {current_admin_user.get('username', 'N/A')} 删除菜品ID {item_id} 时发生服务器错误: {e}", exc_info=True)
         return jsonify({"error": "删除菜品时发生服务器错误", "message": str(e)}), 500
 
+@app.route('/api/admin/menu/<int:item_id>/stock', methods=['PUT'])
+@admin_required
+def admin_set_menu_item_stock(current_admin_user, item_id):
+    """管理员设置菜品库存 (stock 为 null 表示不限量)"""
+    data = request.get_json()
+    if not data or 'stock' not in data:
+        return jsonify({"error": "缺少库存 (stock) 参数"}), 400
+
+    stock = data['stock']
+    if stock is not None:
+        try:
+            stock = int(stock)
+            if stock < 0:
+                raise ValueError("库存不能为负数")
+        except (ValueError, TypeError):
+            return jsonify({"error": "库存格式无效", "message": "库存必须是非负整数或 null。"}), 400
+
+    try:
+        with db.transaction():  # 存在性检查、设置库存和重新查询在同一个事务中
+            if not db.get_menu_item_by_id(item_id):
+                return jsonify({"error": "菜品未找到"}), 404
+
+            if db.set_menu_item_stock(item_id, stock):
+                app.logger.info(f"管理员 {current_admin_user['username']} 将菜品ID {item_id} 的库存设置为 {stock}")
+                updated_item = db.get_menu_item_by_id(item_id)
+                menu_index.upsert(updated_item)
+                _mark_menu_changed()
+                return jsonify({"message": "库存更新成功", "item": updated_item,
+                                "stock": db.get_menu_item_stock(item_id)}), 200
+            return jsonify({"error": "库存更新失败"}), 500
+    except Exception as e:
+        app.logger.error(f"管理员 {current_admin_user['username']} 设置菜品ID {item_id} 库存失败: {e}", exc_info=True)
+        return jsonify({"error": "设置库存时发生服务器错误", "message": str(e)}), 500
+
 # == 订单API ==
 @app.route('/api/orders/<int:order_id>/pay', methods=['POST'])
 @token_required
+@idempotent
 def pay_for_order(current_user, order_id):
-    """用户支付订单"""
+    """用户支付订单 (一条条件更新完成所有权校验、状态校验和支付时间记录)"""
     try:
-        order = db.get_order_details_by_id(order_id)
-        if not order:
-            return jsonify({"error": "订单未找到"}), 404
-
-        if order.get('user_id') != current_user['id']:
-            return jsonify({"error": "无权操作此订单"}), 403
+        result, current = db.transition_order(order_id, 'payment_status', 'paid', user_id=current_user['id'])
 
-        if order.get('payment_status') == 'paid':
-            return jsonify({"message": "此订单已支付，无需重复操作"}), 200
-
-        success = db.update_order_payment_status(order_id, 'paid')
-
-        if success:
+        if result == order_states.APPLIED:
             app.logger.info(f"用户 {current_user['username']} (ID: {current_user['id']}) 成功支付订单 {order_id}")
             return jsonify({"message": f"订单 #{order_id} 支付成功"}), 200
-        else:
-            app.logger.error(f"用户 {current_user['username']} 支付订单 {order_id} 时数据库更新失败")
-            return jsonify({"error": "支付失败，请稍后再试"}), 500
+        if result == order_states.UNCHANGED:
+            return jsonify({"message": "此订单已支付，无需重复操作"}), 200
+        if result == order_states.NOT_FOUND:
+            return jsonify({"error": "订单未找到"}), 404
+        if result == order_states.FORBIDDEN:
+            return jsonify({"error": "无权操作此订单"}), 403
+        if result == order_states.INVALID:
+            return jsonify({"error": "订单当前状态不允许支付", "payment_status": current}), 409
+
+        app.logger.error(f"用户 {current_user['username']} 支付订单 {order_id} 时数据库更新失败")
+        return jsonify({"error": "支付失败，请稍后再试"}), 500
 
     except Exception as e:
         app.logger.error(f"支付订单 {order_id} 时发生服务器错误 (用户: {current_user['username']}): {e}", exc_info=True)
@@ -330,6 +763,7 @@ def pay_for_order(current_user, order_id):
 
 @app.route('/api/orders', methods=['POST'])
 @token_required 
+@idempotent
 def place_order(current_user):
     """创建新订单 (用户必须登录)"""
     try:
@@ -342,50 +776,76 @@ def place_order(current_user):
         if not isinstance(order_items_data_frontend, list) or not order_items_data_frontend:
             return jsonify({"error": "订单项目(items)必须是非空列表"}), 400
 
-        detailed_items_for_db = []
-        total_amount = 0
-        for item_data in order_items_data_frontend:
-            if not isinstance(item_data, dict) or not all(k in item_data for k in ('menu_item_id', 'quantity')):
-                return jsonify({"error": "订单项目中缺少 menu_item_id 或 quantity"}), 400
-            
-            menu_item_id = item_data['menu_item_id']
-            quantity = item_data['quantity']
-            special_requests = item_data.get('special_requests')
+        # 排队模式下从内存中的菜品索引校验菜品和价格，确认下单不访问数据库
+        lookup_menu_item = menu_index.get_item if order_intake.enabled else db.get_menu_item_by_id
 
-            try:
-                quantity = int(quantity)
-                if quantity <= 0:
-                     return jsonify({"error": f"菜品ID {menu_item_id} 的数量必须为正整数"}), 400
-            except ValueError:
-                return jsonify({"error": f"菜品ID {menu_item_id} 的数量格式无效"}), 400
-
-            menu_item_db = db.get_menu_item_by_id(menu_item_id) 
-            if not menu_item_db or not menu_item_db['is_available']:
-                return jsonify({"error": f"菜品 '{menu_item_db.get('name', menu_item_id)}' 未找到或不可用"}), 404
+        with db.transaction():  # 逐个校验菜品共用一个连接 (不包含下单本身，create_order 自行管理事务)
+            detailed_items_for_db = []
+            total_amount = 0
+            for item_data in order_items_data_frontend:
+                if not isinstance(item_data, dict) or not all(k in item_data for k in ('menu_item_id', 'quantity')):
+                    return jsonify({"error": "订单项目中缺少 menu_item_id 或 quantity"}), 400
+            
+                menu_item_id = item_data['menu_item_id']
+                quantity = item_data['quantity']
+                special_requests = item_data.get('special_requests')
+
+                try:
+                    quantity = int(quantity)
+                    if quantity <= 0:
+                         return jsonify({"error": f"菜品ID {menu_item_id} 的数量必须为正整数"}), 400
+                except ValueError:
+                    return jsonify({"error": f"菜品ID {menu_item_id} 的数量格式无效"}), 400
+
+                menu_item_db = lookup_menu_item(menu_item_id)
+                if not menu_item_db or not menu_item_db['is_available']:
+                    item_label = menu_item_db['name'] if menu_item_db else menu_item_id
+                    return jsonify({"error": f"菜品 '{item_label}' 未找到或不可用"}), 404
             
-            unit_price = menu_item_db['price'] 
-            subtotal = unit_price * quantity
-            total_amount += subtotal
+                unit_price = menu_item_db['price'] 
+                subtotal = unit_price * quantity
+                total_amount += subtotal
             
-            detailed_items_for_db.append({
-                'menu_item_id': menu_item_id,
-                'quantity': quantity,
-                'unit_price': unit_price,
-                'subtotal': subtotal,
-                'special_requests': special_requests
-            })
-
-        order_id = db.create_order(
-            user_id=current_user['id'], 
-            customer_name=current_user.get('full_name', current_user['username']), 
-            total_amount=total_amount,
-            items_data=detailed_items_for_db,
-            payment_method=data.get('payment_method'),
-            delivery_address=data.get('delivery_address'),
-            notes=data.get('notes')
-        )
+                detailed_items_for_db.append({
+                    'menu_item_id': menu_item_id,
+                    'quantity': quantity,
+                    'unit_price': unit_price,
+                    'subtotal': subtotal,
+                    'special_requests': special_requests
+                })
+
+        customer_name = current_user.get('full_name') or current_user['username']
+        if order_intake.enabled:
+            order_ref = order_intake.submit(
+                user_id=current_user['id'],
+                customer_name=customer_name,
+                total_amount=total_amount,
+                items_data=detailed_items_for_db,
+                payment_method=data.get('payment_method'),
+                delivery_address=data.get('delivery_address'),
+                notes=data.get('notes')
+            )
+            app.logger.info(f"用户 {current_user['username']} (ID: {current_user['id']}) 的订单已排队, 参考号: {order_ref}")
+            return jsonify({"message": "订单已受理，正在排队处理", "order_ref": order_ref,
+                            "status": "queued", "total_amount": total_amount}), 202
+
+        try:
+            order_id = db.create_order(
+                user_id=current_user['id'], 
+                customer_name=customer_name,
+                total_amount=total_amount,
+                items_data=detailed_items_for_db,
+                payment_method=data.get('payment_method'),
+                delivery_address=data.get('delivery_address'),
+                notes=data.get('notes')
+            )
+        except db.InsufficientStockError as se:
+            app.logger.info(f"用户 {current_user['username']} 下单失败，菜品ID {se.menu_item_id} 库存不足")
+            return jsonify({"error": "菜品库存不足", "menu_item_id": se.menu_item_id,
+                            "available": se.available}), 409
 
         if order_id:
+            recommender.record_order(order_id, [item['menu_item_id'] for item in detailed_items_for_db])
             app.logger.info(f"用户 {current_user['username']} (ID: {current_user['id']}) 创建订单成功, 订单ID: {order_id}")
             return jsonify({"message": "订单创建成功", "order_id": order_id, "total_amount": total_amount}), 201
         else:
@@ -406,12 +866,53 @@ def get_my_orders(current_user):
         if per_page < 1: per_page = 1
         if per_page > 100: per_page = 100 
 
-        orders_data = db.get_orders_by_user_id(current_user['id'], page, per_page)
+        try:
+            fields = db.parse_fields_param(request.args.get('fields'), db.USER_ORDER_FIELDS)
+        except ValueError as ve:
+            return jsonify({"error": "fields 参数无效", "message": str(ve)}), 400
+
+        with db.transaction():  # 订单列表和总数在同一个快照中查询
+            orders_data = db.get_orders_by_user_id(current_user['id'], page, per_page, fields=fields)
+        if page == 1:
+            # 排队模式下尚未写入数据库的订单单独列出
+            orders_data['queued_orders'] = order_intake.queued_orders_for_user(current_user['id'])
         return jsonify(orders_data), 200
     except Exception as e:
         app.logger.error(f"用户 {current_user['username']} 获取历史订单失败: {e}", exc_info=True)
         return jsonify({"error": "获取历史订单失败", "message": str(e)}), 500
 
+@app.route('/api/orders/details', methods=['GET'])
+@token_required
+def get_orders_details(current_user):
+    """
+    批量获取订单详情：ids 为逗号分隔的订单ID (最多 MAX_ORDER_DETAILS_BATCH 个)。
+    普通用户只能查看自己的订单，其他人的订单列在 forbidden 中；不存在的订单列在 not_found 中。
+    """
+    try:
+        raw_ids = [i.strip() for i in request.args.get('ids', '').split(',') if i.strip()]
+        if not raw_ids:
+            return jsonify({"error": "缺少订单ID参数 (ids)"}), 400
+        if not all(i.isdigit() for i in raw_ids):
+            return jsonify({"error": "订单ID必须为正整数"}), 400
+        order_ids = list(dict.fromkeys(int(i) for i in raw_ids))
+        if len(order_ids) > db.MAX_ORDER_DETAILS_BATCH:
+            return jsonify({"error": f"一次最多查询 {db.MAX_ORDER_DETAILS_BATCH} 个订单"}), 400
+
+        found = db.get_order_details_by_ids(order_ids)
+        orders, forbidden, not_found = [], [], []
+        for order_id in order_ids:
+            order = found.get(order_id)
+            if not order:
+                not_found.append(order_id)
+            elif current_user['role'] != 'admin' and order.get('user_id') != current_user['id']:
+                forbidden.append(order_id)
+            else:
+                orders.append(order)
+        return jsonify({"orders": orders, "not_found": not_found, "forbidden": forbidden}), 200
+    except Exception as e:
+        app.logger.error(f"批量获取订单详情失败 (请求者: {current_user['username']}): {e}", exc_info=True)
+        return jsonify({"error": "批量获取订单详情失败", "message": str(e)}), 500
+
 @app.route('/api/orders/<int:order_id>', methods=['GET'])
 @token_required 
 def get_single_order(current_user, order_id):
@@ -429,11 +930,78 @@ def get_single_order(current_user, order_id):
         app.logger.error(f"获取订单 {order_id} 失败 (请求者: {current_user['username']}): {e}", exc_info=True)
         return jsonify({"error": f"获取订单 {order_id} 失败", "message": str(e)}), 500
 
+@app.route('/api/orders/queued/<string:order_ref>', methods=['GET'])
+@token_required
+def get_queued_order(current_user, order_ref):
+    """按参考号查询排队订单：queued (排队中) / committed (已写入，附订单详情) / rejected (被拒绝)"""
+    try:
+        intake_status = order_intake.status(order_ref)
+        if not intake_status or intake_status.get('tenant_id') != db.current_tenant_id():
+            return jsonify({"error": "订单未找到"}), 404
+
+        if intake_status['status'] == 'committed':
+            order = db.get_order_details_by_id(intake_status['order_id'])
+            if not order:
+                return jsonify({"error": "订单未找到"}), 404
+            owner_id = order.get('user_id')
+            intake_status = {**intake_status, "order": order}
+        else:
+            owner_id = intake_status.get('user_id')
+
+        if current_user['role'] != 'admin' and owner_id != current_user['id']:
+            return jsonify({"error": "无权访问此订单"}), 403
+        return jsonify(intake_status), 200
+    except Exception as e:
+        app.logger.error(f"查询排队订单 {order_ref} 失败 (请求者: {current_user['username']}): {e}", exc_info=True)
+        return jsonify({"error": "查询排队订单失败", "message": str(e)}), 500
+
 # == 管理员订单管理API ==
+ORDER_SEARCH_PARAMS = ('customer', 'phone', 'date_from', 'date_to', 'min_amount', 'max_amount', 'payment_status')
+
+
+def _parse_search_time(value, end_of_range=False):
+    """解析 YYYY-MM-DD 或 ISO 时间；只给日期的结束时间包含当天 (返回次日零点，作为不含的上界)"""
+    if len(value) == 10:
+        day = datetime.strptime(value, '%Y-%m-%d')
+        return day + timedelta(days=1) if end_of_range else day
+    return datetime.fromisoformat(value)
+
+
+def _parse_order_search_criteria(args):
+    """把查询参数转换为 db.search_orders_admin 的搜索条件，参数非法时抛出 ValueError"""
+    criteria = {}
+    if args.get('customer', '').strip():
+        criteria['customer'] = args['customer'].strip()
+    if args.get('phone', '').strip():
+        criteria['phone'] = args['phone'].strip()
+    if args.get('date_from'):
+        criteria['date_from'] = _parse_search_time(args['date_from'])
+    if args.get('date_to'):
+        criteria['date_to'] = _parse_search_time(args['date_to'], end_of_range=True)
+    for key in ('min_amount', 'max_amount'):
+        if args.get(key):
+            criteria[key] = float(args[key])
+    payment_status = args.get('payment_status')
+    if payment_status:
+        if payment_status not in order_states.PAYMENT_STATUSES:
+            raise ValueError(f"无效的支付状态: {payment_status}. 合法状态为: {', '.join(order_states.PAYMENT_STATUSES)}")
+        criteria['payment_status'] = payment_status
+    status = args.get('status')
+    if status:
+        if status not in order_states.ORDER_STATUSES:
+            raise ValueError(f"无效的订单状态: {status}. 合法状态为: {', '.join(order_states.ORDER_STATUSES)}")
+        criteria['status'] = status
+    return criteria
+
+
 @app.route('/api/admin/orders', methods=['GET'])
 @admin_required
 def admin_get_all_orders(current_admin_user):
-    """管理员获取所有订单 (分页, 可筛选, 可排序)"""
+    """
+    管理员获取所有订单 (分页, 可筛选, 可排序)。
+    带有 customer / phone / date_from / date_to / min_amount / max_amount / payment_status 任一参数时进入搜索模式，
+    按下单时间倒序返回相同的分页结构；explain=true 时附带执行计划。
+    """
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -446,7 +1014,28 @@ def admin_get_all_orders(current_admin_user):
         if per_page < 1: per_page = 1
         if per_page > 100: per_page = 100
 
-        orders_data = db.get_all_orders_admin(page, per_page, status_filter, user_id_filter, sort_by, sort_order)
+        try:
+            fields = db.parse_fields_param(request.args.get('fields'), db.ADMIN_ORDER_FIELDS)
+        except ValueError as ve:
+            return jsonify({"error": "fields 参数无效", "message": str(ve)}), 400
+
+        with db.transaction():  # 搜索涉及的用户查询、计数和分页查询共用一个连接
+            if any(request.args.get(param) for param in ORDER_SEARCH_PARAMS):
+                try:
+                    criteria = _parse_order_search_criteria(request.args)
+                except ValueError as ve:
+                    return jsonify({"error": "搜索参数无效", "message": str(ve)}), 400
+                explain = request.args.get('explain', 'false').lower() == 'true'
+                try:
+                    orders_data = db.search_orders_admin(criteria, page, per_page, fields=fields, explain=explain)
+                except ValueError as ve:
+                    return jsonify({"error": "搜索条件过于宽泛", "message": str(ve)}), 400
+                if orders_data is None:
+                    return jsonify({"error": "搜索订单失败，数据库错误"}), 500
+                return jsonify(orders_data), 200
+
+            orders_data = db.get_all_orders_admin(page, per_page, status_filter, user_id_filter, sort_by, sort_order,
+                                                  fields=fields)
         return jsonify(orders_data), 200
     except Exception as e:
         app.logger.error(f"管理员 {current_admin_user['username']} 获取所有订单失败: {e}", exc_info=True)
@@ -461,21 +1050,203 @@ def admin_update_order_status(current_admin_user, order_id):
     if not new_status:
         return jsonify({"error": "缺少新状态 (status) 参数"}), 400
     
-    valid_statuses = ['pending', 'confirmed', 'preparing', 'completed', 'cancelled', 'delivered']
-    if new_status not in valid_statuses:
-        return jsonify({"error": f"无效的订单状态: {new_status}. 合法状态为: {', '.join(valid_statuses)}"}), 400
+    if new_status not in order_states.ORDER_STATUSES:
+        return jsonify({"error": f"无效的订单状态: {new_status}. 合法状态为: {', '.join(order_states.ORDER_STATUSES)}"}), 400
 
     try:
-        success = db.update_order_status_admin(order_id, new_status, current_admin_user['id'])
-        if success:
+        result, current = db.transition_order(order_id, 'status', new_status, changed_by_user_id=current_admin_user['id'])
+        if result == order_states.APPLIED and new_status == 'cancelled':
+            recommender.record_cancellation(order_id)
+        if result in (order_states.APPLIED, order_states.UNCHANGED):
             app.logger.info(f"管理员 {current_admin_user['username']} 更新订单 {order_id} 状态为 {new_status} 成功")
             return jsonify({"message": f"订单 {order_id} 状态已更新为 {new_status}"}), 200
-        else:
-            return jsonify({"error": f"更新订单 {order_id} 状态失败，订单可能不存在或数据库错误"}), 404 
+        if result == order_states.NOT_FOUND:
+            return jsonify({"error": f"订单 {order_id} 不存在"}), 404
+        if result == order_states.INVALID:
+            allowed = order_states.ORDER_STATUS_TRANSITIONS.get(current, ())
+            return jsonify({"error": f"订单 {order_id} 当前状态为 {current}，不能修改为 {new_status}",
+                            "status": current, "allowed_statuses": list(allowed)}), 409
+        return jsonify({"error": f"更新订单 {order_id} 状态失败，数据库错误"}), 500
     except Exception as e:
         app.logger.error(f"管理员 {current_admin_user['username']} 更新订单 {order_id} 状态失败: {e}", exc_info=True)
         return jsonify({"error": "更新订单状态时发生服务器错误", "message": str(e)}), 500
 
+@app.route('/api/admin/orders/archive', methods=['POST'])
+@admin_required
+def admin_archive_orders(current_admin_user):
+    """管理员手动触发一次历史订单归档 (可选参数 older_than_days)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        older_than_days = int(data.get('older_than_days', archiver.ARCHIVE_AFTER_DAYS))
+        if older_than_days < 1:
+            raise ValueError("older_than_days 必须为正整数")
+    except (ValueError, TypeError) as ve:
+        return jsonify({"error": "归档参数无效", "message": str(ve)}), 400
+
+    try:
+        archived = archiver.run_archive(older_than_days=older_than_days)
+        app.logger.info(f"管理员 {current_admin_user['username']} 手动归档了 {archived} 个历史订单")
+        return jsonify({"message": "归档完成", "archived_orders": archived}), 200
+    except Exception as e:
+        app.logger.error(f"管理员 {current_admin_user['username']} 归档历史订单失败: {e}", exc_info=True)
+        return jsonify({"error": "归档历史订单时发生服务器错误", "message": str(e)}), 500
+
+@app.route('/api/admin/write-behind/stats', methods=['GET'])
+@admin_required
+def admin_write_behind_stats(current_admin_user):
+    """管理员查看写后缓冲的队列深度和刷新耗时"""
+    return jsonify(write_behind.write_buffer.stats()), 200
+
+
+@app.route('/api/admin/order-intake', methods=['GET'])
+@admin_required
+def admin_order_intake_stats(current_admin_user):
+    """管理员查看排队下单模式的开关状态、队列深度和提交统计"""
+    return jsonify(order_intake.stats()), 200
+
+
+@app.route('/api/admin/order-intake', methods=['PUT'])
+@admin_required
+def admin_set_order_intake(current_admin_user):
+    """管理员开启/关闭排队下单模式 (对所有工作进程生效；关闭后已排队的订单仍会继续提交)"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('enabled'), bool):
+        return jsonify({"error": "缺少或无效的 enabled 参数 (true/false)"}), 400
+    try:
+        order_intake.enabled = data['enabled']
+        app.logger.info(f"管理员 {current_admin_user['username']} {'开启' if data['enabled'] else '关闭'}了排队下单模式")
+        return jsonify(order_intake.stats()), 200
+    except Exception as e:
+        app.logger.error(f"管理员 {current_admin_user['username']} 切换排队下单模式失败: {e}", exc_info=True)
+        return jsonify({"error": "切换排队下单模式失败", "message": str(e)}), 500
+
+
+@app.route('/api/admin/llm/stats', methods=['GET'])
+@admin_required
+def admin_llm_stats(current_admin_user):
+    """管理员查看餐谱建议的平均提示词大小和模型耗时 (候选筛选 vs 完整菜单)，以及熔断器和舱壁状态"""
+    return jsonify({**menu_prefilter.get_stats(), **llm.get_resilience_stats()}), 200
+
+
+@app.route('/api/admin/recommender/stats', methods=['GET'])
+@admin_required
+def admin_recommender_stats(current_admin_user):
+    """管理员查看各餐厅推荐模型的规模 (订单数、菜品数、配对数)"""
+    return jsonify(recommender.get_stats()), 200
+
+
+@app.route('/api/admin/logging/stats', methods=['GET'])
+@admin_required
+def admin_logging_stats(current_admin_user):
+    """管理员查看日志管道的队列深度和丢弃计数"""
+    return jsonify(log_config.get_logging_stats()), 200
+
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@admin_required
+def admin_list_profiles(current_admin_user):
+    """管理员查看剖析开关状态和环形缓冲区中的剖析结果 (最新的在前)"""
+    return jsonify({"config": profiler.request_profiler.config(),
+                    "profiles": profiler.request_profiler.list()}), 200
+
+
+@app.route('/api/admin/profiles', methods=['PUT'])
+@admin_required
+def admin_configure_profiles(current_admin_user):
+    """
+    管理员开启/关闭按需剖析。
+    请求体: {"enabled": true, "sample_rate": 0.01, "path_prefix": "/api/orders", "duration_seconds": 900}
+    开启期间带 X-Profile 请求头的请求一定被剖析，其余请求按 sample_rate 抽样；到期后自动关闭
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('enabled'), bool):
+        return jsonify({"error": "缺少或无效的 enabled 参数 (true/false)"}), 400
+    try:
+        sample_rate = float(data.get('sample_rate', 0))
+        duration_seconds = int(data.get('duration_seconds', profiler.PROFILE_DEFAULT_ARM_SECONDS))
+        profiler.request_profiler.configure(data['enabled'], sample_rate=sample_rate,
+                                            path_prefix=data.get('path_prefix'), arm_seconds=duration_seconds)
+    except (ValueError, TypeError) as ve:
+        return jsonify({"error": "剖析参数无效", "message": str(ve)}), 400
+    app.logger.info(f"管理员 {current_admin_user['username']} {'开启' if data['enabled'] else '关闭'}了按需剖析: "
+                    f"{profiler.request_profiler.config()}")
+    return jsonify(profiler.request_profiler.config()), 200
+
+
+@app.route('/api/admin/profiles', methods=['DELETE'])
+@admin_required
+def admin_clear_profiles(current_admin_user):
+    """管理员清空环形缓冲区中的剖析结果"""
+    profiler.request_profiler.clear()
+    return jsonify({"message": "剖析结果已清空"}), 200
+
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@admin_required
+def admin_get_profile(current_admin_user, profile_id):
+    """管理员查看单个剖析结果；?format=collapsed 时下载折叠栈文本 (可用 flamegraph.pl / speedscope 生成火焰图)"""
+    profile = profiler.request_profiler.get(profile_id)
+    if profile is None:
+        return jsonify({"message": "剖析结果不存在或已被覆盖"}), 404
+    if request.args.get('format') == 'collapsed':
+        return Response(profile.collapsed(), mimetype='text/plain',
+                        headers={'Content-Disposition': f'attachment; filename=profile-{profile.id}.collapsed'})
+    return jsonify(profile.to_dict()), 200
+
+
+# == 集团管理API (跨餐厅汇总) ==
+def _parse_group_tenant_ids():
+    """解析可选的 tenant_ids 参数 (逗号分隔)，为空时表示所有餐厅"""
+    raw = request.args.get('tenant_ids')
+    if not raw:
+        return None
+    tenant_ids = [int(part) for part in raw.split(',') if part.strip()]
+    unknown = [tid for tid in tenant_ids if tid not in db.all_tenant_ids()]
+    if unknown:
+        raise ValueError(f"未知的餐厅ID: {', '.join(map(str, unknown))}")
+    return tenant_ids
+
+@app.route('/api/admin/group/orders', methods=['GET'])
+@group_admin_required
+def group_get_orders(current_admin_user):
+    """集团管理员跨餐厅查看订单 (各分片并行查询后合并排序分页)"""
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 10, type=int)
+        status_filter = request.args.get('status')
+        sort_by = request.args.get('sort_by', 'order_time')
+        sort_order = request.args.get('sort_order', 'DESC')
+
+        if page < 1: page = 1
+        if per_page < 1: per_page = 1
+        if per_page > 100: per_page = 100
+
+        try:
+            tenant_ids = _parse_group_tenant_ids()
+        except ValueError as ve:
+            return jsonify({"error": "tenant_ids 参数无效", "message": str(ve)}), 400
+
+        orders_data = db.get_group_orders_admin(page, per_page, status_filter, sort_by, sort_order,
+                                                tenant_ids=tenant_ids)
+        return jsonify(orders_data), 200
+    except Exception as e:
+        app.logger.error(f"集团管理员 {current_admin_user['username']} 获取跨餐厅订单失败: {e}", exc_info=True)
+        return jsonify({"error": "获取跨餐厅订单失败", "message": str(e)}), 500
+
+@app.route('/api/admin/group/summary', methods=['GET'])
+@group_admin_required
+def group_get_summary(current_admin_user):
+    """集团管理员查看各餐厅的订单数与销售额汇总"""
+    try:
+        try:
+            tenant_ids = _parse_group_tenant_ids()
+        except ValueError as ve:
+            return jsonify({"error": "tenant_ids 参数无效", "message": str(ve)}), 400
+        return jsonify(db.get_group_sales_summary(tenant_ids)), 200
+    except Exception as e:
+        app.logger.error(f"集团管理员 {current_admin_user['username']} 获取汇总数据失败: {e}", exc_info=True)
+        return jsonify({"error": "获取集团汇总数据失败", "message": str(e)}), 500
+
 
 # ============================================
 # == 管理员用户管理API (User Management) ==
@@ -518,15 +1289,19 @@ def admin_update_user_role(current_admin_user, user_id):
         return jsonify({"error": "无法修改自己的角色"}), 403
 
     try:
-        if not db.get_user_by_id(user_id):
-            return jsonify({"error": "用户未找到"}), 404
+        with db.transaction():  # 存在性检查、修改角色和吊销令牌在同一个事务中
+            if not db.get_user_by_id(user_id):
+                return jsonify({"error": "用户未找到"}), 404
         
-        success = db.update_user_role(user_id, new_role)
-        if success:
-            app.logger.info(f"管理员 {current_admin_user['username']} 将用户 {user_id} 的角色修改为 {new_role}")
-            return jsonify({"message": "用户角色更新成功"}), 200
-        else:
-            return jsonify({"error": "用户角色更新失败"}), 500
+            success = db.update_user_role(user_id, new_role)
+            if success:
+                # 旧令牌中携带的是旧角色，全部吊销，用户需重新登录
+                if not auth_tokens.revoke_all_user_tokens(user_id):
+                    app.logger.error(f"用户 {user_id} 角色已修改，但吊销其已签发的令牌失败")
+                app.logger.info(f"管理员 {current_admin_user['username']} 将用户 {user_id} 的角色修改为 {new_role}")
+                return jsonify({"message": "用户角色更新成功"}), 200
+            else:
+                return jsonify({"error": "用户角色更新失败"}), 500
     except Exception as e:
         app.logger.error(f"管理员 {current_admin_user['username']} 修改用户 {user_id} 角色失败: {e}", exc_info=True)
         return jsonify({"error": "更新角色时发生服务器错误", "message": str(e)}), 500
@@ -573,13 +1348,15 @@ def admin_create_category(current_admin_user):
     display_order = data.get('display_order', 0)
 
     try:
-        category_id = db.create_category(name, description, display_order)
-        if category_id:
-            app.logger.info(f"管理员 {current_admin_user['username']} 创建新分类 '{name}' (ID: {category_id})")
-            new_category = db.get_category_by_id(category_id)
-            return jsonify({"message": "分类创建成功", "category": new_category}), 201
-        else:
-            return jsonify({"error": "创建分类失败"}), 500
+        with db.transaction():  # 插入和重新查询在同一个事务中
+            category_id = db.create_category(name, description, display_order)
+            if category_id:
+                app.logger.info(f"管理员 {current_admin_user['username']} 创建新分类 '{name}' (ID: {category_id})")
+                _mark_menu_changed()
+                new_category = db.get_category_by_id(category_id)
+                return jsonify({"message": "分类创建成功", "category": new_category}), 201
+            else:
+                return jsonify({"error": "创建分类失败"}), 500
     except Exception as e:
         app.logger.error(f"管理员 {current_admin_user['username']} 创建分类失败: {e}", exc_info=True)
         return jsonify({"error": "创建分类时发生服务器错误", "message": str(e)}), 500
@@ -597,13 +1374,16 @@ def admin_update_category(current_admin_user, category_id):
     display_order = data.get('display_order', 0)
 
     try:
-        success = db.update_category(category_id, name, description, display_order)
-        if success:
-            app.logger.info(f"管理员 {current_admin_user['username']} 更新了分类 {category_id}")
-            updated_category = db.get_category_by_id(category_id)
-            return jsonify({"message": "分类更新成功", "category": updated_category}), 200
-        else:
-            return jsonify({"error": "分类更新失败，可能未找到该分类"}), 404
+        with db.transaction():  # 更新和重新查询在同一个事务中
+            success = db.update_category(category_id, name, description, display_order)
+            if success:
+                app.logger.info(f"管理员 {current_admin_user['username']} 更新了分类 {category_id}")
+                menu_index.invalidate() # 分类名称可能变化，下次搜索时重建索引
+                _mark_menu_changed()
+                updated_category = db.get_category_by_id(category_id)
+                return jsonify({"message": "分类更新成功", "category": updated_category}), 200
+            else:
+                return jsonify({"error": "分类更新失败，可能未找到该分类"}), 404
     except Exception as e:
         app.logger.error(f"管理员 {current_admin_user['username']} 更新分类 {category_id} 失败: {e}", exc_info=True)
         return jsonify({"error": "更新分类时发生服务器错误", "message": str(e)}), 500
@@ -619,6 +1399,7 @@ def admin_delete_category(current_admin_user, category_id):
         
         if result_code == 1: # 删除成功
             app.logger.info(f"管理员 {current_admin_user['username']} 删除了分类 {category_id}")
+            _mark_menu_changed()
             return jsonify({"message": "分类删除成功"}), 200
         elif result_code == 0: # 分类不存在
             return jsonify({"error": "分类未找到"}), 404
@@ -635,6 +1416,8 @@ def admin_delete_category(current_admin_user, category_id):
 # == LLM 餐谱建议API ==
 @app.route('/api/recipe-suggestion', methods=['POST'])
 @token_required
+@rate_limited('recipe_suggestion')
+@admission_controlled()
 def get_recipe_suggestion(current_user):
     """
     获取基于当前菜单和用户偏好的智能餐谱建议。
@@ -647,43 +1430,114 @@ def get_recipe_suggestion(current_user):
         if not isinstance(current_dishes, list):
             return jsonify({"error": "current_dishes 必须是一个列表"}), 400
         
-        all_available_items = db.get_all_menu_items(include_unavailable=False)
-        menu_context = [
-            f"{item['name']} (分类: {item['category_name']}, 描述: {item['description'] or '无'})" 
-            for item in all_available_items
-        ]
-        
-        suggestion = llm.get_recipe_suggestion_from_qwen(
-            current_dishes=current_dishes, 
-            preferences=preferences,
-            full_menu=menu_context
-        )
-        return jsonify({"suggestion": suggestion}), 200
+        # 先在本地按口味/分类/搭配规则筛选候选菜品，只把前 K 个以紧凑格式发给模型
+        candidates, full_menu_context = menu_prefilter.select_candidates(current_dishes, preferences)
+        prefiltered = menu_prefilter.PREFILTER_ENABLED
+        menu_context = candidates if prefiltered else full_menu_context
+
+        # 大模型调用带总时限、舱壁和熔断保护；不可用时立即改用本地共现推荐作答
+        started = time.perf_counter()
+        try:
+            suggestion = llm.get_recipe_suggestion_from_qwen(
+                current_dishes=current_dishes, 
+                preferences=preferences,
+                full_menu=menu_context,
+                candidates_only=prefiltered
+            )
+        except llm.LLMUnavailableError as ue:
+            return _recipe_fallback_response(current_dishes, ue.reason)
+        llm_ms = (time.perf_counter() - started) * 1000
+        # 提示词大小只用于统计筛选效果，在模型成功作答后才计算；未启用筛选时完整菜单的提示词就是实际发送的提示词
+        prompt_chars = sum(map(len, llm.build_recipe_prompt(current_dishes, preferences, menu_context, prefiltered)))
+        full_menu_prompt_chars = (sum(map(len, llm.build_recipe_prompt(current_dishes, preferences, full_menu_context)))
+                                  if prefiltered else prompt_chars)
+        menu_prefilter.record_request(prefiltered, prompt_chars, full_menu_prompt_chars, llm_ms)
+        app.logger.info(f"餐谱建议: 提示词 {prompt_chars} 字符 (完整菜单 {full_menu_prompt_chars} 字符), 模型耗时 {llm_ms:.0f} ms",
+                        extra={"prompt_chars": prompt_chars, "full_menu_prompt_chars": full_menu_prompt_chars,
+                               "candidates": len(menu_context), "llm_ms": round(llm_ms, 1)})
+        return jsonify({"suggestion": suggestion, "source": "llm"}), 200
         
     except Exception as e:
         app.logger.error(f"获取餐谱建议失败: {e}", exc_info=True)
         return jsonify({"error": "获取餐谱建议时发生服务器错误", "message": str(e)}), 500
 
+def _recipe_fallback_response(current_dishes, reason):
+    """
+    大模型不可用时，用本地共现推荐生成建议。
+    舱壁已满 (并发的大模型调用已达上限) 且本地也没有可用的推荐时返回 429 + Retry-After，让客户端稍后重试。
+    """
+    app.logger.info(f"餐谱建议改用本地推荐: {reason}", extra={"fallback_reason": reason})
+    try:
+        results, source = recommender.recommend(_resolve_dish_ids(current_dishes))
+    except Exception as e:
+        app.logger.error(f"本地推荐失败: {e}", exc_info=True)
+        results, source = [], None
+    if not results and reason == 'bulkhead_full':
+        return too_many_requests("智能推荐服务繁忙，请稍后再试")
+    if results:
+        lines = [f"- **{item['name']}** ({item.get('category_name') or '未分类'}, ¥{item['price']})" for item in results]
+        heading = "和您已选的菜品经常一起点的有：" if source == 'co_occurrence' else "本店顾客最常点的菜品有："
+        suggestion = heading + "\n" + "\n".join(lines)
+    else:
+        suggestion = "抱歉，暂时无法为您提供搭配建议，请稍后再试。"
+    return jsonify({"suggestion": suggestion, "recommendations": results, "source": source,
+                    "fallback_reason": reason}), 200
+
+
+# --- 健康检查 ---
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """存活检查：进程能处理请求即返回 200，附带冷启动统计"""
+    return jsonify({"status": "ok", "warmup": warmup.get_state()}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """就绪检查：启动预热 (连接池、菜单缓存) 完成后才返回 200，之前返回 503"""
+    state = warmup.get_state()
+    return jsonify({"ready": state['status'] == 'ready', "warmup": state}), 200 if state['status'] == 'ready' else 503
+
+
+# --- 前端页面与静态资源 (由 backend/frontend_assets.py 构建到 frontend_dist/) ---
+def _send_frontend_file(published_path):
+    resolved = frontend_assets.resolve(published_path, request.headers.get('Accept-Encoding'))
+    if resolved is None:
+        return jsonify({"error": "文件未找到"}), 404
+    path, mimetype, encoding, etag, is_asset = resolved
+    max_age = frontend_assets.ASSET_MAX_AGE if is_asset else frontend_assets.HTML_MAX_AGE
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=max_age)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    if is_asset:
+        response.headers['Cache-Control'] = f"public, max-age={max_age}, immutable"
+    else:
+        response.headers['Cache-Control'] = f"public, max-age={max_age}, must-revalidate"
+    return response
 
-if __name__ == '__main__':
-    # 配置日志
-    app_logger = logging.getLogger() 
-    app_logger.setLevel(logging.INFO)
-
-    # 避免重复添加handler
-    if not app_logger.handlers: 
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        
-        file_handler = logging.FileHandler('restaurant_app.log', encoding='utf-8') 
-        file_handler.setLevel(logging.INFO)
+@app.route('/', methods=['GET'])
+def frontend_index():
+    return _send_frontend_file('index.html')
+
+@app.route('/<string:page>.html', methods=['GET'])
+def frontend_page(page):
+    return _send_frontend_file(f"{page}.html")
 
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)')
-        console_handler.setFormatter(formatter)
-        file_handler.setFormatter(formatter)
+@app.route('/assets/<string:filename>', methods=['GET'])
+def frontend_asset(filename):
+    return _send_frontend_file(f"assets/{filename}")
 
-        app_logger.addHandler(console_handler)
-        app_logger.addHandler(file_handler)
+
+warmup.record_import_time(_import_started)
+
+if __name__ == '__main__':
+    # 配置日志：请求线程只入队，JSON 格式化和控制台/文件写入由后台线程完成
+    log_config.configure_logging()
     
+    frontend_assets.build() # 按当前 frontend/ 源文件构建前端资源 (文件名带内容哈希，并预压缩)
+    frontend_assets.reload_manifest()
+    warmup.start() # 后台预热连接池和缓存，完成前 /readyz 返回 503
+    archiver.start_archive_scheduler() # 多进程部署时只有一个进程实际执行归档
+    menu_snapshot.start_refresher() # 多进程部署时只有一个进程实际刷新共享菜单快照
+    order_intake.start() # 恢复并提交上次退出时日志中尚未写入数据库的排队订单
     app.logger.info("餐饮管理系统后端API启动...") 
     app.run(host='0.0.0.0', port=5000, debug=True)
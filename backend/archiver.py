@@ -0,0 +1,137 @@
+# backend/archiver.py
+# 历史订单定时归档任务：把超过保留期的终态订单分批迁移到归档表，使日常查询只扫描近期数据
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl  # 仅 POSIX 可用；不可用时不加文件锁，按单进程运行
+except ImportError:
+    fcntl = None
+
+import backend.database as db
+from backend.db_config import (ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL_SECONDS,
+                               MENU_CHANGES_RETENTION_DAYS)
+
+logger = logging.getLogger(__name__)
+
+# 两批之间的停顿，给在线事务让出锁和IO
+BATCH_PAUSE_SECONDS = 0.2
+
+# 每个工作进程都启动归档线程，只有持有该文件锁的一个进程实际执行归档；其余进程定期尝试接替
+ARCHIVE_LOCK_PATH = os.path.join(tempfile.gettempdir(), 'restaurant-archiver.lock')
+ARCHIVE_TAKEOVER_SECONDS = 60
+
+
+def run_archive(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None):
+    """
+    对每个数据库分片执行一次归档，直到没有可归档的订单 (或达到每个分片 max_batches 批)。
+    返回: 本次共归档的订单数
+    """
+    total = 0
+    batches = 0
+    # 归档按分片进行 (不区分租户)，用分片上的任一租户来路由连接
+    for shard_name, tenant_ids in db.shard_tenants().items():
+        shard_batches = 0
+        with db.use_tenant(tenant_ids[0]):
+            while max_batches is None or shard_batches < max_batches:
+                moved = db.archive_orders_batch(older_than_days, batch_size)
+                if not moved:
+                    break
+                total += moved
+                shard_batches += 1
+                if moved < batch_size:
+                    break
+                time.sleep(BATCH_PAUSE_SECONDS)
+        batches += shard_batches
+    if total:
+        logger.info(f"历史订单归档完成，共迁移 {total} 个订单 ({batches} 批)")
+    return total
+
+
+_scheduler_thread = None
+_stop_event = threading.Event()
+
+
+def prune_menu_changes(retention_days=MENU_CHANGES_RETENTION_DAYS):
+    """清理每家餐厅超过保留期的菜单变更日志，返回删除的行数"""
+    total = 0
+    for tenant_id in db.all_tenant_ids():
+        with db.use_tenant(tenant_id):
+            total += db.prune_menu_changes(retention_days) or 0
+    if total:
+        logger.info(f"已清理 {total} 条过期的菜单变更日志")
+    return total
+
+
+def prune_revoked_access_tokens():
+    """清理各分片上对应访问令牌已过期的吊销记录，返回删除的行数"""
+    total = 0
+    for shard_name, tenant_ids in db.shard_tenants().items():
+        with db.use_tenant(tenant_ids[0]):
+            total += db.prune_revoked_access_tokens() or 0
+    if total:
+        logger.info(f"已清理 {total} 条过期的访问令牌吊销记录")
+    return total
+
+
+def _try_become_runner():
+    """尝试获取归档进程的文件锁 (非阻塞)，成功时返回需要一直持有的锁文件；进程退出时锁自动释放，由其他进程接替"""
+    if fcntl is None:
+        return True
+    lock_file = open(ARCHIVE_LOCK_PATH, 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _scheduler_loop(interval_seconds):
+    runner_lock = None
+    try:
+        while not _stop_event.is_set():
+            if runner_lock is None:
+                runner_lock = _try_become_runner()
+                if runner_lock is None:
+                    _stop_event.wait(min(interval_seconds, ARCHIVE_TAKEOVER_SECONDS))
+                    continue
+                logger.info(f"进程 {os.getpid()} 负责执行定时归档")
+            try:
+                run_archive()
+            except Exception as e:
+                logger.error(f"定时归档任务执行失败: {e}", exc_info=True)
+            try:
+                prune_menu_changes()
+            except Exception as e:
+                logger.error(f"清理菜单变更日志失败: {e}", exc_info=True)
+            try:
+                prune_revoked_access_tokens()
+            except Exception as e:
+                logger.error(f"清理访问令牌吊销记录失败: {e}", exc_info=True)
+            _stop_event.wait(interval_seconds)
+    finally:
+        if runner_lock not in (None, True):
+            runner_lock.close()
+
+
+def start_archive_scheduler(interval_seconds=ARCHIVE_INTERVAL_SECONDS):
+    """
+    启动后台归档线程 (重复调用无副作用)。每个工作进程都启动 (应用在每个工作进程处理首个请求时调用)，
+    但只有拿到文件锁的一个进程实际执行归档，避免多个进程同时迁移同一批订单。
+    """
+    global _scheduler_thread
+    if _scheduler_thread and _scheduler_thread.is_alive():
+        return
+    _stop_event.clear()
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, args=(interval_seconds,),
+                                         name='order-archiver', daemon=True)
+    _scheduler_thread.start()
+
+
+def stop_archive_scheduler():
+    """停止后台归档线程"""
+    _stop_event.set()
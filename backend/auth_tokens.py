@@ -0,0 +1,104 @@
+# backend/auth_tokens.py
+# 访问令牌 / 刷新令牌的签发、轮换与吊销
+# 刷新令牌是随机串，数据库只保存其 SHA-256 (高熵随机串不需要 bcrypt 这类慢哈希)
+# 刷新令牌带有 "<租户ID>." 前缀，刷新时据此路由到该餐厅所在的数据库分片
+import hashlib
+import secrets
+import time
+from datetime import datetime
+
+import jwt
+
+import backend.database as db
+
+
+# 访问令牌的吊销状态保存在数据库中 (各工作进程、各主机一致)，token_required 在查询当前用户时一并读取:
+# - 按 jti 吊销单个访问令牌 (登出)，记录在 revoked_access_tokens 表，访问令牌过期后由归档任务清理
+# - 按用户设置截止时间 users.tokens_valid_after，吊销该时间之前签发的全部访问令牌 (角色变更、检测到令牌重放)
+def revoke_access_token(payload):
+    """吊销单个访问令牌 (登出)，返回是否成功"""
+    return db.revoke_access_token(payload['jti'], payload['user_id'], payload['exp']) is not None
+
+
+def revoke_user_access_tokens(user_id):
+    """吊销当前租户下该用户此前签发的全部访问令牌，返回是否成功"""
+    return db.set_user_tokens_valid_after(user_id, time.time()) is not None
+
+
+def is_revoked(payload, user):
+    """user 为 db.get_user_for_token 的查询结果"""
+    if user.get('token_revoked'):
+        return True
+    cutoff = user.get('tokens_valid_after')
+    return cutoff is not None and payload.get('iat', 0) <= cutoff
+
+
+def hash_refresh_token(refresh_token):
+    return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+
+def refresh_token_tenant(refresh_token):
+    """从刷新令牌前缀解析租户ID；格式不符时返回 None"""
+    tenant_part, sep, _ = refresh_token.partition('.')
+    if not sep or not tenant_part.isdigit():
+        return None
+    return int(tenant_part)
+
+
+def issue_access_token(user, secret_key, expires_delta):
+    """签发访问令牌 (带 jti 和 iat，便于吊销)"""
+    payload = {
+        'user_id': user['id'],
+        'tenant_id': user.get('tenant_id', db.current_tenant_id()),
+        'username': user['username'],
+        'role': user['role'],
+        'jti': secrets.token_hex(16),
+        'iat': time.time(),  # 保留小数部分，按用户吊销时能精确区分吊销前后签发的令牌
+        'exp': datetime.utcnow() + expires_delta,
+    }
+    return jwt.encode(payload, secret_key, algorithm="HS256")
+
+
+def issue_refresh_token(user_id, expires_delta, family_id=None):
+    """签发刷新令牌并保存其哈希 (写入当前租户所在分片)；family_id 为空时开启一个新的令牌族 (新的登录会话)"""
+    refresh_token = f"{db.current_tenant_id()}.{secrets.token_urlsafe(48)}"
+    family_id = family_id or secrets.token_hex(16)
+    expires_at = datetime.now() + expires_delta
+    if not db.create_refresh_token(user_id, hash_refresh_token(refresh_token), family_id, expires_at):
+        return None
+    return refresh_token
+
+
+def rotate_refresh_token(refresh_token, expires_delta):
+    """
+    使用刷新令牌换取新的刷新令牌 (一次性使用)。
+    已使用过的令牌再次出现视为被盗用：吊销整个令牌族以及该用户已签发的访问令牌。
+    返回: (user_id, 新刷新令牌, 错误信息)
+    """
+    record = db.get_refresh_token_by_hash(hash_refresh_token(refresh_token))
+    if not record:
+        return None, None, "刷新令牌无效"
+    if record['revoked_at'] is not None or not db.consume_refresh_token(record['id']):
+        db.revoke_refresh_token_family(record['family_id'])
+        revoke_user_access_tokens(record['user_id'])
+        return None, None, "刷新令牌已被使用，为安全起见该会话已被注销，请重新登录"
+    if record['is_expired']:
+        return None, None, "刷新令牌已过期，请重新登录"
+
+    new_refresh_token = issue_refresh_token(record['user_id'], expires_delta, family_id=record['family_id'])
+    if not new_refresh_token:
+        return None, None, "刷新令牌签发失败"
+    return record['user_id'], new_refresh_token, None
+
+
+def revoke_refresh_token(refresh_token):
+    """登出：吊销该刷新令牌所属的整个令牌族"""
+    record = db.get_refresh_token_by_hash(hash_refresh_token(refresh_token))
+    if record:
+        db.revoke_refresh_token_family(record['family_id'])
+
+
+def revoke_all_user_tokens(user_id):
+    """吊销用户的全部刷新令牌和已签发的访问令牌 (例如角色变更后)，返回是否成功"""
+    refresh_revoked = db.revoke_user_refresh_tokens(user_id) is not None
+    return revoke_user_access_tokens(user_id) and refresh_revoked
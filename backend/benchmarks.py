@@ -0,0 +1,169 @@
+# backend/benchmarks.py
+# 性能对比脚本：直接调用数据库函数，在真实数据库上测量各项优化的效果 (需要已初始化的数据库，见 database_setup.sql)。
+# 用法: python -m backend.benchmarks <场景> [--repeat N]
+#   projection - fields= 字段投影前后的查询耗时与返回体大小 (菜单、管理员订单列表、我的订单)
+#   stock      - 多线程并发抢购少量库存: 检查没有超卖、没有因锁等待/死锁失败的订单，并统计下单耗时
+#   bulk_import - 批量导入 BULK_IMPORT_ROWS 行菜品的耗时 (首次新增、再次修改价格)，结束后删除生成的菜品
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.database as db
+import backend.menu_import as menu_import
+
+# 顾客端菜单网格实际用到的字段
+MENU_GRID_FIELDS = ['id', 'name', 'price', 'category_name', 'image_url']
+
+STOCK_BENCH_QUANTITY = 40   # 每轮抢购的库存
+STOCK_BENCH_BUYERS = 100    # 每轮下单数 (每单 1 份)
+STOCK_BENCH_THREADS = 32    # 并发下单线程数
+
+BULK_IMPORT_ROWS = 1000     # 批量导入压测的行数
+
+
+def _payload_bytes(data):
+    # 与 jsonify 一致：Decimal / datetime 按字符串序列化
+    return len(json.dumps(data, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def _measure(func, repeat):
+    """执行 repeat 次，返回 (耗时中位数毫秒, 最后一次的结果)"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def _compare(label, full, projected, repeat):
+    full_ms, full_result = _measure(full, repeat)
+    projected_ms, projected_result = _measure(projected, repeat)
+    full_bytes, projected_bytes = _payload_bytes(full_result), _payload_bytes(projected_result)
+    print(f"{label}:")
+    print(f"  全部字段: {full_ms:8.2f}ms  {full_bytes:>10} 字节")
+    print(f"  字段投影: {projected_ms:8.2f}ms  {projected_bytes:>10} 字节  "
+          f"(返回体减少 {100 - projected_bytes * 100 / max(full_bytes, 1):.1f}%)")
+
+
+def bench_projection(repeat):
+    _compare("GET /api/menu",
+             lambda: db.get_all_menu_items(include_unavailable=True),
+             lambda: db.get_all_menu_items(include_unavailable=True, fields=MENU_GRID_FIELDS),
+             repeat)
+    _compare("GET /api/admin/orders (每页 100 条)",
+             lambda: db.get_all_orders_admin(1, 100, fields=list(db.ADMIN_ORDER_FIELDS)),
+             lambda: db.get_all_orders_admin(1, 100, fields=['id', 'order_time', 'total_amount', 'status']),
+             repeat)
+    user = db.execute_query("SELECT user_id FROM orders WHERE tenant_id = %s AND user_id IS NOT NULL LIMIT 1",
+                            (db.current_tenant_id(),), fetch_one=True)
+    if user:
+        _compare("GET /api/orders/my (每页 100 条)",
+                 lambda: db.get_orders_by_user_id(user['user_id'], 1, 100, fields=list(db.USER_ORDER_FIELDS)),
+                 lambda: db.get_orders_by_user_id(user['user_id'], 1, 100, fields=['id', 'total_amount', 'status']),
+                 repeat)
+
+
+def _timed_order(item):
+    started = time.perf_counter()
+    try:
+        order_id = db.create_order(item['price'], [{'menu_item_id': item['id'], 'quantity': 1,
+                                                    'unit_price': item['price'], 'subtotal': item['price']}],
+                                   customer_name="库存压测")
+        outcome = 'failed' if order_id is None else order_id
+    except db.InsufficientStockError:
+        outcome = 'insufficient'
+    return outcome, (time.perf_counter() - started) * 1000
+
+
+def bench_stock(repeat):
+    """每轮把一道菜设为 STOCK_BENCH_QUANTITY 份，并发下 STOCK_BENCH_BUYERS 单；结束后删除压测订单并恢复原库存"""
+    item = db.execute_query("SELECT id, price, is_available FROM menu_items WHERE tenant_id = %s ORDER BY id LIMIT 1",
+                            (db.current_tenant_id(),), fetch_one=True)
+    if not item:
+        print("没有可用于压测的菜品")
+        return
+    original_stock = db.get_menu_item_stock(item['id'])
+    order_ids = []
+    timings = []
+    try:
+        for round_no in range(1, repeat + 1):
+            db.set_menu_item_stock(item['id'], STOCK_BENCH_QUANTITY)
+            with ThreadPoolExecutor(max_workers=STOCK_BENCH_THREADS) as pool:
+                results = list(pool.map(lambda _: _timed_order(item), range(STOCK_BENCH_BUYERS)))
+            outcomes = [outcome for outcome, _ in results]
+            timings.extend(elapsed for _, elapsed in results)
+            placed = [outcome for outcome in outcomes if outcome not in ('failed', 'insufficient')]
+            order_ids.extend(placed)
+            remaining = db.get_menu_item_stock(item['id'])
+            print(f"第 {round_no} 轮: 成功 {len(placed)}  库存不足 {outcomes.count('insufficient')}  "
+                  f"失败 {outcomes.count('failed')}  剩余库存 {remaining}")
+            assert len(placed) + remaining == STOCK_BENCH_QUANTITY and remaining >= 0, "库存与成功订单数不一致 (超卖)"
+            assert outcomes.count('failed') == 0, "有订单因数据库错误 (锁等待超时/死锁) 失败"
+        timings.sort()
+        print(f"下单耗时: 中位数 {statistics.median(timings):.2f}ms  "
+              f"P95 {timings[int(len(timings) * 0.95) - 1]:.2f}ms  最大 {timings[-1]:.2f}ms")
+    finally:
+        for start in range(0, len(order_ids), 500):
+            batch = order_ids[start:start + 500]
+            db.execute_query(f"DELETE FROM orders WHERE id IN ({', '.join(['%s'] * len(batch))})",
+                             tuple(batch), is_modify=True)
+        db.set_menu_item_stock(item['id'], original_stock)
+        db.execute_query("UPDATE menu_items SET is_available = %s WHERE id = %s",
+                         (item['is_available'], item['id']), is_modify=True)
+
+
+def _bulk_import(raw_rows):
+    """按接口的流程校验并导入，返回 (耗时毫秒, 导入结果)"""
+    started = time.perf_counter()
+    rows = []
+    for number, raw in enumerate(menu_import.parse_json(raw_rows), start=1):
+        row, errors = menu_import.normalize_row(raw)
+        assert not errors, f"第 {number} 行校验失败: {errors}"
+        rows.append({"row": number, **row})
+    result = db.bulk_upsert_menu_items(rows)
+    return (time.perf_counter() - started) * 1000, result
+
+
+def bench_bulk_import(repeat):
+    """每轮导入 BULK_IMPORT_ROWS 道新菜品，再导入一次修改全部价格；结束后删除生成的菜品"""
+    prefix = f"导入压测-{int(time.time())}-"
+    created_ids = []
+    create_timings, update_timings = [], []
+    try:
+        for round_no in range(1, repeat + 1):
+            names = [f"{prefix}{round_no}-{i}" for i in range(BULK_IMPORT_ROWS)]
+            elapsed, result = _bulk_import([{"name": name, "price": 10} for name in names])
+            assert result and result['applied'], f"导入失败: {result and result['errors']}"
+            created_ids.extend(entry['id'] for entry in result['created'])
+            create_timings.append(elapsed)
+            elapsed, result = _bulk_import([{"name": name, "price": 12.5} for name in names])
+            assert result and len(result['updated']) == BULK_IMPORT_ROWS, "再次导入没有修改全部菜品"
+            update_timings.append(elapsed)
+        print(f"导入 {BULK_IMPORT_ROWS} 行 (新增): 中位数 {statistics.median(create_timings):.2f}ms  "
+              f"最大 {max(create_timings):.2f}ms")
+        print(f"导入 {BULK_IMPORT_ROWS} 行 (修改): 中位数 {statistics.median(update_timings):.2f}ms  "
+              f"最大 {max(update_timings):.2f}ms")
+    finally:
+        for start in range(0, len(created_ids), 500):
+            batch = created_ids[start:start + 500]
+            db.execute_query(f"DELETE FROM menu_items WHERE id IN ({', '.join(['%s'] * len(batch))})",
+                             tuple(batch), is_modify=True)
+
+
+BENCHMARKS = {
+    'projection': bench_projection,
+    'stock': bench_stock,
+    'bulk_import': bench_bulk_import,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="在真实数据库上测量性能优化的效果")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=20, help="每项测量的重复次数 (取中位数)")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.repeat)
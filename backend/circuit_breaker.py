@@ -0,0 +1,129 @@
+# backend/circuit_breaker.py
+# 外部依赖的熔断器：连续失败 (或响应超过延迟 SLO) 达到阈值后熔断，冷却期后放行少量探测请求判断是否恢复
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态 (或半开状态下探测名额已满)，调用被直接拒绝"""
+
+
+class CircuitBreaker:
+    """
+    三态熔断器：
+    - closed: 正常放行；连续 failure_threshold 次失败 (含超出 latency_slo 的慢调用) 后打开
+    - open: 直接拒绝，open_seconds 后进入半开
+    - half_open: 最多放行 half_open_max_calls 个探测请求，成功则关闭，失败则重新打开
+    用法:
+        breaker.before_call()        # 可能抛出 CircuitOpenError
+        ... 调用依赖 ...
+        breaker.record_success(耗时秒数) / breaker.record_failure(耗时秒数)
+    """
+
+    def __init__(self, name, failure_threshold=5, open_seconds=30, latency_slo=None, half_open_max_calls=1,
+                 latency_window=200):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.latency_slo = latency_slo
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._half_open_in_flight = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._counters = {"calls": 0, "successes": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def before_call(self):
+        """调用依赖之前检查是否放行"""
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._half_open_in_flight >= self.half_open_max_calls):
+                self._counters["rejected"] += 1
+                raise CircuitOpenError(f"{self.name} 熔断中")
+            if state == HALF_OPEN:
+                self._half_open_in_flight += 1
+            self._counters["calls"] += 1
+
+    def record_success(self, elapsed_seconds):
+        """调用成功；超过延迟 SLO 的成功调用按失败计入熔断判断"""
+        if self.latency_slo is not None and elapsed_seconds > self.latency_slo:
+            with self._lock:
+                self._counters["slow_calls"] += 1
+            self._on_failure(elapsed_seconds)
+            return
+        with self._lock:
+            self._latencies.append(elapsed_seconds)
+            self._counters["successes"] += 1
+            self._consecutive_failures = 0
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+            self._state = CLOSED
+            self._opened_at = None
+
+    def record_failure(self, elapsed_seconds=None):
+        """调用失败 (异常、超时)"""
+        with self._lock:
+            self._counters["failures"] += 1
+        self._on_failure(elapsed_seconds)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            result = {
+                "state": self._current_state(),
+                "consecutive_failures": self._consecutive_failures,
+                "open_for_seconds": round(max(0.0, self._opened_at + self.open_seconds - time.monotonic()), 1)
+                if self._state == OPEN else 0,
+                **self._counters,
+            }
+        result["latency_ms"] = {
+            "p50": _percentile_ms(latencies, 0.5),
+            "p95": _percentile_ms(latencies, 0.95),
+            "max": _percentile_ms(latencies, 1.0),
+            "samples": len(latencies),
+        }
+        return result
+
+    def _on_failure(self, elapsed_seconds):
+        with self._lock:
+            if elapsed_seconds is not None:
+                self._latencies.append(elapsed_seconds)
+            self._consecutive_failures += 1
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                self._open()
+            elif self._state == CLOSED and self._consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        # 调用方持有锁
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._half_open_in_flight = 0
+        self._counters["opened"] += 1
+
+    def _current_state(self):
+        # 调用方持有锁；冷却期结束后自动转为半开
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_in_flight = 0
+        return self._state
+
+
+def _percentile_ms(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index] * 1000, 1)
@@ -1,62 +1,343 @@
 # backend/database.py
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
 import bcrypt  # 用于密码哈希
-from backend.db_config import DB_CONFIG  # 引入数据库配置
+from backend.db_config import (DB_SHARDS, TENANT_SHARDS, DEFAULT_TENANT_ID, DB_POOL_SIZE,
+                               DB_POOL_CHECKOUT_TIMEOUT, STOCK_SHARDS, MENU_CHANGES_SETTLE_SECONDS,
+                               MENU_CHANGES_MAX_ENTITIES)  # 引入数据库配置
+import backend.image_cache as image_cache
+import backend.order_states as order_states
+import backend.profiler as profiler
+
+
+logger = logging.getLogger(__name__)
+
+
+# --- 租户 (餐厅) 上下文 ---
+# 当前请求所属的租户保存在 ContextVar 中，所有数据库函数据此路由到对应分片并按 tenant_id 过滤
+_current_tenant = ContextVar('current_tenant', default=DEFAULT_TENANT_ID)
+
+
+class UnknownTenantError(ValueError):
+    """租户ID未在 TENANT_SHARDS 中配置"""
+
+
+def current_tenant_id():
+    """返回当前上下文的租户ID"""
+    return _current_tenant.get()
+
+
+def set_current_tenant(tenant_id):
+    """设置当前上下文的租户，返回可用于 reset_current_tenant 的令牌"""
+    tenant_id = int(tenant_id)
+    if tenant_id not in TENANT_SHARDS:
+        raise UnknownTenantError(f"未知的餐厅ID: {tenant_id}")
+    return _current_tenant.set(tenant_id)
+
+
+def reset_current_tenant(token):
+    _current_tenant.reset(token)
+
+
+@contextmanager
+def use_tenant(tenant_id):
+    """在 with 代码块内切换到指定租户"""
+    token = set_current_tenant(tenant_id)
+    try:
+        yield
+    finally:
+        reset_current_tenant(token)
+
+
+def all_tenant_ids():
+    return sorted(TENANT_SHARDS)
+
+
+def shard_tenants():
+    """返回 分片名 -> 该分片上的租户ID列表"""
+    result = {}
+    for tenant_id in all_tenant_ids():
+        result.setdefault(TENANT_SHARDS[tenant_id], []).append(tenant_id)
+    return result
+
+
+_fan_out_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='tenant-fanout')
+
+
+def fan_out(func, *args, tenant_ids=None, **kwargs):
+    """
+    对多个租户并行执行同一个数据库函数 (每个租户在自己的分片上执行)。
+    返回: {tenant_id: 结果}
+    """
+    tenant_ids = all_tenant_ids() if tenant_ids is None else tenant_ids
+
+    def run(tenant_id):
+        with use_tenant(tenant_id):
+            return func(*args, **kwargs)
+
+    futures = {tenant_id: _fan_out_executor.submit(run, tenant_id) for tenant_id in tenant_ids}
+    return {tenant_id: future.result() for tenant_id, future in futures.items()}
 
 
 # --- 数据库连接辅助函数 ---
+_pools = {}
+_pool_lock = threading.Lock()
+_pool_stats_lock = threading.Lock()
+_pool_waiting = {}  # 分片名 -> 正在等待空闲连接的调用数 (连接池排队长度)
+
+
+def _get_pool(shard_name):
+    """延迟创建分片的连接池"""
+    pool = _pools.get(shard_name)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(shard_name)
+            if pool is None:
+                pool = pooling.MySQLConnectionPool(pool_name=f'restaurant_pool_{shard_name}', pool_size=DB_POOL_SIZE,
+                                                   **DB_SHARDS[shard_name])
+                _pools[shard_name] = pool
+    return pool
+
+
+def get_pool_stats():
+    """返回连接池状态，供准入控制和监控使用 (waiting 为所有分片排队数之和)"""
+    with _pool_stats_lock:
+        per_shard = dict(_pool_waiting)
+    return {"pool_size": DB_POOL_SIZE, "waiting": sum(per_shard.values()), "waiting_by_shard": per_shard}
+
+
 def create_connection():
-    """创建并返回一个数据库连接对象"""
+    """
+    返回当前租户所在分片的数据库连接 (用完调用 close())。
+    处于请求级会话中时通过会话取得连接 (显式事务内复用同一个连接)，否则从连接池取出一个连接。
+    连接池耗尽时最多等待 DB_POOL_CHECKOUT_TIMEOUT 秒，超时返回 None。
+    """
+    shard_name = TENANT_SHARDS[current_tenant_id()]
+    session = _current_session.get()
+    if session is not None and not session.is_leased(shard_name):
+        return session.acquire(shard_name)
+    return _checkout_connection(shard_name)
+
+
+def _checkout_connection(shard_name):
+    """从分片的连接池取出一个连接 (调用 close() 即归还连接池)，超时或出错时返回 None"""
     connection = None
+    waiting = False
+    deadline = time.monotonic() + DB_POOL_CHECKOUT_TIMEOUT
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
+        while connection is None:
+            try:
+                connection = _get_pool(shard_name).get_connection()
+            except PoolError:
+                if not waiting:
+                    waiting = True
+                    with _pool_stats_lock:
+                        _pool_waiting[shard_name] = _pool_waiting.get(shard_name, 0) + 1
+                if time.monotonic() >= deadline:
+                    logger.error(f"等待分片 {shard_name} 的数据库连接池空闲连接超时 ({DB_POOL_CHECKOUT_TIMEOUT}s)")
+                    break
+                time.sleep(0.01)
         # print("成功连接到MySQL数据库") # 开发时可以取消注释
     except Error as e:
-        print(f"连接MySQL时发生错误: '{e}'")
+        logger.error(f"连接MySQL (分片 {shard_name}) 时发生错误: '{e}'")
+    finally:
+        if waiting:
+            with _pool_stats_lock:
+                _pool_waiting[shard_name] -= 1
     return connection
 
-# 请用这段代码替换 database.py 中已有的同名函数
 
-def update_order_payment_status(order_id, new_status):
+def _close_connection(connection, cursor=None):
     """
-    更新指定订单的支付状态和支付时间。
-    (已修正：使用项目中已有的 execute_query 函数，更简洁、更安全)
-    
-    Args:
-        order_id (int): 要更新的订单ID。
-        new_status (str): 新的支付状态 (例如 'paid')。
-        
-    Returns:
-        bool: 如果操作成功执行返回 True，否则返回 False。
+    关闭游标并把连接归还连接池。连接在查询中途断开时也必须调用 close()
+    (连接池在取出时会重连)，否则该连接永远不会归还，连接池会永久少一个名额
     """
-    # SQL UPDATE语句，同时更新支付状态和支付时间
-    sql = "UPDATE orders SET payment_status = %s WHERE id = %s"
-    
+    if cursor is not None:
+        try:
+            cursor.close()
+        except Error:
+            pass
     try:
-        # 直接调用项目中已有的通用函数 execute_query 来执行更新
-        # 这会自动处理数据库连接、游标、提交/回滚和关闭，非常方便
-        affected_rows = execute_query(
-            query=sql, 
-            params=(new_status, order_id), 
-            is_modify=True, 
-            dictionary_cursor=False  # 更新操作不需要返回字典
-        )
-        
-        # execute_query 在执行修改操作(is_modify=True)时，
-        # 成功则返回受影响的行数(>=0)，出错则返回 None。
-        if affected_rows is not None:
-            print(f"数据库日志：订单 {order_id} 支付状态更新操作完成，影响行数: {affected_rows}")
-            return True
+        connection.close()
+    except Error as e:
+        logger.warning(f"归还数据库连接时发生错误: '{e}'")
+
+
+# --- 请求级数据库会话 ---
+# 请求开始时 begin_session() 绑定一个会话，请求内各数据库函数的 create_connection() 都通过会话取得连接：
+# - 显式事务 (transaction()) 内：同一分片的各函数复用同一个连接，事务结束时统一提交并归还连接池
+# - 事务外：函数 close() 时立即提交并归还连接池，请求在其他耗时操作 (例如调用大模型) 期间不占用连接，
+#   也不会一直持有打开的一致性快照
+# 某个函数持有连接期间又调用了其他数据库函数 (嵌套) 时，内层调用单独从连接池取连接。
+# 请求结束时 end_session() 兜底提交 (出错时回滚) 并归还仍未归还的连接。
+# 没有会话时 (后台线程、fan_out 工作线程) 行为不变。
+_current_session = ContextVar('current_db_session', default=None)
+
+_SESSION_SAVEPOINT = 'db_session_helper'
+
+
+class _SessionConnection:
+    """
+    会话连接的代理，其余属性和方法直接转发给真实连接。
+    - close(): 归还给会话；不在显式事务中时会话随即提交并归还连接池
+    - 显式事务 (transaction()) 内: commit() 推迟到事务结束；rollback() 回滚到本函数开始时的保存点，
+      只撤销本函数的修改，与没有事务时各函数独立提交/回滚的语义一致
+    """
+
+    def __init__(self, session, shard_name, connection):
+        self._session = session
+        self._shard_name = shard_name
+        self._connection = connection
+        self._in_transaction = session.transaction_depth > 0
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def commit(self):
+        if not self._in_transaction:
+            self._connection.commit()
+
+    def rollback(self):
+        if self._in_transaction:
+            _execute_statement(self._connection, f"ROLLBACK TO SAVEPOINT {_SESSION_SAVEPOINT}")
         else:
-            # 如果 execute_query 内部出错，它会打印错误并返回 None
-            print(f"数据库错误：更新订单 {order_id} 支付状态失败。")
-            return False
+            self._connection.rollback()
 
-    except Exception as e:
-        # 捕获意外的程序错误
-        print(f"在 update_order_payment_status 函数中发生意外错误: {e}")
-        return False
+    def close(self):
+        self._session.release(self._shard_name)
+
+
+def _execute_statement(connection, statement):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(statement)
+    finally:
+        cursor.close()
+
+
+class DbSession:
+    """请求级数据库会话：每个分片最多一个连接，按顺序出借给各数据库函数 (只在显式事务期间保留)"""
+
+    def __init__(self):
+        self._connections = {}    # 分片名 -> 真实连接
+        self._leased = set()      # 正在被某个函数使用的分片
+        self.transaction_depth = 0
+        self.checkouts = 0        # 从连接池取连接的次数
+
+    def is_leased(self, shard_name):
+        return shard_name in self._leased
+
+    def acquire(self, shard_name):
+        connection = self._connections.get(shard_name)
+        if connection is None:
+            connection = _checkout_connection(shard_name)
+            if connection is None:
+                return None
+            self._connections[shard_name] = connection
+            self.checkouts += 1
+        proxy = _SessionConnection(self, shard_name, connection)
+        if proxy._in_transaction:
+            try:
+                _execute_statement(connection, f"SAVEPOINT {_SESSION_SAVEPOINT}")
+            except Error as e:
+                logger.error(f"在分片 {shard_name} 的会话连接上创建保存点时发生错误: '{e}'")
+                return None
+        self._leased.add(shard_name)
+        return proxy
+
+    def release(self, shard_name):
+        self._leased.discard(shard_name)
+        if self.transaction_depth > 0:
+            return
+        # 不在显式事务中：结束快照 (修改已由函数自己提交或回滚) 并归还连接池
+        connection = self._connections.pop(shard_name, None)
+        if connection is None:
+            return
+        try:
+            connection.commit()
+        except Error as e:
+            logger.error(f"归还分片 {shard_name} 的会话连接时提交失败: '{e}'")
+        _close_connection(connection)
+
+    def finish(self, commit=True):
+        """提交或回滚所有连接上的当前事务 (连接保留在会话中)；提交失败时回滚并抛出"""
+        for connection in self._connections.values():
+            if commit:
+                try:
+                    connection.commit()
+                except Error:
+                    connection.rollback()
+                    raise
+            else:
+                connection.rollback()
+
+    def close(self, commit=True):
+        """结束会话：提交或回滚后把连接归还连接池"""
+        for shard_name, connection in self._connections.items():
+            try:
+                if commit:
+                    connection.commit()
+                else:
+                    connection.rollback()
+            except Error as e:
+                logger.error(f"结束分片 {shard_name} 的数据库会话时发生错误: '{e}'")
+            _close_connection(connection)
+        self._connections.clear()
+        self._leased.clear()
+
+
+def begin_session():
+    """为当前请求绑定一个数据库会话，返回 end_session() 需要的令牌"""
+    return _current_session.set(DbSession())
+
+
+def end_session(token, commit=True):
+    """结束当前请求的数据库会话 (请求出错时 commit=False)"""
+    session = _current_session.get()
+    _current_session.reset(token)
+    if session is not None:
+        session.close(commit=commit)
+
+
+def current_session():
+    return _current_session.get()
+
+
+@contextmanager
+def transaction():
+    """
+    显式事务：with 代码块内调用的所有数据库函数在同一个事务中执行，代码块正常结束时提交，抛出异常时回滚。
+    数据库函数出错时只回滚它自己的修改并照常返回 None，需要整体回滚时由调用方抛出异常。
+    可以嵌套 (内层并入外层事务)；没有请求级会话时 (例如后台线程) 临时创建一个会话。
+    最外层事务结束后连接归还连接池。不同分片各自提交，不保证跨分片的原子性。
+    """
+    session = _current_session.get()
+    token = None
+    if session is None:
+        token = _current_session.set(DbSession())
+        session = _current_session.get()
+    session.transaction_depth += 1
+    succeeded = False
+    try:
+        yield session
+        succeeded = True
+    finally:
+        session.transaction_depth -= 1
+        if token is not None:
+            _current_session.reset(token)
+        if session.transaction_depth == 0:
+            try:
+                session.finish(commit=succeeded)
+            finally:
+                session.close(commit=False)
 
 def execute_query(query, params=None, fetch_one=False, fetch_all=False, is_modify=False, dictionary_cursor=True):
     """
@@ -80,6 +361,9 @@ def execute_query(query, params=None, fetch_one=False, fetch_all=False, is_modif
         cursor = connection.cursor()
 
     result = None
+    profile = profiler.current_profile()  # 请求未被剖析时为 None，不计时
+    started = time.perf_counter() if profile is not None else None
+    rows = None
     try:
         cursor.execute(query, params or ())
         if is_modify:
@@ -88,19 +372,21 @@ def execute_query(query, params=None, fetch_one=False, fetch_all=False, is_modif
             row_count = cursor.rowcount
             # print(f"修改查询执行成功，影响行数: {row_count}, 最后插入ID: {last_row_id}")
             result = last_row_id if query.strip().upper().startswith("INSERT") else row_count
+            rows = row_count
         elif fetch_one:
             result = cursor.fetchone()
+            rows = 0 if result is None else 1
         elif fetch_all:
             result = cursor.fetchall()
+            rows = len(result)
     except Error as e:
-        print(f"执行查询 '{query[:100]}...' 时发生错误: '{e}'")
+        logger.error(f"执行查询 '{query[:100]}...' 时发生错误: '{e}'")
         if is_modify and connection.is_connected():
             connection.rollback()
     finally:
-        if connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
+        if profile is not None:
+            profile.add_sql(query, time.perf_counter() - started, rows)
+        _close_connection(connection, cursor)
     return result
 
 
@@ -109,23 +395,23 @@ def create_user(username, password, role='customer', full_name=None, email=None,
     """创建新用户，密码会自动哈希处理"""
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
     query = """
-    INSERT INTO users (username, password_hash, role, full_name, email, phone)
-    VALUES (%s, %s, %s, %s, %s, %s)
+    INSERT INTO users (tenant_id, username, password_hash, role, full_name, email, phone)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
     """
-    params = (username, hashed_password, role, full_name, email, phone)
+    params = (current_tenant_id(), username, hashed_password, role, full_name, email, phone)
     return execute_query(query, params, is_modify=True)
 
 
 def get_user_by_username(username):
-    """根据用户名获取用户信息"""
-    query = "SELECT id, username, password_hash, role, full_name, email, phone, created_at, last_login FROM users WHERE username = %s"
-    return execute_query(query, (username,), fetch_one=True, dictionary_cursor=True)
+    """根据用户名获取当前餐厅的用户信息"""
+    query = "SELECT id, tenant_id, username, password_hash, role, full_name, email, phone, created_at, last_login FROM users WHERE tenant_id = %s AND username = %s"
+    return execute_query(query, (current_tenant_id(), username), fetch_one=True, dictionary_cursor=True)
 
 
 def get_user_by_id(user_id):
-    """根据用户ID获取用户信息"""
-    query = "SELECT id, username, password_hash, role, full_name, email, phone, created_at, last_login FROM users WHERE id = %s"
-    return execute_query(query, (user_id,), fetch_one=True, dictionary_cursor=True)
+    """根据用户ID获取当前餐厅的用户信息"""
+    query = "SELECT id, tenant_id, username, password_hash, role, full_name, email, phone, created_at, last_login FROM users WHERE id = %s AND tenant_id = %s"
+    return execute_query(query, (user_id, current_tenant_id()), fetch_one=True, dictionary_cursor=True)
 
 
 def verify_password(plain_password, hashed_password):
@@ -141,22 +427,202 @@ def update_user_last_login(user_id):
     return execute_query(query, (user_id,), is_modify=True)
 
 
+def update_users_last_login_batch(last_logins):
+    """
+    批量更新当前租户下多个用户的最后登录时间 (一条多行 UPDATE 语句)。
+    :param last_logins: {user_id: datetime}
+    :return: 成功返回 True，失败返回 False
+    """
+    if not last_logins:
+        return True
+    case_clauses = " ".join(["WHEN %s THEN %s"] * len(last_logins))
+    id_placeholders = ", ".join(["%s"] * len(last_logins))
+    query = f"UPDATE users SET last_login = CASE id {case_clauses} END WHERE tenant_id = %s AND id IN ({id_placeholders})"
+    params = []
+    for user_id, login_time in last_logins.items():
+        params.extend((user_id, login_time))
+    params.append(current_tenant_id())
+    params.extend(last_logins.keys())
+    return execute_query(query, tuple(params), is_modify=True, dictionary_cursor=False) is not None
+
+
+# --- 字段投影 (fields=) 白名单 ---
+# 键为对外暴露的字段名，值为对应的 SQL 列表达式。只有白名单内的字段才会进入 SELECT 列表，
+# 未请求的列既不会从数据库读取，也不会被序列化返回。
+MENU_ITEM_FIELDS = {
+    'id': 'mi.id',
+    'name': 'mi.name',
+    'description': 'mi.description',
+    'price': 'mi.price',
+    'category_id': 'mi.category_id',
+    'image_url': 'mi.image_url',
+    'is_available': 'mi.is_available',
+    'category_name': 'c.name',
+    # 剩余库存 (分片求和)，NULL 表示不限量；仅在 fields= 显式请求时查询
+    'stock': '(SELECT SUM(s.quantity) FROM menu_item_stock_shards s WHERE s.menu_item_id = mi.id)',
+}
+MENU_ITEM_DEFAULT_FIELDS = ['id', 'name', 'description', 'price', 'category_id', 'image_url', 'is_available',
+                            'category_name']
+
+ADMIN_ORDER_FIELDS = {
+    'id': 'o.id',
+    'order_time': 'o.order_time',
+    'total_amount': 'o.total_amount',
+    'status': 'o.status',
+    'payment_status': 'o.payment_status',
+    'paid_at': 'o.paid_at',
+    'payment_method': 'o.payment_method',
+    'customer_name': 'o.customer_name',
+    'delivery_address': 'o.delivery_address',
+    'notes': 'o.notes',
+    'user_username': 'u.username',
+    'user_id_from_user_table': 'u.id',
+}
+ADMIN_ORDER_DEFAULT_FIELDS = ['id', 'order_time', 'total_amount', 'status', 'payment_status', 'customer_name',
+                              'user_username', 'user_id_from_user_table']
+
+USER_ORDER_FIELDS = {
+    'id': 'o.id',
+    'order_time': 'o.order_time',
+    'total_amount': 'o.total_amount',
+    'status': 'o.status',
+    'payment_status': 'o.payment_status',
+    'paid_at': 'o.paid_at',
+    'payment_method': 'o.payment_method',
+    'delivery_address': 'o.delivery_address',
+    'notes': 'o.notes',
+}
+USER_ORDER_DEFAULT_FIELDS = ['id', 'order_time', 'total_amount', 'status', 'payment_status']
+
+
+def parse_fields_param(raw_fields, allowed_fields):
+    """
+    解析 `fields=a,b,c` 查询参数，并按白名单校验。
+    :param raw_fields: 原始参数字符串 (None 或空串表示不做投影)
+    :param allowed_fields: 白名单字典 (字段名 -> SQL 表达式)
+    :return: 去重后的字段名列表；未提供参数时返回 None
+    :raises ValueError: 包含白名单之外的字段时
+    """
+    if not raw_fields:
+        return None
+    fields = []
+    for name in raw_fields.split(','):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in allowed_fields:
+            raise ValueError(f"不支持的字段: {name}. 可选字段为: {', '.join(allowed_fields)}")
+        fields.append(name)
+    return fields or None
+
+
+def _build_select_list(fields, allowed_fields, default_fields=None):
+    """根据字段列表生成 SELECT 子句中的列清单 (字段已通过白名单校验)"""
+    selected = fields or default_fields or list(allowed_fields)
+    return ", ".join(f"{allowed_fields[name]} as {name}" for name in selected)
+
+
+# --- 刷新令牌 (refresh token) 函数 ---
+def create_refresh_token(user_id, token_hash, family_id, expires_at):
+    """保存新签发的刷新令牌 (只保存其 SHA-256 哈希)"""
+    query = """
+    INSERT INTO refresh_tokens (user_id, token_hash, family_id, expires_at)
+    VALUES (%s, %s, %s, %s)
+    """
+    return execute_query(query, (user_id, token_hash, family_id, expires_at), is_modify=True)
+
+
+def get_refresh_token_by_hash(token_hash):
+    """根据令牌哈希获取刷新令牌记录"""
+    query = """
+    SELECT id, user_id, family_id, expires_at, revoked_at, expires_at <= CURRENT_TIMESTAMP as is_expired
+    FROM refresh_tokens WHERE token_hash = %s
+    """
+    return execute_query(query, (token_hash,), fetch_one=True, dictionary_cursor=True)
+
+
+def consume_refresh_token(token_id):
+    """
+    将刷新令牌标记为已使用 (一次性)。条件更新保证并发请求中只有一个能成功。
+    返回: True (本次成功使用) / False (已被使用或已吊销)
+    """
+    query = "UPDATE refresh_tokens SET revoked_at = CURRENT_TIMESTAMP WHERE id = %s AND revoked_at IS NULL"
+    affected_rows = execute_query(query, (token_id,), is_modify=True, dictionary_cursor=False)
+    return affected_rows is not None and affected_rows > 0
+
+
+def revoke_refresh_token_family(family_id):
+    """吊销同一登录会话 (令牌族) 下的所有刷新令牌"""
+    query = "UPDATE refresh_tokens SET revoked_at = CURRENT_TIMESTAMP WHERE family_id = %s AND revoked_at IS NULL"
+    return execute_query(query, (family_id,), is_modify=True, dictionary_cursor=False)
+
+
+def revoke_user_refresh_tokens(user_id):
+    """吊销某个用户的所有刷新令牌 (例如角色变更后)"""
+    query = "UPDATE refresh_tokens SET revoked_at = CURRENT_TIMESTAMP WHERE user_id = %s AND revoked_at IS NULL"
+    return execute_query(query, (user_id,), is_modify=True, dictionary_cursor=False)
+
+
+def revoke_access_token(jti, user_id, expires_at):
+    """吊销单个访问令牌 (登出)；expires_at 为访问令牌过期的 Unix 时间戳，过期后该记录由归档任务清理"""
+    query = "INSERT IGNORE INTO revoked_access_tokens (jti, user_id, expires_at) VALUES (%s, %s, FROM_UNIXTIME(%s))"
+    return execute_query(query, (jti, user_id, expires_at), is_modify=True, dictionary_cursor=False)
+
+
+def set_user_tokens_valid_after(user_id, cutoff):
+    """吊销当前餐厅该用户在 cutoff (Unix 时间戳) 及之前签发的全部访问令牌"""
+    query = """
+    UPDATE users SET tokens_valid_after = GREATEST(COALESCE(tokens_valid_after, 0), %s)
+    WHERE id = %s AND tenant_id = %s
+    """
+    return execute_query(query, (cutoff, user_id, current_tenant_id()), is_modify=True, dictionary_cursor=False)
+
+
+def get_user_for_token(user_id, jti):
+    """
+    token_required 使用：一次查询取得当前餐厅的用户信息和访问令牌的吊销状态
+    (tokens_valid_after、token_revoked)，所有工作进程看到的吊销状态一致
+    """
+    query = """
+    SELECT id, tenant_id, username, password_hash, role, full_name, email, phone, created_at, last_login,
+           tokens_valid_after, EXISTS(SELECT 1 FROM revoked_access_tokens WHERE jti = %s) AS token_revoked
+    FROM users WHERE id = %s AND tenant_id = %s
+    """
+    return execute_query(query, (jti, user_id, current_tenant_id()), fetch_one=True, dictionary_cursor=True)
+
+
+def prune_revoked_access_tokens():
+    """删除当前分片上对应访问令牌已过期的吊销记录，返回删除的行数 (出错返回 None)"""
+    query = "DELETE FROM revoked_access_tokens WHERE expires_at < CURRENT_TIMESTAMP"
+    return execute_query(query, is_modify=True, dictionary_cursor=False)
+
+
 # --- 菜品管理函数 ---
-def get_all_menu_items(include_unavailable=False):
-    """获取所有菜品信息，并包含分类名称。管理员可获取所有菜品。"""
-    query_base = """
-    SELECT mi.id, mi.name, mi.description, mi.price, mi.category_id, mi.image_url, mi.is_available, c.name as category_name
+def get_all_menu_items(include_unavailable=False, fields=None, with_thumbnails=False):
+    """
+    获取所有菜品信息，并包含分类名称。管理员可获取所有菜品。
+    :param fields: 可选的字段列表 (须来自 MENU_ITEM_FIELDS)，为空时返回全部字段
+    :param with_thumbnails: 为 True 且结果包含 image_url 时，附加本地缩略图代理地址 thumbnail_url
+    """
+    query_base = f"""
+    SELECT {_build_select_list(fields, MENU_ITEM_FIELDS, MENU_ITEM_DEFAULT_FIELDS)}
     FROM menu_items mi
     LEFT JOIN categories c ON mi.category_id = c.id
+    WHERE mi.tenant_id = %s
     """
-    params = []
+    params = [current_tenant_id()]
 
     if not include_unavailable:
-        query_base += " WHERE mi.is_available = TRUE"
+        query_base += " AND mi.is_available = TRUE"
 
     query_base += " ORDER BY c.display_order, mi.name"
 
-    return execute_query(query_base, tuple(params), fetch_all=True, dictionary_cursor=True)
+    items = execute_query(query_base, tuple(params), fetch_all=True, dictionary_cursor=True)
+    if with_thumbnails and items:
+        for item in items:
+            if 'image_url' in item:
+                item['thumbnail_url'] = image_cache.thumbnail_url(item['image_url'])
+    return items
 
 
 def get_menu_item_by_id(item_id):
@@ -165,18 +631,164 @@ def get_menu_item_by_id(item_id):
     SELECT mi.id, mi.name, mi.description, mi.price, mi.category_id, mi.image_url, mi.is_available, c.name as category_name
     FROM menu_items mi
     LEFT JOIN categories c ON mi.category_id = c.id
-    WHERE mi.id = %s
+    WHERE mi.id = %s AND mi.tenant_id = %s
+    """
+    return execute_query(query, (item_id, current_tenant_id()), fetch_one=True, dictionary_cursor=True)
+
+
+# --- 菜单增量同步函数 (变更日志由 database_setup.sql 中的触发器写入 menu_changes 表) ---
+def get_menu_version():
+    """
+    当前餐厅的菜单目录版本号 (变更日志中已稳定的最大ID)。
+    最近 MENU_CHANGES_SETTLE_SECONDS 秒内的变更不计入，客户端下次增量同步时会收到它们，
+    这样即使某个事务提交得比后来者晚，它的变更也不会被跳过。
+    """
+    query = """
+    SELECT COALESCE(
+        (SELECT MAX(id) FROM menu_changes
+         WHERE tenant_id = %s AND changed_at <= CURRENT_TIMESTAMP - INTERVAL %s SECOND),
+        (SELECT pruned_through FROM menu_change_watermarks WHERE tenant_id = %s),
+        0) AS version
+    """
+    tenant_id = current_tenant_id()
+    result = execute_query(query, (tenant_id, MENU_CHANGES_SETTLE_SECONDS, tenant_id), fetch_one=True,
+                           dictionary_cursor=True)
+    return int(result['version']) if result else None
+
+
+def get_menu_changes(since_version, include_unavailable=False):
     """
-    return execute_query(query, (item_id,), fetch_one=True, dictionary_cursor=True)
+    获取指定版本之后变化的菜品和分类。
+    :return: {"version", "full_resync", "items", "removed_item_ids", "categories"}；
+             full_resync 为 True 时 (版本号已被清理、超出当前版本、变更过多或有分类被删除) 客户端应重新获取完整菜单；
+             数据库错误时返回 None
+    """
+    tenant_id = current_tenant_id()
+    head_query = """
+    SELECT MAX(id) AS latest,
+           MAX(CASE WHEN changed_at <= CURRENT_TIMESTAMP - INTERVAL %s SECOND THEN id END) AS settled,
+           (SELECT MAX(id) FROM menu_changes WHERE tenant_id = %s) AS head,
+           (SELECT pruned_through FROM menu_change_watermarks WHERE tenant_id = %s) AS pruned_through
+    FROM menu_changes
+    WHERE tenant_id = %s AND id > %s
+    """
+    head = execute_query(head_query, (MENU_CHANGES_SETTLE_SECONDS, tenant_id, tenant_id, tenant_id, since_version),
+                         fetch_one=True, dictionary_cursor=True)
+    if head is None:
+        return None
+
+    result = {"version": since_version, "full_resync": False, "items": [], "removed_item_ids": [],
+              "categories": []}
+    pruned_through = head['pruned_through'] or 0
+    if since_version < pruned_through or since_version > max(head['head'] or 0, pruned_through):
+        result['full_resync'] = True
+        return result
+    if head['latest'] is None:
+        return result
+    result['version'] = max(int(head['settled'] or 0), since_version)
+
+    changes_query = """
+    SELECT entity, entity_id FROM menu_changes
+    WHERE tenant_id = %s AND id > %s AND id <= %s
+    GROUP BY entity, entity_id
+    LIMIT %s
+    """
+    changes = execute_query(changes_query, (tenant_id, since_version, head['latest'], MENU_CHANGES_MAX_ENTITIES + 1),
+                            fetch_all=True, dictionary_cursor=True)
+    if changes is None:
+        return None
+    if len(changes) > MENU_CHANGES_MAX_ENTITIES:
+        result['full_resync'] = True
+        return result
+    item_ids = [change['entity_id'] for change in changes if change['entity'] == 'item']
+    category_ids = [change['entity_id'] for change in changes if change['entity'] == 'category']
+
+    if category_ids:
+        placeholders = ', '.join(['%s'] * len(category_ids))
+        categories = execute_query(
+            f"SELECT id, name, description, display_order FROM categories WHERE id IN ({placeholders}) AND tenant_id = %s",
+            (*category_ids, tenant_id), fetch_all=True, dictionary_cursor=True)
+        if categories is None:
+            return None
+        if len(categories) < len(category_ids):
+            # 分类被删除时其菜品经外键 SET NULL 变为未分类，这种级联修改不会触发触发器，只能全量刷新
+            result['full_resync'] = True
+            return result
+        result['categories'] = categories
+
+    if item_ids or category_ids:
+        conditions = []
+        params = [tenant_id]
+        if item_ids:
+            conditions.append(f"mi.id IN ({', '.join(['%s'] * len(item_ids))})")
+            params.extend(item_ids)
+        if category_ids:
+            # 分类改名后，其下菜品的 category_name 也随之变化
+            conditions.append(f"mi.category_id IN ({', '.join(['%s'] * len(category_ids))})")
+            params.extend(category_ids)
+        items_query = f"""
+        SELECT {_build_select_list(None, MENU_ITEM_FIELDS, MENU_ITEM_DEFAULT_FIELDS)}
+        FROM menu_items mi
+        LEFT JOIN categories c ON mi.category_id = c.id
+        WHERE mi.tenant_id = %s AND ({' OR '.join(conditions)})
+        """
+        items = execute_query(items_query, tuple(params), fetch_all=True, dictionary_cursor=True)
+        if items is None:
+            return None
+        found_ids = set()
+        for item in items:
+            found_ids.add(item['id'])
+            if not include_unavailable and not item['is_available']:
+                result['removed_item_ids'].append(item['id'])
+                continue
+            item['thumbnail_url'] = image_cache.thumbnail_url(item['image_url'])
+            result['items'].append(item)
+        # 已被物理删除的菜品
+        result['removed_item_ids'].extend(item_id for item_id in item_ids if item_id not in found_ids)
+    return result
+
+
+def prune_menu_changes(retention_days):
+    """删除当前餐厅超过保留期的菜单变更日志，并记录清理位置；返回删除的行数 (出错返回 None)"""
+    tenant_id = current_tenant_id()
+    connection = create_connection()
+    if not connection:
+        return None
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT MAX(id) FROM menu_changes
+            WHERE tenant_id = %s AND changed_at < CURRENT_TIMESTAMP - INTERVAL %s DAY
+        """, (tenant_id, retention_days))
+        (pruned_through,) = cursor.fetchone()
+        if pruned_through is None:
+            connection.rollback()
+            return 0
+        cursor.execute("""
+            INSERT INTO menu_change_watermarks (tenant_id, pruned_through) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE pruned_through = GREATEST(pruned_through, VALUES(pruned_through))
+        """, (tenant_id, pruned_through))
+        cursor.execute("DELETE FROM menu_changes WHERE tenant_id = %s AND id <= %s", (tenant_id, pruned_through))
+        deleted = cursor.rowcount
+        connection.commit()
+        return deleted
+    except Error as e:
+        logger.error(f"清理餐厅 {tenant_id} 的菜单变更日志时发生数据库错误: '{e}'")
+        if connection.is_connected():
+            connection.rollback()
+        return None
+    finally:
+        _close_connection(connection, cursor)
 
 
 def add_menu_item(name, description, price, category_id, image_url=None, is_available=True):
     """添加新菜品"""
     query = """
-    INSERT INTO menu_items (name, description, price, category_id, image_url, is_available)
-    VALUES (%s, %s, %s, %s, %s, %s)
+    INSERT INTO menu_items (tenant_id, name, description, price, category_id, image_url, is_available)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
     """
-    params = (name, description, price, category_id, image_url, is_available)
+    params = (current_tenant_id(), name, description, price, category_id, image_url, is_available)
     return execute_query(query, params, is_modify=True)
 
 
@@ -190,14 +802,168 @@ def update_menu_item(item_id, name, description, price, category_id, image_url,
         category_id = %s,
         image_url = %s,
         is_available = %s,
+        auto_disabled = FALSE,
         updated_at = CURRENT_TIMESTAMP
-    WHERE id = %s
+    WHERE id = %s AND tenant_id = %s
     """
-    params = (name, description, price, category_id, image_url, is_available, item_id)
+    params = (name, description, price, category_id, image_url, is_available, item_id, current_tenant_id())
     affected_rows = execute_query(query, params, is_modify=True, dictionary_cursor=False)
     return affected_rows
 
 
+MENU_BULK_STATEMENT_ROWS = 500  # 批量导入时每条多行 INSERT 语句包含的行数
+
+_MENU_BULK_COLUMNS = ('name', 'description', 'price', 'category_id', 'image_url', 'is_available')
+
+
+def bulk_upsert_menu_items(rows, apply_valid_rows=False, dry_run=False):
+    """
+    在一个事务中批量新增或修改菜品 (行数据须已经过 menu_import.normalize_row 的格式校验)。
+    - 先锁定当前餐厅的全部菜品行并读取分类列表，所有行都基于这同一份快照校验
+      (菜品ID是否存在、分类是否存在、名称是否与其他菜品冲突、批次内是否重复)
+    - 有 id 的行修改该菜品；没有 id 的行按名称匹配已有菜品，匹配不到则新增。未提供的字段保持原值
+    - 新增和修改合并为多行 INSERT ... ON DUPLICATE KEY UPDATE，每条语句最多 MENU_BULK_STATEMENT_ROWS 行；
+      与现有数据完全相同的行不写入。只有显式修改 is_available 时才清除售罄自动下架标记
+    :param rows: [{"row": 行号, 字段...}]
+    :param apply_valid_rows: 为 False 时任意一行有错误就整体回滚；为 True 时只写入校验通过的行
+    :param dry_run: 只校验并返回计划执行的操作，不写入
+    :return: {"applied", "created", "updated", "unchanged", "errors"}；数据库错误时返回 None
+    """
+    tenant_id = current_tenant_id()
+    connection = create_connection()
+    if not connection:
+        return None
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT id, name, description, price, category_id, image_url, is_available, auto_disabled
+            FROM menu_items WHERE tenant_id = %s FOR UPDATE
+        """, (tenant_id,))
+        by_id = {item['id']: item for item in cursor.fetchall()}
+        by_name = {item['name']: item for item in by_id.values()}
+        cursor.execute("SELECT id, name FROM categories WHERE tenant_id = %s", (tenant_id,))
+        categories = cursor.fetchall()
+        category_ids = {category['id'] for category in categories}
+        category_ids_by_name = {}
+        for category in categories:
+            category_ids_by_name.setdefault(category['name'], []).append(category['id'])
+
+        errors, created, updated, unchanged = [], [], [], []
+        planned = []            # (行号, 已有菜品或 None, 合并后的字段)
+        claimed_targets = {}    # 菜品ID 或 ('new', 名称) -> 行号
+        claimed_names = {}      # 写入后的名称 -> 行号
+        for row in rows:
+            number = row['row']
+            fields = {key: value for key, value in row.items() if key != 'row'}
+            if 'id' in fields:
+                existing = by_id.get(fields['id'])
+                if existing is None:
+                    errors.append({"row": number, "message": f"菜品ID {fields['id']} 不存在"})
+                    continue
+            else:
+                existing = by_name.get(fields['name'])
+
+            if 'category' in fields:
+                matches = category_ids_by_name.get(fields.pop('category'), [])
+                if len(matches) != 1:
+                    errors.append({"row": number, "message": "分类不存在" if not matches else "分类名称不唯一，请使用 category_id"})
+                    continue
+                fields['category_id'] = matches[0]
+            elif 'category_id' in fields and fields['category_id'] not in category_ids:
+                errors.append({"row": number, "message": f"分类ID {fields['category_id']} 不存在"})
+                continue
+
+            if existing is None:
+                missing = [key for key in ('price', 'category_id') if key not in fields]
+                if missing:
+                    errors.append({"row": number, "message": f"新增菜品缺少必要字段: {', '.join(missing)}"})
+                    continue
+                merged = {'description': '', 'image_url': None, 'is_available': True, **fields}
+            else:
+                merged = {key: existing[key] for key in _MENU_BULK_COLUMNS}
+                merged.update((key, fields[key]) for key in _MENU_BULK_COLUMNS if key in fields)
+                holder = by_name.get(merged['name'])
+                if holder is not None and holder['id'] != existing['id']:
+                    errors.append({"row": number, "message": f"名称 '{merged['name']}' 已被菜品ID {holder['id']} 使用"})
+                    continue
+
+            target = existing['id'] if existing else ('new', merged['name'])
+            if target in claimed_targets:
+                errors.append({"row": number, "message": f"与第 {claimed_targets[target]} 行修改的是同一个菜品"})
+                continue
+            if merged['name'] in claimed_names:
+                errors.append({"row": number, "message": f"名称 '{merged['name']}' 与第 {claimed_names[merged['name']]} 行重复"})
+                continue
+            claimed_targets[target] = number
+            claimed_names[merged['name']] = number
+            planned.append((number, existing, merged))
+
+        values = []
+        for number, existing, merged in planned:
+            if existing is None:
+                values.append((None, merged, False))
+                created.append({"row": number, "name": merged['name']})
+                continue
+            changes = [key for key in _MENU_BULK_COLUMNS if not _menu_value_equal(key, existing[key], merged[key])]
+            if not changes:
+                unchanged.append({"row": number, "id": existing['id'], "name": existing['name']})
+                continue
+            auto_disabled = False if 'is_available' in changes else bool(existing['auto_disabled'])
+            values.append((existing['id'], merged, auto_disabled))
+            updated.append({"row": number, "id": existing['id'], "name": merged['name'], "changes": changes})
+
+        result = {"applied": False, "created": created, "updated": updated, "unchanged": unchanged, "errors": errors}
+        if dry_run or (errors and not apply_valid_rows) or not values:
+            connection.rollback()
+            result["applied"] = not dry_run and not (errors and not apply_valid_rows)
+            return result
+
+        for start in range(0, len(values), MENU_BULK_STATEMENT_ROWS):
+            chunk = values[start:start + MENU_BULK_STATEMENT_ROWS]
+            params = []
+            for item_id, merged, auto_disabled in chunk:
+                params.extend((item_id, tenant_id, *(merged[key] for key in _MENU_BULK_COLUMNS), auto_disabled))
+            cursor.execute(f"""
+                INSERT INTO menu_items (id, tenant_id, name, description, price, category_id, image_url,
+                                        is_available, auto_disabled)
+                VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(chunk))}
+                ON DUPLICATE KEY UPDATE name = VALUES(name), description = VALUES(description), price = VALUES(price),
+                    category_id = VALUES(category_id), image_url = VALUES(image_url),
+                    is_available = VALUES(is_available), auto_disabled = VALUES(auto_disabled)
+            """, tuple(params))
+
+        # 新增菜品的ID按名称查回 (同一餐厅内名称唯一)
+        new_names = [entry['name'] for entry in created]
+        new_ids = {}
+        for start in range(0, len(new_names), MENU_BULK_STATEMENT_ROWS):
+            chunk = new_names[start:start + MENU_BULK_STATEMENT_ROWS]
+            cursor.execute(f"SELECT id, name FROM menu_items WHERE tenant_id = %s "
+                           f"AND name IN ({', '.join(['%s'] * len(chunk))})", (tenant_id, *chunk))
+            new_ids.update((item['name'], item['id']) for item in cursor.fetchall())
+        for entry in created:
+            entry['id'] = new_ids.get(entry['name'])
+
+        connection.commit()
+        result["applied"] = True
+        return result
+    except Error as e:
+        logger.error(f"批量导入 {len(rows)} 行菜品时发生数据库错误: '{e}'")
+        if connection.is_connected():
+            connection.rollback()
+        return None
+    finally:
+        _close_connection(connection, cursor)
+
+
+def _menu_value_equal(key, current, new):
+    if key == 'price':
+        return current is not None and round(float(current), 2) == round(float(new), 2)
+    if key == 'is_available':
+        return bool(current) == bool(new)
+    return current == new
+
+
 # ========== 代码修改部分 ==========
 def delete_menu_item(item_id):
     """
@@ -209,59 +975,257 @@ def delete_menu_item(item_id):
         受影响的行数 (成功时通常为1), 如果出错则返回0。
     """
     # SQL UPDATE 语句将菜品标记为不可用，实现软删除
-    query = "UPDATE menu_items SET is_available = FALSE, updated_at = CURRENT_TIMESTAMP WHERE id = %s"
+    query = "UPDATE menu_items SET is_available = FALSE, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND tenant_id = %s"
     try:
         # 使用通用的 execute_query 函数执行更新
         affected_rows = execute_query(
             query=query, 
-            params=(item_id,), 
+            params=(item_id, current_tenant_id()), 
             is_modify=True, 
             dictionary_cursor=False
         )
         
         # is_modify=True 时，成功返回受影响的行数(>=0)，出错返回 None
         if affected_rows is not None:
-            print(f"数据库日志：菜品ID {item_id} 已被软删除（设置为不可用）。")
+            logger.info(f"菜品ID {item_id} 已被软删除（设置为不可用）。")
             return affected_rows
         else:
-            print(f"数据库错误：软删除菜品ID {item_id} 失败。")
+            logger.error(f"软删除菜品ID {item_id} 失败。")
             return 0 # 表示操作失败或未找到行
             
     except Exception as e:
-        print(f"软删除菜品ID {item_id} 时发生未知错误: {e}")
+        logger.error(f"软删除菜品ID {item_id} 时发生未知错误: {e}")
         return 0 # 表示操作失败
 # ========== 代码修改结束 ==========
 
 
+# --- 库存管理函数 (分片计数器) ---
+class InsufficientStockError(Exception):
+    """下单时某道菜品库存不足"""
+
+    def __init__(self, menu_item_id, requested, available=None):
+        self.menu_item_id = menu_item_id
+        self.requested = requested
+        self.available = available
+        super().__init__(f"菜品ID {menu_item_id} 库存不足 (需要 {requested}, 剩余 {available})")
+
+
+def get_menu_item_stock(item_id):
+    """获取菜品剩余库存；未启用库存管理 (不限量) 时返回 None"""
+    query = "SELECT SUM(quantity) as stock FROM menu_item_stock_shards WHERE menu_item_id = %s"
+    result = execute_query(query, (item_id,), fetch_one=True, dictionary_cursor=True)
+    if not result or result['stock'] is None:
+        return None
+    return int(result['stock'])
+
+
+def set_menu_item_stock(item_id, stock):
+    """
+    设置菜品库存 (均匀分配到 STOCK_SHARDS 个分片)。stock 为 None 表示取消限量。
+    库存大于 0 时，若菜品此前因售罄被自动下架，则自动恢复供应。
+    返回: True (成功) / False (数据库错误)
+    """
+    connection = create_connection()
+    if not connection:
+        return False
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DELETE FROM menu_item_stock_shards WHERE menu_item_id = %s", (item_id,))
+        if stock is not None:
+            base, remainder = divmod(int(stock), STOCK_SHARDS)
+            shard_rows = [(item_id, shard_id, base + (1 if shard_id < remainder else 0))
+                          for shard_id in range(STOCK_SHARDS)]
+            cursor.executemany(
+                "INSERT INTO menu_item_stock_shards (menu_item_id, shard_id, quantity) VALUES (%s, %s, %s)",
+                shard_rows)
+        if stock is None or int(stock) > 0:
+            cursor.execute("""
+                UPDATE menu_items SET is_available = TRUE, auto_disabled = FALSE
+                WHERE id = %s AND auto_disabled = TRUE
+            """, (item_id,))
+        else:
+            cursor.execute("""
+                UPDATE menu_items SET is_available = FALSE, auto_disabled = TRUE
+                WHERE id = %s AND is_available = TRUE
+            """, (item_id,))
+        connection.commit()
+        return True
+    except Error as e:
+        logger.error(f"设置菜品 {item_id} 库存时发生数据库错误: '{e}'")
+        if connection.is_connected():
+            connection.rollback()
+        return False
+    finally:
+        _close_connection(connection, cursor)
+
+
+def _aggregate_item_quantities(items):
+    """按菜品ID汇总数量，并按ID排序 (固定加锁顺序，避免死锁)"""
+    totals = {}
+    for item in items:
+        totals[item['menu_item_id']] = totals.get(item['menu_item_id'], 0) + int(item['quantity'])
+    return sorted(totals.items())
+
+
+def _reserve_stock(cursor, items_data):
+    """
+    在调用方的事务中扣减库存。
+    每道菜先在看起来够扣的分片中随机选一个，尝试单条条件 UPDATE (quantity >= 需求量)，只锁定一个分片行；
+    没有单个分片够扣时才锁定该菜品的全部分片，跨分片扣减。
+    未启用库存管理的菜品 (没有分片行) 不受限制。
+    返回: 本次有分片被扣到 0 的菜品ID列表 (由调用方在提交后检查是否售罄)
+    :raises InsufficientStockError: 库存不足
+    """
+    drained = []
+    for menu_item_id, quantity in _aggregate_item_quantities(items_data):
+        cursor.execute("SELECT shard_id, quantity FROM menu_item_stock_shards WHERE menu_item_id = %s",
+                       (menu_item_id,))
+        shards = cursor.fetchall()
+        if not shards:
+            continue
+
+        # 非锁定读只用于挑选分片，真正的判断由条件 UPDATE 完成
+        candidates = [row[0] for row in shards if row[1] >= quantity]
+        random.shuffle(candidates)
+        reserved = False
+        for shard_id in candidates:
+            cursor.execute("""
+                UPDATE menu_item_stock_shards SET quantity = quantity - %s
+                WHERE menu_item_id = %s AND shard_id = %s AND quantity >= %s
+            """, (quantity, menu_item_id, shard_id, quantity))
+            if cursor.rowcount == 1:
+                reserved = True
+                # 读取刚扣减的分片 (本事务已锁定该行)，被扣到 0 时才需要检查其他分片
+                cursor.execute("SELECT quantity FROM menu_item_stock_shards WHERE menu_item_id = %s AND shard_id = %s",
+                               (menu_item_id, shard_id))
+                if cursor.fetchone()[0] == 0:
+                    drained.append(menu_item_id)
+                break
+
+        if not reserved:
+            cursor.execute("""
+                SELECT shard_id, quantity FROM menu_item_stock_shards
+                WHERE menu_item_id = %s ORDER BY shard_id FOR UPDATE
+            """, (menu_item_id,))
+            shards = cursor.fetchall()
+            available = sum(row[1] for row in shards)
+            if available < quantity:
+                raise InsufficientStockError(menu_item_id, quantity, available)
+            remaining = quantity
+            for shard_id, shard_quantity in shards:
+                take = min(shard_quantity, remaining)
+                if take > 0:
+                    cursor.execute("""
+                        UPDATE menu_item_stock_shards SET quantity = quantity - %s
+                        WHERE menu_item_id = %s AND shard_id = %s
+                    """, (take, menu_item_id, shard_id))
+                    remaining -= take
+                if remaining == 0:
+                    break
+            drained.append(menu_item_id)   # 跨分片扣减至少会把一个分片扣到 0
+    return drained
+
+
+def _disable_sold_out_items(menu_item_ids):
+    """
+    下单提交后检查被扣到 0 的菜品，全部分片都为 0 时自动下架。
+    在独立的短事务中执行：此时订单事务已释放分片锁，这里按 分片 -> menu_items 的顺序加锁 (与补货、取消订单一致)，
+    不会与并发下单互相等待。只有售罄这一刻才会锁定 menu_items 行。
+    """
+    connection = create_connection()
+    if not connection:
+        return
+
+    cursor = connection.cursor()
+    try:
+        for menu_item_id in menu_item_ids:
+            # 锁定读: 读到并发订单和补货已提交的最新数量
+            cursor.execute("""
+                SELECT 1 FROM menu_item_stock_shards WHERE menu_item_id = %s AND quantity > 0 LIMIT 1 LOCK IN SHARE MODE
+            """, (menu_item_id,))
+            if cursor.fetchone() is None:
+                cursor.execute("""
+                    UPDATE menu_items SET is_available = FALSE, auto_disabled = TRUE
+                    WHERE id = %s AND is_available = TRUE
+                """, (menu_item_id,))
+            connection.commit()
+    except Error as e:
+        # 未能下架时菜品仍显示可售，但下单会因库存不足被拒绝，下一次扣到 0 时会再次检查
+        logger.error(f"检查售罄菜品 {menu_item_ids} 时发生数据库错误: '{e}'")
+        if connection.is_connected():
+            connection.rollback()
+    finally:
+        _close_connection(connection, cursor)
+
+
+def _release_stock(cursor, order_id):
+    """在调用方的事务中归还订单占用的库存，并恢复因售罄被自动下架的菜品"""
+    cursor.execute("SELECT menu_item_id, quantity FROM order_items WHERE order_id = %s", (order_id,))
+    rows = cursor.fetchall()
+    items = [{'menu_item_id': row['menu_item_id'], 'quantity': row['quantity']} if isinstance(row, dict)
+             else {'menu_item_id': row[0], 'quantity': row[1]} for row in rows]
+    for menu_item_id, quantity in _aggregate_item_quantities(items):
+        cursor.execute("""
+            UPDATE menu_item_stock_shards SET quantity = quantity + %s
+            WHERE menu_item_id = %s AND shard_id = %s
+        """, (quantity, menu_item_id, random.randrange(STOCK_SHARDS)))
+        if cursor.rowcount == 0:
+            # 分片数配置变化后随机分片可能不存在，退回到该菜品的第一个分片
+            cursor.execute("""
+                UPDATE menu_item_stock_shards SET quantity = quantity + %s
+                WHERE menu_item_id = %s ORDER BY shard_id LIMIT 1
+            """, (quantity, menu_item_id))
+        if cursor.rowcount == 1:
+            cursor.execute("""
+                UPDATE menu_items SET is_available = TRUE, auto_disabled = FALSE
+                WHERE id = %s AND auto_disabled = TRUE
+            """, (menu_item_id,))
+
+
 # --- 订单管理函数 ---
 def create_order(total_amount, items_data, user_id=None, customer_name="匿名用户", payment_method=None,
-                 delivery_address=None, notes=None):
-    """创建新订单"""
+                 delivery_address=None, notes=None, intake_ref=None):
+    """
+    创建新订单，并在同一事务中扣减限量菜品的库存；有分片被扣到 0 的菜品在提交后另行检查是否售罄。
+    不要在 db.transaction() 中调用: 显式事务会把分片锁一直持有到请求结束。
+    :param intake_ref: 排队下单的订单参考号 (唯一键，保证同一排队订单只写入一次)
+    :raises InsufficientStockError: 库存不足时回滚并抛出，由调用方返回明确的错误
+    """
+    # 在取出连接之前查询用户，请求级会话中两次查询可复用同一个连接
+    actual_customer_name = customer_name
+    if user_id:
+        user_info_dict = get_user_by_id(user_id)
+        if user_info_dict:
+            actual_customer_name = user_info_dict.get('full_name') or user_info_dict.get(
+                'username') or customer_name
+
     connection = create_connection()
     if not connection:
         return None
 
     cursor = connection.cursor()
     order_id = None
+    drained = []
     try:
+        # 读已提交: 条件 UPDATE 未命中的分片行不会一直锁到事务结束，各订单只按 菜品ID -> 分片ID 的顺序持有行锁，
+        # 并发下单不会互相死锁 (调用方已开启显式事务时无法再修改隔离级别，沿用默认级别)
+        if not connection.in_transaction:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
         order_query = """
-        INSERT INTO orders (user_id, customer_name, total_amount, payment_method, delivery_address, notes, status, payment_status)
-        VALUES (%s, %s, %s, %s, %s, %s, 'pending', 'unpaid') 
+        INSERT INTO orders (tenant_id, user_id, customer_name, total_amount, payment_method, delivery_address, notes, intake_ref, status, payment_status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'pending', 'unpaid') 
         """
-        actual_customer_name = customer_name
-        if user_id:
-            user_info_dict = get_user_by_id(user_id)
-            if user_info_dict:
-                actual_customer_name = user_info_dict.get('full_name') or user_info_dict.get(
-                    'username') or customer_name
-
-        order_params = (user_id, actual_customer_name, total_amount, payment_method, delivery_address, notes)
+        order_params = (current_tenant_id(), user_id, actual_customer_name, total_amount, payment_method,
+                        delivery_address, notes, intake_ref)
         cursor.execute(order_query, order_params)
         order_id = cursor.lastrowid
 
         if not order_id:
             raise Exception("创建订单失败，未能获取订单ID")
 
+        drained = _reserve_stock(cursor, items_data)
+
         item_query = """
         INSERT INTO order_items (order_id, menu_item_id, quantity, unit_price, subtotal, special_requests)
         VALUES (%s, %s, %s, %s, %s, %s)
@@ -281,54 +1245,90 @@ def create_order(total_amount, items_data, user_id=None, customer_name="匿名
 
         connection.commit()
         # print(f"订单 {order_id} 创建成功，包含 {len(order_items_to_insert)} 个订单项。")
-        return order_id
+    except InsufficientStockError:
+        if connection.is_connected():
+            connection.rollback()
+        raise
     except Error as e:
-        print(f"创建订单时发生数据库错误: '{e}'")
+        logger.error(f"创建订单时发生数据库错误: '{e}'")
         if connection.is_connected():
             connection.rollback()
         return None
     except Exception as ex:
-        print(f"创建订单时发生一般错误: '{ex}'")
+        logger.error(f"创建订单时发生一般错误: '{ex}'")
         if connection.is_connected():
             connection.rollback()
         return None
     finally:
-        if connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
+        _close_connection(connection, cursor)
 
+    if drained:
+        _disable_sold_out_items(drained)
+    return order_id
 
-def get_order_details_by_id(order_id):
-    """获取单个订单的详细信息，包括订单项和用户信息(如果存在)"""
-    order_query = """
-    SELECT o.*, u.username as user_username, u.full_name as user_full_name, u.email as user_email, u.phone as user_phone
-    FROM orders o
-    LEFT JOIN users u ON o.user_id = u.id
-    WHERE o.id = %s
-    """
-    order_data = execute_query(order_query, (order_id,), fetch_one=True, dictionary_cursor=True)
 
-    if not order_data:
-        return None
+def get_order_id_by_intake_ref(intake_ref):
+    """根据排队下单的参考号查询已写入的订单ID，不存在时返回 None"""
+    query = "SELECT id FROM orders WHERE intake_ref = %s AND tenant_id = %s"
+    result = execute_query(query, (intake_ref, current_tenant_id()), fetch_one=True, dictionary_cursor=True)
+    return result['id'] if result else None
 
-    items_query = """
-    SELECT oi.quantity, oi.unit_price, oi.subtotal, oi.special_requests, mi.name as item_name, mi.image_url as item_image_url
-    FROM order_items oi
-    JOIN menu_items mi ON oi.menu_item_id = mi.id
-    WHERE oi.order_id = %s
+
+MAX_ORDER_DETAILS_BATCH = 100     # 批量获取订单详情时一次最多的订单数
+
+
+def get_order_details_by_ids(order_ids):
     """
-    order_items = execute_query(items_query, (order_id,), fetch_all=True, dictionary_cursor=True)
+    批量获取订单详情 (含订单项和下单用户信息)。
+    近期表中的订单用两条集合查询取回 (订单 JOIN 用户、订单项 JOIN 菜品)，在内存中按订单组装；
+    近期表中找不到的订单再以同样方式到归档表中查找。
+    :return: {订单ID: 订单详情}，不存在的订单不在结果中
+    """
+    remaining = list(dict.fromkeys(int(order_id) for order_id in order_ids))
+    orders = {}
+    for orders_table, items_table in (('orders', 'order_items'), ('orders_archive', 'order_items_archive')):
+        if not remaining:
+            break
+        placeholders = ', '.join(['%s'] * len(remaining))
+        order_query = f"""
+        SELECT o.*, u.username as user_username, u.full_name as user_full_name, u.email as user_email, u.phone as user_phone
+        FROM {orders_table} o
+        LEFT JOIN users u ON o.user_id = u.id
+        WHERE o.id IN ({placeholders}) AND o.tenant_id = %s
+        """
+        found = execute_query(order_query, (*remaining, current_tenant_id()), fetch_all=True, dictionary_cursor=True)
+        if not found:
+            continue
+
+        found_ids = [order['id'] for order in found]
+        for order in found:
+            order['items'] = []
+            order['archived'] = orders_table == 'orders_archive'
+            orders[order['id']] = order
+
+        items_query = f"""
+        SELECT oi.order_id, oi.quantity, oi.unit_price, oi.subtotal, oi.special_requests, mi.name as item_name, mi.image_url as item_image_url
+        FROM {items_table} oi
+        JOIN menu_items mi ON oi.menu_item_id = mi.id
+        WHERE oi.order_id IN ({', '.join(['%s'] * len(found_ids))})
+        ORDER BY oi.order_id, oi.id
+        """
+        for item in execute_query(items_query, tuple(found_ids), fetch_all=True, dictionary_cursor=True) or []:
+            orders[item.pop('order_id')]['items'].append(item)
+        remaining = [order_id for order_id in remaining if order_id not in orders]
+    return orders
+
 
-    order_data['items'] = order_items
-    return order_data
+def get_order_details_by_id(order_id):
+    """获取单个订单的详细信息，包括订单项和用户信息(如果存在)；近期表中不存在时回退到归档表"""
+    return get_order_details_by_ids([order_id]).get(int(order_id))
 
 
-def get_orders_by_user_id(user_id, page=1, per_page=10):
-    """获取特定用户的所有订单（分页）"""
+def get_orders_by_user_id(user_id, page=1, per_page=10, fields=None):
+    """获取特定用户的所有订单（分页），fields 为可选的字段投影 (须来自 USER_ORDER_FIELDS)"""
     offset = (page - 1) * per_page
-    query = """
-    SELECT o.id, o.order_time, o.total_amount, o.status, o.payment_status
+    query = f"""
+    SELECT {_build_select_list(fields, USER_ORDER_FIELDS, USER_ORDER_DEFAULT_FIELDS)}
     FROM orders o
     WHERE o.user_id = %s
     ORDER BY o.order_time DESC
@@ -344,20 +1344,19 @@ def get_orders_by_user_id(user_id, page=1, per_page=10):
 
 
 def get_all_orders_admin(page=1, per_page=10, status_filter=None, user_id_filter=None, sort_by='order_time',
-                         sort_order='DESC'):
-    """管理员获取所有订单（分页，可筛选，可排序）"""
+                         sort_order='DESC', fields=None):
+    """管理员获取所有订单（分页，可筛选，可排序），fields 为可选的字段投影 (须来自 ADMIN_ORDER_FIELDS)"""
     offset = (page - 1) * per_page
-    base_query = """
-    SELECT o.id, o.order_time, o.total_amount, o.status, o.payment_status, o.customer_name, 
-           u.username as user_username, u.id as user_id_from_user_table
+    base_query = f"""
+    SELECT {_build_select_list(fields, ADMIN_ORDER_FIELDS, ADMIN_ORDER_DEFAULT_FIELDS)}
     FROM orders o
     LEFT JOIN users u ON o.user_id = u.id
     """
     count_base_query = "SELECT COUNT(*) as total_orders FROM orders o LEFT JOIN users u ON o.user_id = u.id"
 
-    conditions = []
-    params_for_main_query = []
-    params_for_count_query = []
+    conditions = ["o.tenant_id = %s"]
+    params_for_main_query = [current_tenant_id()]
+    params_for_count_query = [current_tenant_id()]
 
     if status_filter:
         conditions.append("o.status = %s")
@@ -370,13 +1369,12 @@ def get_all_orders_admin(page=1, per_page=10, status_filter=None, user_id_filter
             params_for_main_query.append(user_id_val)
             params_for_count_query.append(user_id_val)
         except ValueError:
-            print(f"警告: 无效的用户ID筛选值 '{user_id_filter}', 已忽略。")
+            logger.warning(f"无效的用户ID筛选值 '{user_id_filter}', 已忽略。")
             pass
 
-    if conditions:
-        where_clause = " WHERE " + " AND ".join(conditions)
-        base_query += where_clause
-        count_base_query += where_clause
+    where_clause = " WHERE " + " AND ".join(conditions)
+    base_query += where_clause
+    count_base_query += where_clause
 
     allowed_sort_by = ['order_time', 'total_amount', 'status', 'id']
     db_sort_by = 'o.order_time'
@@ -385,7 +1383,7 @@ def get_all_orders_admin(page=1, per_page=10, status_filter=None, user_id_filter
     elif sort_by == 'user_username':
         db_sort_by = "u.username"
     else:
-        print(f"警告: 不允许的排序字段 '{sort_by}', 使用默认排序 'o.order_time'.")
+        logger.warning(f"不允许的排序字段 '{sort_by}', 使用默认排序 'o.order_time'.")
 
     if sort_order.upper() not in ['ASC', 'DESC']:
         sort_order_safe = 'DESC'
@@ -404,67 +1402,399 @@ def get_all_orders_admin(page=1, per_page=10, status_filter=None, user_id_filter
     return {"orders": orders, "total_orders": total_orders, "page": page, "per_page": per_page}
 
 
-def update_order_status_admin(order_id, new_status, admin_user_id):
-    """管理员更新订单状态，并记录到历史表"""
+# --- 管理员订单搜索 ---
+# 每种条件组合都由一个以 tenant_id 开头的索引支撑 (见 database_setup.sql)，并用 FORCE INDEX 固定执行计划：
+# - phone / 用户名前缀: 先在 users 的唯一索引上查出用户ID，再按 idx_orders_tenant_user_time 取订单
+# - 顾客名前缀: idx_orders_tenant_customer (customer_name 前缀范围扫描)，与用户名匹配到的订单取并集
+# - 支付状态 / 订单状态: idx_orders_tenant_payment_time / idx_orders_tenant_status_time (等值 + 时间范围)
+# - 只有时间范围: idx_orders_tenant_time；只有金额范围: idx_orders_tenant_amount
+ORDER_SEARCH_MAX_MATCHED_USERS = 200   # 用户名前缀最多匹配的用户数，超过时要求输入更长的前缀
+
+
+def _like_prefix(prefix):
+    """转义 LIKE 通配符后生成前缀匹配模式"""
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _plan_order_search(criteria):
+    """为没有顾客/电话条件的搜索选择驱动索引"""
+    if criteria.get('payment_status'):
+        return 'idx_orders_tenant_payment_time'
+    if criteria.get('status'):
+        return 'idx_orders_tenant_status_time'
+    if criteria.get('date_from') or criteria.get('date_to') or not (
+            criteria.get('min_amount') is not None or criteria.get('max_amount') is not None):
+        return 'idx_orders_tenant_time'
+    return 'idx_orders_tenant_amount'
+
+
+def search_orders_admin(criteria, page=1, per_page=10, fields=None, explain=False):
+    """
+    管理员订单搜索，返回与 get_all_orders_admin 相同的分页结构 (按下单时间倒序)。
+    :param criteria: 可包含 customer (顾客名或用户名前缀)、phone (下单用户手机号)、date_from / date_to (下单时间，
+                     date_to 不含)、min_amount / max_amount、payment_status、status
+    :param explain: 为 True 时附带主查询的 EXPLAIN 结果和所选索引，用于核对执行计划
+    :return: 分页结果；数据库错误时返回 None
+    :raises ValueError: 顾客前缀匹配到的用户超过 ORDER_SEARCH_MAX_MATCHED_USERS 个
+    """
+    tenant_id = current_tenant_id()
+    empty = {"orders": [], "total_orders": 0, "page": page, "per_page": per_page}
+
+    phone_user_ids = None
+    if criteria.get('phone'):
+        # 标量子查询总是返回一行：行为 None 表示数据库错误，id 为 None 表示没有该用户
+        user = execute_query("SELECT (SELECT id FROM users WHERE tenant_id = %s AND phone = %s) AS id",
+                             (tenant_id, criteria['phone']), fetch_one=True, dictionary_cursor=True)
+        if user is None:
+            return None
+        if user['id'] is None:
+            return empty
+        phone_user_ids = [user['id']]
+
+    customer_pattern = _like_prefix(criteria['customer']) if criteria.get('customer') else None
+    username_user_ids = []
+    if customer_pattern:
+        rows = execute_query("SELECT id FROM users WHERE tenant_id = %s AND username LIKE %s LIMIT %s",
+                             (tenant_id, customer_pattern, ORDER_SEARCH_MAX_MATCHED_USERS + 1),
+                             fetch_all=True, dictionary_cursor=True)
+        if rows is None:
+            return None
+        if len(rows) > ORDER_SEARCH_MAX_MATCHED_USERS:
+            raise ValueError(f"顾客前缀 '{criteria['customer']}' 匹配到的用户超过 {ORDER_SEARCH_MAX_MATCHED_USERS} 个，"
+                             f"请输入更长的前缀")
+        username_user_ids = [row['id'] for row in rows]
+
+    # 除顾客条件外的过滤条件 (作用于订单表 o)
+    conditions = ["o.tenant_id = %s"]
+    params = [tenant_id]
+    for column, key, op in (('order_time', 'date_from', '>='), ('order_time', 'date_to', '<'),
+                            ('total_amount', 'min_amount', '>='), ('total_amount', 'max_amount', '<='),
+                            ('payment_status', 'payment_status', '='), ('status', 'status', '=')):
+        if criteria.get(key) is not None and criteria.get(key) != '':
+            conditions.append(f"o.{column} {op} %s")
+            params.append(criteria[key])
+
+    def in_list(values):
+        return ', '.join(['%s'] * len(values))
+
+    if phone_user_ids is not None:
+        index = 'idx_orders_tenant_user_time'
+        from_clause = f"FROM orders o FORCE INDEX ({index}) LEFT JOIN users u ON o.user_id = u.id"
+        conditions.append(f"o.user_id IN ({in_list(phone_user_ids)})")
+        params.extend(phone_user_ids)
+        if customer_pattern:
+            if username_user_ids:
+                conditions.append(f"(o.customer_name LIKE %s OR o.user_id IN ({in_list(username_user_ids)}))")
+                params.extend([customer_pattern, *username_user_ids])
+            else:
+                conditions.append("o.customer_name LIKE %s")
+                params.append(customer_pattern)
+        from_params = []
+    elif customer_pattern:
+        # 顾客名前缀与用户名前缀分别走各自的索引，取订单ID的并集后再回表过滤
+        # 时间范围同时下推到子查询中，由索引末尾的 order_time 列过滤
+        index = 'idx_orders_tenant_customer + idx_orders_tenant_user_time'
+        time_conditions, time_params = "", []
+        for key, op in (('date_from', '>='), ('date_to', '<')):
+            if criteria.get(key):
+                time_conditions += f" AND order_time {op} %s"
+                time_params.append(criteria[key])
+        subqueries = ["SELECT id FROM orders FORCE INDEX (idx_orders_tenant_customer) "
+                      f"WHERE tenant_id = %s AND customer_name LIKE %s{time_conditions}"]
+        from_params = [tenant_id, customer_pattern, *time_params]
+        if username_user_ids:
+            subqueries.append(f"SELECT id FROM orders FORCE INDEX (idx_orders_tenant_user_time) "
+                              f"WHERE tenant_id = %s AND user_id IN ({in_list(username_user_ids)}){time_conditions}")
+            from_params.extend([tenant_id, *username_user_ids, *time_params])
+        from_clause = (f"FROM ({' UNION '.join(subqueries)}) matched "
+                       f"JOIN orders o ON o.id = matched.id LEFT JOIN users u ON o.user_id = u.id")
+    else:
+        index = _plan_order_search(criteria)
+        from_clause = f"FROM orders o FORCE INDEX ({index}) LEFT JOIN users u ON o.user_id = u.id"
+        from_params = []
+
+    where_clause = " WHERE " + " AND ".join(conditions)
+    query = f"""
+    SELECT {_build_select_list(fields, ADMIN_ORDER_FIELDS, ADMIN_ORDER_DEFAULT_FIELDS)}
+    {from_clause}{where_clause}
+    ORDER BY o.order_time DESC, o.id DESC
+    LIMIT %s OFFSET %s
+    """
+    main_params = (*from_params, *params, per_page, (page - 1) * per_page)
+    orders = execute_query(query, main_params, fetch_all=True, dictionary_cursor=True)
+
+    # 过滤条件不涉及 users 表，计数时省去连接
+    count_from = from_clause.replace(" LEFT JOIN users u ON o.user_id = u.id", "")
+    count_query = f"SELECT COUNT(*) as total_orders {count_from}{where_clause}"
+    total_result = execute_query(count_query, (*from_params, *params), fetch_one=True, dictionary_cursor=True)
+    if orders is None or total_result is None:
+        return None
+    result = {"orders": orders, "total_orders": total_result['total_orders'],
+              "page": page, "per_page": per_page}
+    if explain:
+        result['plan'] = {
+            "index": index,
+            "explain": execute_query(f"EXPLAIN {query}", main_params, fetch_all=True, dictionary_cursor=True),
+        }
+    return result
+
+
+def get_order_item_sets(after_order_id=0, limit=1000):
+    """
+    按订单ID升序分批读取当前租户每个订单包含的菜品 (不含已取消的订单)，供推荐模型统计共现次数。
+    :return: [(order_id, [menu_item_id, ...]), ...]
+    """
+    query = """
+    SELECT o.id as order_id, GROUP_CONCAT(DISTINCT oi.menu_item_id) as item_ids
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.tenant_id = %s AND o.id > %s AND o.status <> 'cancelled'
+    GROUP BY o.id
+    ORDER BY o.id
+    LIMIT %s
+    """
+    rows = execute_query(query, (current_tenant_id(), after_order_id, limit), fetch_all=True, dictionary_cursor=True)
+    return [(row['order_id'], [int(i) for i in row['item_ids'].split(',')]) for row in rows or []]
+
+
+def get_order_item_ids(order_id):
+    """当前租户某个订单包含的菜品ID列表 (不论订单状态)；数据库错误时返回 None"""
+    query = """
+    SELECT DISTINCT oi.menu_item_id
+    FROM order_items oi
+    JOIN orders o ON o.id = oi.order_id
+    WHERE o.id = %s AND o.tenant_id = %s
+    """
+    rows = execute_query(query, (order_id, current_tenant_id()), fetch_all=True, dictionary_cursor=True)
+    if rows is None:
+        return None
+    return [row['menu_item_id'] for row in rows]
+
+
+# --- 跨餐厅 (集团) 汇总查询：并行下发到各租户所在分片，再在内存中合并 ---
+def get_group_orders_admin(page=1, per_page=10, status_filter=None, sort_by='order_time', sort_order='DESC',
+                           tenant_ids=None):
+    """
+    集团管理员获取所有餐厅的订单 (分页)。
+    每个租户取前 page*per_page 条，合并排序后再截取当前页，结果中附带 tenant_id。
+    """
+    if sort_by not in ('order_time', 'total_amount', 'status', 'id', 'user_username'):
+        sort_by = 'order_time'
+    descending = str(sort_order).upper() != 'ASC'
+    window = page * per_page
+
+    per_tenant = fan_out(get_all_orders_admin, 1, window, status_filter, None, sort_by, sort_order,
+                         tenant_ids=tenant_ids)
+
+    merged = []
+    total_orders = 0
+    for tenant_id, result in per_tenant.items():
+        total_orders += result['total_orders']
+        for order in result['orders'] or []:
+            order['tenant_id'] = tenant_id
+            merged.append(order)
+
+    # None 值始终排在最后
+    present = [o for o in merged if o.get(sort_by) is not None]
+    missing = [o for o in merged if o.get(sort_by) is None]
+    present.sort(key=lambda o: o[sort_by], reverse=descending)
+    merged = present + missing
+
+    offset = (page - 1) * per_page
+    return {"orders": merged[offset:offset + per_page], "total_orders": total_orders, "page": page,
+            "per_page": per_page}
+
+
+def get_tenant_sales_summary():
+    """当前餐厅的订单数、营业额和待处理订单数"""
+    query = """
+    SELECT COUNT(*) as total_orders,
+           COALESCE(SUM(CASE WHEN status <> 'cancelled' THEN total_amount ELSE 0 END), 0) as total_revenue,
+           COALESCE(SUM(status = 'pending'), 0) as pending_orders
+    FROM orders WHERE tenant_id = %s
+    """
+    return execute_query(query, (current_tenant_id(),), fetch_one=True, dictionary_cursor=True)
+
+
+def get_group_sales_summary(tenant_ids=None):
+    """集团汇总：并行获取每家餐厅的销售概况并合计"""
+    per_tenant = fan_out(get_tenant_sales_summary, tenant_ids=tenant_ids)
+    restaurants = []
+    totals = {"total_orders": 0, "total_revenue": 0, "pending_orders": 0}
+    for tenant_id, summary in sorted(per_tenant.items()):
+        summary = summary or {"total_orders": 0, "total_revenue": 0, "pending_orders": 0}
+        restaurants.append({"tenant_id": tenant_id, **summary})
+        for key in totals:
+            totals[key] += summary[key] or 0
+    return {"restaurants": restaurants, "totals": totals}
+
+
+def transition_order(order_id, field, new_value, user_id=None, changed_by_user_id=None):
+    """
+    按订单状态机转换订单的 status 或 payment_status。
+    转换以一条条件更新 (compare-and-set) 完成：
+        UPDATE orders SET <field> = ? WHERE id = ? AND tenant_id = ? AND <field> IN (合法的前驱状态) [AND user_id = ?]
+    受影响行数就是结果，无需先查询再更新；并发的转换 (例如员工取消与顾客支付) 只有一个能成功，不会丢失更新。
+    只有转换失败时才额外查询一次订单，用于区分失败原因。
+    - 支付成功 ('paid') 时同时记录支付时间 paid_at
+    - 订单被取消时在同一事务中归还库存
+    - 状态变更历史由 after_order_status_update 触发器写入，changed_by_user_id 通过会话变量 @current_user_id 传给触发器
+    :param field: 'status' 或 'payment_status'
+    :param user_id: 指定时要求订单属于该用户 (顾客操作自己的订单)
+    :return: (转换结果 order_states.APPLIED/UNCHANGED/NOT_FOUND/FORBIDDEN/INVALID, 订单当前的 field 值)；数据库错误时返回 (None, None)
+    :raises ValueError: new_value 不是合法状态
+    """
+    sources = order_states.allowed_sources(field, new_value)
     connection = create_connection()
     if not connection:
-        return False
+        return None, None
 
     cursor = connection.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT status FROM orders WHERE id = %s", (order_id,))
+        applied = False
+        if sources:
+            assignments = [f"{field} = %s", "updated_at = CURRENT_TIMESTAMP"]
+            if field == 'payment_status' and new_value == 'paid':
+                assignments.append("paid_at = CURRENT_TIMESTAMP")
+            conditions = ["id = %s", "tenant_id = %s", f"{field} IN ({', '.join(['%s'] * len(sources))})"]
+            params = [new_value, order_id, current_tenant_id(), *sources]
+            blocking = order_states.PAYMENT_BLOCKING_ORDER_STATUSES.get(new_value, ()) if field == 'payment_status' else ()
+            if blocking:
+                conditions.append(f"status NOT IN ({', '.join(['%s'] * len(blocking))})")
+                params.extend(blocking)
+            if user_id is not None:
+                conditions.append("user_id = %s")
+                params.append(user_id)
+
+            if field == 'status' and changed_by_user_id is not None:
+                # 连接归还连接池时会重置会话，会话变量不会泄漏给后续请求
+                cursor.execute("SET @current_user_id = %s", (changed_by_user_id,))
+            cursor.execute(f"UPDATE orders SET {', '.join(assignments)} WHERE {' AND '.join(conditions)}",
+                           tuple(params))
+            applied = cursor.rowcount == 1
+
+        if applied:
+            if field == 'status' and new_value == 'cancelled':
+                _release_stock(cursor, order_id)
+            connection.commit()
+            return order_states.APPLIED, new_value
+
+        connection.rollback()
+        cursor.execute(f"SELECT {field}, user_id FROM orders WHERE id = %s AND tenant_id = %s",
+                       (order_id, current_tenant_id()))
         order = cursor.fetchone()
         if not order:
-            return False
-        old_status = order['status']
+            return order_states.NOT_FOUND, None
+        current = order[field]
+        if user_id is not None and order['user_id'] != user_id:
+            return order_states.FORBIDDEN, None
+        if current == new_value:
+            return order_states.UNCHANGED, current
+        return order_states.INVALID, current
+    except Error as e:
+        logger.error(f"转换订单 {order_id} 的 {field} 为 '{new_value}' 时发生数据库错误: '{e}'")
+        if connection.is_connected():
+            connection.rollback()
+        return None, None
+    finally:
+        _close_connection(connection, cursor)
+
+# --- 幂等键存储函数 (可选，见 backend/idempotency.py) ---
+def get_idempotency_record(idempotency_key):
+    """获取未过期的幂等键记录"""
+    query = """
+    SELECT idempotency_key, request_fingerprint, status_code, response_body
+    FROM idempotency_keys
+    WHERE idempotency_key = %s AND expires_at > CURRENT_TIMESTAMP
+    """
+    return execute_query(query, (idempotency_key,), fetch_one=True, dictionary_cursor=True)
 
-        if old_status == new_status:
-            return True
 
-        cursor.execute("UPDATE orders SET status = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                       (new_status, order_id))
+def save_idempotency_record(idempotency_key, request_fingerprint, status_code, response_body, ttl_seconds):
+    """保存已完成请求的响应，供重复请求重放"""
+    query = """
+    INSERT INTO idempotency_keys (idempotency_key, request_fingerprint, status_code, response_body, expires_at)
+    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + INTERVAL %s SECOND)
+    ON DUPLICATE KEY UPDATE request_fingerprint = VALUES(request_fingerprint), status_code = VALUES(status_code),
+        response_body = VALUES(response_body), expires_at = VALUES(expires_at)
+    """
+    params = (idempotency_key, request_fingerprint, status_code, response_body, ttl_seconds)
+    return execute_query(query, params, is_modify=True, dictionary_cursor=False)
 
-        history_query = """
-        INSERT INTO order_status_history (order_id, previous_status, new_status, changed_by_user_id, notes)
-        VALUES (%s, %s, %s, %s, %s)
-        """
-        notes_for_history = f"管理员 (ID: {admin_user_id}) 将状态从 '{old_status}' 修改为 '{new_status}'."
-        cursor.execute(history_query, (order_id, old_status, new_status, admin_user_id, notes_for_history))
+
+def delete_expired_idempotency_records():
+    """清理过期的幂等键记录"""
+    query = "DELETE FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP"
+    return execute_query(query, is_modify=True, dictionary_cursor=False)
+
+# --- 历史订单归档函数 ---
+ARCHIVABLE_ORDER_STATUSES = ('completed', 'cancelled', 'delivered')
+
+
+def archive_orders_batch(older_than_days, batch_size):
+    """
+    将一批超过 older_than_days 天的终态订单 (连同订单项、状态历史) 迁移到归档表。
+    每批在一个短事务内完成，只锁定本批订单行。
+    返回: 本批迁移的订单数 (0 表示没有可归档的订单)，数据库错误时返回 None
+    """
+    connection = create_connection()
+    if not connection:
+        return None
+
+    cursor = connection.cursor()
+    try:
+        status_placeholders = ", ".join(["%s"] * len(ARCHIVABLE_ORDER_STATUSES))
+        cursor.execute(f"""
+            SELECT id FROM orders
+            WHERE status IN ({status_placeholders}) AND order_time < CURRENT_TIMESTAMP - INTERVAL %s DAY
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE
+        """, (*ARCHIVABLE_ORDER_STATUSES, older_than_days, batch_size))
+        order_ids = [row[0] for row in cursor.fetchall()]
+        if not order_ids:
+            connection.rollback()
+            return 0
+
+        id_placeholders = ", ".join(["%s"] * len(order_ids))
+        ids = tuple(order_ids)
+        cursor.execute(f"INSERT IGNORE INTO orders_archive SELECT * FROM orders WHERE id IN ({id_placeholders})", ids)
+        cursor.execute(f"INSERT IGNORE INTO order_items_archive SELECT * FROM order_items WHERE order_id IN ({id_placeholders})", ids)
+        cursor.execute(f"INSERT IGNORE INTO order_status_history_archive SELECT * FROM order_status_history WHERE order_id IN ({id_placeholders})", ids)
+        # order_items / order_status_history 通过 ON DELETE CASCADE 一并删除
+        cursor.execute(f"DELETE FROM orders WHERE id IN ({id_placeholders})", ids)
 
         connection.commit()
-        return True
+        return len(order_ids)
     except Error as e:
-        print(f"管理员更新订单 {order_id} 状态时发生数据库错误: '{e}'")
+        logger.error(f"归档历史订单时发生数据库错误: '{e}'")
         if connection.is_connected():
             connection.rollback()
-        return False
+        return None
     finally:
-        if connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
+        _close_connection(connection, cursor)
 
 # --- 分类管理函数 ---
 def get_all_categories():
     """获取所有菜品分类"""
-    query = "SELECT id, name, description, display_order FROM categories ORDER BY display_order, name"
-    return execute_query(query, fetch_all=True)
+    query = "SELECT id, name, description, display_order FROM categories WHERE tenant_id = %s ORDER BY display_order, name"
+    return execute_query(query, (current_tenant_id(),), fetch_all=True)
 
 
 def get_category_by_id(category_id):
     """根据ID获取单个分类信息"""
-    query = "SELECT id, name, description, display_order FROM categories WHERE id = %s"
-    return execute_query(query, (category_id,), fetch_one=True)
+    query = "SELECT id, name, description, display_order FROM categories WHERE id = %s AND tenant_id = %s"
+    return execute_query(query, (category_id, current_tenant_id()), fetch_one=True)
 
 def create_category(name, description=None, display_order=0):
     """创建新分类"""
-    query = "INSERT INTO categories (name, description, display_order) VALUES (%s, %s, %s)"
-    return execute_query(query, (name, description, display_order), is_modify=True)
+    query = "INSERT INTO categories (tenant_id, name, description, display_order) VALUES (%s, %s, %s, %s)"
+    return execute_query(query, (current_tenant_id(), name, description, display_order), is_modify=True)
 
 def update_category(category_id, name, description, display_order):
     """更新分类信息"""
-    query = "UPDATE categories SET name = %s, description = %s, display_order = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s"
-    affected_rows = execute_query(query, (name, description, display_order, category_id), is_modify=True, dictionary_cursor=False)
+    query = "UPDATE categories SET name = %s, description = %s, display_order = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND tenant_id = %s"
+    affected_rows = execute_query(query, (name, description, display_order, category_id, current_tenant_id()), is_modify=True, dictionary_cursor=False)
     return affected_rows is not None and affected_rows > 0
 
 def delete_category(category_id):
@@ -481,11 +1811,11 @@ def delete_category(category_id):
         if item_count and item_count['count'] > 0:
             return -1
         
-        delete_query = "DELETE FROM categories WHERE id = %s"
+        delete_query = "DELETE FROM categories WHERE id = %s"  # 已通过 get_category_by_id 校验属于当前餐厅
         affected_rows = execute_query(delete_query, (category_id,), is_modify=True, dictionary_cursor=False)
         return 1 if affected_rows is not None and affected_rows > 0 else 0
     except Error as e:
-        print(f"删除分类 {category_id} 时发生数据库错误: {e}")
+        logger.error(f"删除分类 {category_id} 时发生数据库错误: {e}")
         return -2
 
 ## --- 管理员用户管理函数 ---
@@ -498,21 +1828,22 @@ def get_all_users(page=1, per_page=10):
     query = """
         SELECT id, username, full_name, email, phone, role, created_at, last_login 
         FROM users 
+        WHERE tenant_id = %s
         ORDER BY created_at DESC 
         LIMIT %s OFFSET %s
     """
-    users = execute_query(query, (per_page, offset), fetch_all=True)
+    users = execute_query(query, (current_tenant_id(), per_page, offset), fetch_all=True)
     
-    count_query = "SELECT COUNT(*) as total FROM users"
-    total_result = execute_query(count_query, fetch_one=True)
+    count_query = "SELECT COUNT(*) as total FROM users WHERE tenant_id = %s"
+    total_result = execute_query(count_query, (current_tenant_id(),), fetch_one=True)
     total_users = total_result['total'] if total_result else 0
     
     return {"users": users, "total_users": total_users, "page": page, "per_page": per_page}
 
 def update_user_role(user_id, new_role):
     """管理员更新用户角色"""
-    query = "UPDATE users SET role = %s WHERE id = %s"
-    affected_rows = execute_query(query, (new_role, user_id), is_modify=True, dictionary_cursor=False)
+    query = "UPDATE users SET role = %s WHERE id = %s AND tenant_id = %s"
+    affected_rows = execute_query(query, (new_role, user_id, current_tenant_id()), is_modify=True, dictionary_cursor=False)
     return affected_rows is not None and affected_rows > 0
 
 def delete_user(user_id):
@@ -527,26 +1858,26 @@ def delete_user(user_id):
         order_check_query = "SELECT COUNT(*) as count FROM orders WHERE user_id = %s"
         order_count = execute_query(order_check_query, (user_id,), fetch_one=True)
         if order_count and order_count['count'] > 0:
-            print(f"警告：用户 {user_id} 存在关联订单，删除用户后，这些订单的 user_id 将变为 NULL。")
+            logger.warning(f"用户 {user_id} 存在关联订单，删除用户后，这些订单的 user_id 将变为 NULL。")
 
-        delete_query = "DELETE FROM users WHERE id = %s"
+        delete_query = "DELETE FROM users WHERE id = %s"  # 已通过 get_user_by_id 校验属于当前餐厅
         affected_rows = execute_query(delete_query, (user_id,), is_modify=True, dictionary_cursor=False)
         return 1 if affected_rows is not None and affected_rows > 0 else 0
     except Error as e:
-        print(f"删除用户 {user_id} 时发生数据库错误: {e}")
+        logger.error(f"删除用户 {user_id} 时发生数据库错误: {e}")
         return -2
 
 # --- 分类管理函数 ---
 def get_all_categories():
     """获取所有菜品分类"""
-    query = "SELECT id, name, description, display_order FROM categories ORDER BY display_order, name"
-    return execute_query(query, fetch_all=True, dictionary_cursor=True)
+    query = "SELECT id, name, description, display_order FROM categories WHERE tenant_id = %s ORDER BY display_order, name"
+    return execute_query(query, (current_tenant_id(),), fetch_all=True, dictionary_cursor=True)
 
 
 def get_category_by_id(category_id):
     """根据ID获取单个分类信息"""
-    query = "SELECT id, name, description, display_order FROM categories WHERE id = %s"
-    return execute_query(query, (category_id,), fetch_one=True, dictionary_cursor=True)
+    query = "SELECT id, name, description, display_order FROM categories WHERE id = %s AND tenant_id = %s"
+    return execute_query(query, (category_id, current_tenant_id()), fetch_one=True, dictionary_cursor=True)
 
 
 if __name__ == '__main__':
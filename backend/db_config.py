@@ -9,6 +9,37 @@ DB_CONFIG = {
     'port': 3306                # MySQL端口号, 默认3306
 }
 
+# 分片配置：每个分片是一套独立的 MySQL 连接参数 (可以位于不同主机或不同数据库)，各自拥有独立的连接池
+DB_SHARDS = {
+    'shard0': DB_CONFIG,
+    # 'shard1': {**DB_CONFIG, 'host': 'db2.internal', 'database': 'restaurant_db'},
+}
+
+# 租户 (餐厅) -> 分片 的路由表。新增一家餐厅只需在此添加一行 (并在对应分片上执行 database_setup.sql)
+TENANT_SHARDS = {
+    1: 'shard0',
+    # 2: 'shard1',
+}
+DEFAULT_TENANT_ID = 1             # 请求未指定租户时使用的默认餐厅
+GROUP_ADMIN_TENANT_IDS = {1}      # 这些租户 (集团总部) 的管理员可以执行跨餐厅的汇总查询
+
+# 连接池配置 (每个分片一个连接池)
+DB_POOL_SIZE = 10                 # 连接池大小 (mysql-connector 上限为 32)
+DB_POOL_CHECKOUT_TIMEOUT = 5      # 连接池耗尽时，等待空闲连接的最长秒数
+
+# 库存分片数：每道限量菜品的库存被拆分到多行计数器上，下单时随机选择分片扣减，避免热点行锁排队
+STOCK_SHARDS = 8
+
+# 历史订单归档配置：终态订单 (completed/cancelled/delivered) 超过指定天数后分批迁移到 *_archive 表
+ARCHIVE_AFTER_DAYS = 90           # 订单下单多少天后归档
+ARCHIVE_BATCH_SIZE = 500          # 每批迁移的订单数 (每批一个短事务)
+ARCHIVE_INTERVAL_SECONDS = 3600   # 定时归档任务的执行间隔
+
+# 菜单增量同步配置 (/api/menu/changes)
+MENU_CHANGES_SETTLE_SECONDS = 5      # 返回的版本号只推进到该时间之前的变更，之后的变更下次同步时会再次下发 (防止漏掉提交较晚的事务)
+MENU_CHANGES_MAX_ENTITIES = 500      # 一次增量同步最多返回的变更菜品/分类数，超过时要求客户端全量刷新
+MENU_CHANGES_RETENTION_DAYS = 7      # 变更日志保留天数 (由归档任务清理)，版本号早于清理位置的客户端需要全量刷新
+
 # 强烈建议: 不要将敏感信息（如密码）直接硬编码在代码中。
 # 在生产环境中，应使用环境变量、配置文件或密钥管理服务来存储这些信息。
 # 例如, 可以从环境变量读取:
@@ -0,0 +1,271 @@
+# backend/frontend_assets.py
+# 前端静态资源构建与发布：JS/CSS 文件名加入内容哈希 (内容变化即换名，可被浏览器永久缓存)，
+# HTML 中的引用改写为带哈希的文件名，并预先生成 gzip / brotli 压缩版本，由后端直接返回压缩文件。
+# 每次构建写入新的版本目录，frontend_dist 是指向当前版本的符号链接，发布时原子替换链接；
+# 上一版本中的带哈希资源会复制到新版本中，已加载旧页面的浏览器仍能取到旧资源。
+# 构建: python -m backend.frontend_assets
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl  # 仅 POSIX 可用；不可用时只在进程内加锁
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRONTEND_SOURCE_DIR = os.path.join(_PROJECT_ROOT, 'frontend')
+FRONTEND_DIST_DIR = os.path.join(_PROJECT_ROOT, 'frontend_dist')
+
+HASHED_EXTENSIONS = ('.js', '.css')          # 这些资源加内容哈希，发布到 assets/ 下
+PAGE_EXTENSIONS = ('.html',)                 # 页面保留原文件名，引用改写后发布到根目录
+ASSET_MAX_AGE = 365 * 24 * 3600              # 带哈希的资源内容不会变化，长期缓存 (immutable)
+HTML_MAX_AGE = 60                            # 页面短期缓存，过期后凭 ETag 重新验证
+COMPRESS_MIN_BYTES = 512                     # 小于该大小的文件不生成压缩版本
+
+MIMETYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+}
+# 预压缩版本: 编码名 -> 文件后缀 (按优先级排列)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+MANIFEST_NAME = 'manifest.json'
+
+# HTML 中引用本地资源的属性 (src="script.js" / href="style.css")
+_REFERENCE_PATTERN = re.compile(r'(\b(?:src|href)=")([^"#?:]+)(")')
+
+
+def _content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _write_variants(path, data):
+    """写入文件及其预压缩版本，返回生成的编码列表"""
+    with open(path, 'wb') as f:
+        f.write(data)
+    encodings = []
+    if len(data) < COMPRESS_MIN_BYTES:
+        return encodings
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        with open(path + '.gz', 'wb') as f:
+            f.write(compressed)
+        encodings.append('gzip')
+    try:
+        import brotli  # 只在构建时需要，未安装时只生成 gzip 版本
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            with open(path + '.br', 'wb') as f:
+                f.write(compressed)
+            encodings.append('br')
+    return encodings
+
+
+_build_thread_lock = threading.Lock()
+
+
+@contextmanager
+def _build_lock(dist_dir):
+    """构建互斥 (跨进程)：同一时刻只有一个进程构建和发布"""
+    with _build_thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(dist_dir), exist_ok=True)
+        with open(f"{dist_dir}.lock", 'a+') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_manifest(dist_dir):
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _carry_over_assets(dist_dir, build_dir, manifest):
+    """把上一版本的带哈希资源 (及压缩版本) 复制到新版本，只保留一代，不会无限累积"""
+    try:
+        previous = _read_manifest(dist_dir)
+    except (OSError, ValueError):
+        return 0
+    carried = 0
+    for published in previous.get('assets', {}).values():
+        entry = previous['files'].get(published)
+        if entry is None or published in manifest['files']:
+            continue
+        try:
+            shutil.copy2(os.path.join(dist_dir, published), os.path.join(build_dir, published))
+            for encoding, suffix in ENCODINGS:
+                if encoding in entry['encodings']:
+                    shutil.copy2(os.path.join(dist_dir, published + suffix),
+                                 os.path.join(build_dir, published + suffix))
+        except OSError as e:
+            logger.warning(f"保留上一版本的前端资源 {published} 失败: {e}")
+            continue
+        manifest['files'][published] = entry
+        carried += 1
+    return carried
+
+
+def _publish(dist_dir, build_dir):
+    """把 dist_dir 指向新版本目录 (原子替换符号链接)，并删除其他版本目录"""
+    link_tmp = f"{dist_dir}.{os.getpid()}.link"
+    try:
+        if os.path.lexists(link_tmp):
+            os.remove(link_tmp)
+        os.symlink(os.path.basename(build_dir), link_tmp)
+    except (OSError, NotImplementedError):
+        # 不支持符号链接的平台 (例如未开启开发者模式的 Windows)：退回到整目录替换
+        old_dir = f"{dist_dir}.{os.getpid()}.old"
+        if os.path.isdir(dist_dir):
+            os.replace(dist_dir, old_dir)
+        os.replace(build_dir, dist_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return
+    if os.path.isdir(dist_dir) and not os.path.islink(dist_dir):
+        # 旧版本是普通目录 (升级前的布局)，只能先移走再放置链接
+        legacy_dir = f"{dist_dir}.{os.getpid()}.legacy"
+        os.replace(dist_dir, legacy_dir)
+    os.replace(link_tmp, dist_dir)
+
+    parent, prefix = os.path.dirname(dist_dir), os.path.basename(dist_dir) + '.'
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        if (name.startswith(prefix) and path != build_dir and os.path.isdir(path)
+                and not os.path.islink(path)):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def build(source_dir=FRONTEND_SOURCE_DIR, dist_dir=FRONTEND_DIST_DIR):
+    """
+    构建前端发布目录，返回资源清单:
+    {"assets": {原文件名: 带哈希的路径}, "files": {发布路径: {"etag", "encodings"}}}
+    files 中还包含从上一版本保留下来的带哈希资源
+    """
+    with _build_lock(dist_dir):
+        return _build(source_dir, dist_dir)
+
+
+def _build(source_dir, dist_dir):
+    build_dir = f"{dist_dir}.{time.time_ns()}.{os.getpid()}"
+    os.makedirs(os.path.join(build_dir, 'assets'))
+
+    manifest = {"assets": {}, "files": {}}
+    names = sorted(os.listdir(source_dir))
+    for name in names:
+        if not name.endswith(HASHED_EXTENSIONS):
+            continue
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            data = f.read()
+        digest = _content_hash(data)
+        stem, ext = os.path.splitext(name)
+        published = f"assets/{stem}.{digest}{ext}"
+        encodings = _write_variants(os.path.join(build_dir, published), data)
+        manifest['assets'][name] = published
+        manifest['files'][published] = {"etag": digest, "encodings": encodings}
+
+    def rewrite(match):
+        target = manifest['assets'].get(match.group(2))
+        return f"{match.group(1)}/{target}{match.group(3)}" if target else match.group(0)
+
+    for name in names:
+        if not name.endswith(PAGE_EXTENSIONS):
+            continue
+        with open(os.path.join(source_dir, name), 'r', encoding='utf-8') as f:
+            html = _REFERENCE_PATTERN.sub(rewrite, f.read())
+        data = html.encode('utf-8')
+        encodings = _write_variants(os.path.join(build_dir, name), data)
+        manifest['files'][name] = {"etag": _content_hash(data), "encodings": encodings}
+
+    carried = _carry_over_assets(dist_dir, build_dir, manifest)
+    with open(os.path.join(build_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 整版本切换，避免服务中的进程读到构建了一半的文件
+    _publish(dist_dir, build_dir)
+    logger.info(f"前端资源构建完成: {len(manifest['assets'])} 个资源, {len(manifest['files'])} 个发布文件 "
+                f"(保留上一版本资源 {carried} 个)")
+    return manifest
+
+
+_manifest_lock = threading.Lock()
+_manifest = None
+
+
+def get_manifest():
+    """
+    加载资源清单；发布目录不存在时先构建一次。
+    多个进程同时发现没有发布目录时，在构建锁内再检查一次，只有第一个进程实际构建
+    """
+    global _manifest
+    if _manifest is not None:
+        return _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            try:
+                _manifest = _read_manifest(FRONTEND_DIST_DIR)
+            except (OSError, ValueError):
+                with _build_lock(FRONTEND_DIST_DIR):
+                    try:
+                        _manifest = _read_manifest(FRONTEND_DIST_DIR)
+                    except (OSError, ValueError):
+                        _manifest = _build(FRONTEND_SOURCE_DIR, FRONTEND_DIST_DIR)
+    return _manifest
+
+
+def reload_manifest():
+    """重新构建后调用，使新的资源清单生效"""
+    global _manifest
+    with _manifest_lock:
+        _manifest = None
+    return get_manifest()
+
+
+def _accepted_encodings(accept_encoding):
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        if token and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            accepted.add(token.lower())
+    return accepted
+
+
+def resolve(published_path, accept_encoding):
+    """
+    查找发布文件。
+    :return: (磁盘路径, MIME 类型, 内容编码或 None, ETag, 是否为带哈希的资源)；文件不存在时返回 None
+    """
+    entry = get_manifest()['files'].get(published_path)
+    if entry is None:
+        return None
+    path = os.path.join(FRONTEND_DIST_DIR, published_path)
+    mimetype = MIMETYPES.get(os.path.splitext(published_path)[1], 'application/octet-stream')
+    accepted = _accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODINGS:
+        if encoding in entry['encodings'] and encoding in accepted:
+            return path + suffix, mimetype, encoding, f"{entry['etag']}-{encoding}", published_path.startswith('assets/')
+    return path, mimetype, None, entry['etag'], published_path.startswith('assets/')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    result = build()
+    for source, published in result['assets'].items():
+        print(f"{source} -> {published} ({', '.join(result['files'][published]['encodings']) or '未压缩'})")
@@ -0,0 +1,167 @@
+# backend/idempotency.py
+# Idempotency-Key 支持：重复的下单/支付请求不再重复执行，而是重放首次请求的响应
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, jsonify, make_response
+
+import backend.database as db
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600   # 已完成响应的保留时间
+IDEMPOTENCY_MAX_ENTRIES = 10000       # 内存中最多保留的键数量 (超出后淘汰最旧的)
+IDEMPOTENCY_WAIT_SECONDS = 10         # 并发重复请求等待首个请求完成的最长时间
+IDEMPOTENCY_USE_DB = False            # 为 True 时，已完成的响应同时写入 idempotency_keys 表 (多进程/重启后仍可重放)
+
+_IN_FLIGHT = 'in_flight'
+_DONE = 'done'
+
+
+class _Entry:
+    __slots__ = ('state', 'fingerprint', 'status_code', 'body', 'expires_at', 'event')
+
+    def __init__(self, fingerprint):
+        self.state = _IN_FLIGHT
+        self.fingerprint = fingerprint
+        self.status_code = None
+        self.body = None
+        self.expires_at = None
+        self.event = threading.Event()
+
+
+class IdempotencyStore:
+    """
+    有界、带 TTL 的幂等键存储。
+    begin() 返回以下结果之一：
+      ('new', entry)       - 首次请求，调用方负责执行并 complete()/release()
+      ('replay', entry)    - 已有完成的响应，直接重放
+      ('mismatch', entry)  - 同一个键被用于不同的请求体
+      ('in_flight', entry) - 等待超时，首个请求仍在处理中
+    正在处理中的重复请求会在 begin() 内等待首个请求完成。
+    """
+
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, use_db=IDEMPOTENCY_USE_DB):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.use_db = use_db
+
+    def begin(self, key, fingerprint, wait_seconds=IDEMPOTENCY_WAIT_SECONDS):
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            with self._lock:
+                self._evict_expired()
+                entry = self._entries.get(key)
+                if entry is None and self.use_db:
+                    entry = self._load_from_db(key)
+                if entry is None:
+                    entry = _Entry(fingerprint)
+                    self._entries[key] = entry
+                    self._evict_overflow()
+                    return 'new', entry
+                if entry.fingerprint != fingerprint:
+                    return 'mismatch', entry
+                if entry.state == _DONE:
+                    self._entries.move_to_end(key)
+                    return 'replay', entry
+                event = entry.event
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not event.wait(remaining):
+                return 'in_flight', entry
+            # 首个请求已结束 (完成或被释放)，重新检查
+
+    def complete(self, key, entry, status_code, body):
+        """记录首个请求的响应，并唤醒等待中的重复请求"""
+        with self._lock:
+            entry.state = _DONE
+            entry.status_code = status_code
+            entry.body = body
+            entry.expires_at = time.time() + self.ttl_seconds
+        if self.use_db:
+            db.save_idempotency_record(key, entry.fingerprint, status_code, json.dumps(body, default=str),
+                                       self.ttl_seconds)
+        entry.event.set()
+
+    def release(self, key, entry):
+        """首个请求失败 (服务器错误)，释放该键以便客户端重试时重新执行"""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.event.set()
+
+    def _load_from_db(self, key):
+        record = db.get_idempotency_record(key)
+        if not record:
+            return None
+        entry = _Entry(record['request_fingerprint'])
+        entry.state = _DONE
+        entry.status_code = record['status_code']
+        entry.body = json.loads(record['response_body'])
+        entry.expires_at = time.time() + self.ttl_seconds
+        entry.event.set()
+        self._entries[key] = entry
+        self._evict_overflow()
+        return entry
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [k for k, e in self._entries.items() if e.state == _DONE and e.expires_at <= now]
+        for k in expired:
+            del self._entries[k]
+
+    def _evict_overflow(self):
+        # 按最近使用顺序淘汰已完成的键；正在处理中的键不淘汰
+        overflow = len(self._entries) - self.max_entries
+        if overflow <= 0:
+            return
+        for k in [k for k, e in self._entries.items() if e.state == _DONE][:overflow]:
+            del self._entries[k]
+
+
+store = IdempotencyStore()
+
+
+def idempotent(f):
+    """
+    装饰器：为需要登录的写接口提供 Idempotency-Key 支持 (需放在 @token_required 之下)。
+    未携带该请求头时行为不变。键按 用户 + 方法 + 路径 隔离，并校验请求体指纹。
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        client_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not client_key:
+            return f(current_user, *args, **kwargs)
+        if len(client_key) > 128:
+            return jsonify({"error": f"{IDEMPOTENCY_HEADER} 长度不能超过128个字符"}), 400
+
+        key = f"{db.current_tenant_id()}:{current_user['id']}:{request.method}:{request.path}:{client_key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        outcome, entry = store.begin(key, fingerprint)
+        if outcome == 'mismatch':
+            return jsonify({"error": f"{IDEMPOTENCY_HEADER} 已被用于不同的请求内容"}), 422
+        if outcome == 'in_flight':
+            return jsonify({"error": "相同的请求正在处理中，请稍后重试"}), 409
+        if outcome == 'replay':
+            response = make_response(jsonify(entry.body), entry.status_code)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(f(current_user, *args, **kwargs))
+        except Exception:
+            store.release(key, entry)
+            raise
+
+        if response.status_code >= 500 or not response.is_json:
+            store.release(key, entry)
+        else:
+            store.complete(key, entry, response.status_code, response.get_json())
+        return response
+    return decorated
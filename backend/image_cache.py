@@ -0,0 +1,316 @@
+# backend/image_cache.py
+# 菜品图片代理：每个外部图片只抓取一次，原图按内容哈希存放在本地磁盘，并生成固定尺寸的 WebP/JPEG 缩略图
+import hashlib
+import http.client
+import importlib.util
+import io
+import ipaddress
+import json
+import logging
+import os
+import socket
+import ssl
+import threading
+import urllib.request
+from urllib.parse import urlparse
+
+# Pillow 在第一次生成缩略图时才导入；未安装 Pillow 时不生成缩略图，直接提供缓存的原图
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = 'image_cache'
+IMAGE_FETCH_TIMEOUT_SECONDS = 10
+IMAGE_MAX_SOURCE_BYTES = 10 * 1024 * 1024
+IMAGE_ALLOWED_SCHEMES = ('http', 'https')
+# 仅用于测试：允许 file:// 地址以及本机/内网地址 (用本地文件或本地 HTTP 服务代替图床)。
+# 生产环境必须关闭，否则任何能设置菜品图片的人都可以读取服务器文件或访问内网服务
+IMAGE_ALLOW_LOCAL_SOURCES = False
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600               # 图片地址不变时内容不变，浏览器可长期缓存
+
+# 缩略图规格: 名称 -> (宽, 高)，按比例缩放后居中裁剪为固定尺寸
+THUMBNAIL_SIZES = {
+    'small': (200, 150),
+    'medium': (400, 300),
+}
+DEFAULT_THUMBNAIL_SIZE = 'medium'
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+ORIGINAL_VARIANT = 'original'
+
+
+class ImageFetchError(Exception):
+    """抓取源图片失败 (网络错误、超时、不支持的地址或图片过大)"""
+
+
+def _allowed_schemes():
+    return IMAGE_ALLOWED_SCHEMES + ('file',) if IMAGE_ALLOW_LOCAL_SOURCES else IMAGE_ALLOWED_SCHEMES
+
+
+def _is_public_address(ip):
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_source_url(source_url):
+    """
+    校验菜品图片地址：只允许 http/https，且主机不能是本机或内网地址 (主机名在抓取时解析后再检查)。
+    :raises ValueError: 地址不受支持
+    """
+    parsed = urlparse(str(source_url))
+    if parsed.scheme not in _allowed_schemes():
+        raise ValueError(f"图片链接只支持 {'/'.join(_allowed_schemes())} 协议")
+    if parsed.scheme == 'file' or IMAGE_ALLOW_LOCAL_SOURCES:
+        return
+    host = parsed.hostname
+    if not host:
+        raise ValueError("图片链接缺少主机名")
+    if host == 'localhost' or host.endswith('.localhost'):
+        raise ValueError("图片链接不能指向本机或内网地址")
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return
+    if not _is_public_address(ip):
+        raise ValueError("图片链接不能指向本机或内网地址")
+
+
+def _create_public_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection 的替代：只连接公网地址。检查的是实际连接的地址，重定向和 DNS 重绑定都绕不过"""
+    host, port = address
+    try:
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ImageFetchError(f"无法解析图片主机 {host}: {e}") from e
+    last_error = None
+    for family, sock_type, proto, _, sockaddr in addresses:
+        if not IMAGE_ALLOW_LOCAL_SOURCES and not _is_public_address(ipaddress.ip_address(sockaddr[0].split('%')[0])):
+            raise ImageFetchError(f"拒绝抓取本机或内网地址: {host} ({sockaddr[0]})")
+        sock = socket.socket(family, sock_type, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            last_error = e
+    raise last_error or OSError(f"无法连接 {host}")
+
+
+class _PublicConnectionMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _create_public_connection
+
+
+class _PublicHTTPConnection(_PublicConnectionMixin, http.client.HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicConnectionMixin, http.client.HTTPSConnection):
+    pass
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=ssl.create_default_context())
+
+
+def _build_opener():
+    # 不使用环境变量中的代理 (否则检查的是代理地址)，也不注册 ftp 等其他协议的处理器
+    handlers = [urllib.request.ProxyHandler({}), _PublicHTTPHandler(), _PublicHTTPSHandler()]
+    if IMAGE_ALLOW_LOCAL_SOURCES:
+        handlers.append(urllib.request.FileHandler())
+    opener = urllib.request.OpenerDirector()
+    for handler in handlers + [urllib.request.UnknownHandler(), urllib.request.HTTPDefaultErrorHandler(),
+                               urllib.request.HTTPRedirectHandler(), urllib.request.HTTPErrorProcessor()]:
+        opener.add_handler(handler)
+    return opener
+
+
+_registry_lock = threading.Lock()
+_sources = {}                  # 图片键 -> {"url": 源地址, "sha256": 原图内容哈希 (抓取后才有)}
+_key_locks = {}                # 图片键/缩略图路径 -> 锁，保证并发请求时只抓取/生成一次
+
+
+def _path(*parts):
+    # 返回绝对路径 (Flask 的 send_file 会把相对路径解析到应用目录下)
+    return os.path.abspath(os.path.join(IMAGE_CACHE_DIR, *parts))
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _lock_for(name):
+    with _registry_lock:
+        return _key_locks.setdefault(name, threading.Lock())
+
+
+def image_key(source_url):
+    """源图片地址对应的图片键 (地址的 SHA-256 前 32 位)"""
+    return hashlib.sha256(source_url.encode('utf-8')).hexdigest()[:32]
+
+
+def _save_source(key, source):
+    _write_atomic(_path('sources', f"{key}.json"), json.dumps(source).encode('utf-8'))
+
+
+def _load_source(key):
+    with _registry_lock:
+        source = _sources.get(key)
+    if source is not None:
+        return source
+    try:
+        with open(_path('sources', f"{key}.json"), 'rb') as f:
+            source = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    with _registry_lock:
+        return _sources.setdefault(key, source)
+
+
+def register_source(source_url):
+    """登记一个可被代理的源图片地址 (只有登记过的地址才会被抓取)，返回图片键"""
+    key = image_key(source_url)
+    if _load_source(key) is None:
+        source = {"url": source_url, "sha256": None}
+        _save_source(key, source)
+        with _registry_lock:
+            _sources.setdefault(key, source)
+    return key
+
+
+def thumbnail_url(source_url, size=DEFAULT_THUMBNAIL_SIZE):
+    """返回源图片对应的代理地址 (相对于后端根路径)；源地址为空或不受支持时返回 None"""
+    if not source_url:
+        return None
+    try:
+        validate_source_url(source_url)
+    except ValueError:
+        return None
+    key = register_source(source_url)
+    if not PILLOW_AVAILABLE:
+        return f"/api/images/{key}/{ORIGINAL_VARIANT}"
+    return f"/api/images/{key}/{size}.webp"
+
+
+def _fetch(url):
+    try:
+        validate_source_url(url)
+    except ValueError as e:
+        raise ImageFetchError(f"不支持的图片地址 {url}: {e}") from e
+    request = urllib.request.Request(url, headers={'User-Agent': 'restaurant-image-proxy/1.0'})
+    try:
+        with _build_opener().open(request, timeout=IMAGE_FETCH_TIMEOUT_SECONDS) as response:
+            data = response.read(IMAGE_MAX_SOURCE_BYTES + 1)
+    except (OSError, ValueError) as e:
+        raise ImageFetchError(f"抓取图片失败: {e}") from e
+    if len(data) > IMAGE_MAX_SOURCE_BYTES:
+        raise ImageFetchError(f"图片超过 {IMAGE_MAX_SOURCE_BYTES} 字节")
+    if not data:
+        raise ImageFetchError("图片内容为空")
+    return data
+
+
+def _ensure_original(key):
+    """确保原图已缓存，返回 (源信息, 原图路径)"""
+    source = _load_source(key)
+    if source is None:
+        raise KeyError(key)
+    if source.get('sha256'):
+        path = _path('objects', source['sha256'][:2], source['sha256'])
+        if os.path.exists(path):
+            return source, path
+
+    with _lock_for(key):
+        source = _load_source(key)
+        if source.get('sha256'):
+            path = _path('objects', source['sha256'][:2], source['sha256'])
+            if os.path.exists(path):
+                return source, path
+        data = _fetch(source['url'])
+        digest = hashlib.sha256(data).hexdigest()
+        path = _path('objects', digest[:2], digest)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+        source = {"url": source['url'], "sha256": digest}
+        _save_source(key, source)
+        with _registry_lock:
+            _sources[key] = source
+        logger.info(f"已缓存图片 {source['url']} ({len(data)} 字节)")
+        return source, path
+
+
+def _sniff_mimetype(path):
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if head.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def _render_thumbnail(original_path, size_name, fmt):
+    from PIL import Image, ImageOps
+    pil_format, _, save_options = THUMBNAIL_FORMATS[fmt]
+    with Image.open(original_path) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGB')
+        thumb = ImageOps.fit(img, THUMBNAIL_SIZES[size_name], Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumb.save(buffer, pil_format, **save_options)
+    return buffer.getvalue()
+
+
+def get_image(key, variant):
+    """
+    获取代理图片文件。
+    :param variant: 'original' 或 '<规格>.<格式>' (例如 'medium.webp')
+    :return: (文件路径, MIME 类型, ETag)
+    :raises KeyError: 图片键未登记
+    :raises ValueError: 规格或格式不受支持
+    :raises ImageFetchError: 抓取源图片失败
+    """
+    if variant == ORIGINAL_VARIANT:
+        source, original_path = _ensure_original(key)
+        return original_path, _sniff_mimetype(original_path), f"{source['sha256'][:32]}-original"
+
+    size_name, _, fmt = variant.partition('.')
+    if size_name not in THUMBNAIL_SIZES or fmt not in THUMBNAIL_FORMATS:
+        raise ValueError(f"不支持的图片规格: {variant}. 可选规格为: {', '.join(THUMBNAIL_SIZES)}; "
+                         f"格式为: {', '.join(THUMBNAIL_FORMATS)}")
+    if not PILLOW_AVAILABLE:
+        raise ValueError("服务器未安装 Pillow，仅支持 original")
+
+    source, original_path = _ensure_original(key)
+    digest = source['sha256']
+    thumb_path = _path('thumbs', digest[:2], f"{digest}-{size_name}.{fmt}")
+    if not os.path.exists(thumb_path):
+        with _lock_for(thumb_path):
+            if not os.path.exists(thumb_path):
+                try:
+                    _write_atomic(thumb_path, _render_thumbnail(original_path, size_name, fmt))
+                except OSError as e:
+                    raise ImageFetchError(f"无法解析图片: {e}") from e
+    return thumb_path, THUMBNAIL_FORMATS[fmt][1], f"{digest[:32]}-{size_name}-{fmt}"
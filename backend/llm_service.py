@@ -1,31 +1,101 @@
 # backend/llm_service.py
+import logging
 import os
-from openai import OpenAI, APIConnectionError, RateLimitError, APIStatusError
+import threading
+import time
+
+from backend.circuit_breaker import CircuitBreaker, CircuitOpenError
 
 # DeepSeek API 配置
 DEEPSEEK_API_KEY = ""  # <--- 请替换为您的真实 DeepSeek API Key
 DEEPSEEK_BASE_URL = "https://api.deepseek.com"
 
-def get_recipe_suggestion_from_qwen(current_dishes, preferences="", full_menu=None):
-    """
-    从 DeepSeek 大模型获取基于本店菜单的、经过优化的餐谱搭配建议。
+# 弹性策略配置
+LLM_DEADLINE_SECONDS = 8            # 单次请求的总时限 (含重试)，超时后由调用方返回本地兜底建议
+LLM_MAX_RETRIES = 1                 # 网络错误、限流和 5xx 的重试次数 (剩余时限不足时不重试)
+LLM_RETRY_BACKOFF_SECONDS = 0.3
+LLM_MIN_ATTEMPT_SECONDS = 1.0       # 剩余时限少于该值时不再发起新的尝试
+LLM_MAX_CONCURRENCY = 4             # 舱壁：同时进行的大模型调用上限，超出时直接兜底而不是排队
+LLM_LATENCY_SLO_SECONDS = 6         # 超过该耗时的调用计为一次 SLO 违约 (按失败计入熔断器)
+LLM_BREAKER_FAILURE_THRESHOLD = 5   # 连续失败/违约次数达到该值时熔断
+LLM_BREAKER_OPEN_SECONDS = 30       # 熔断后的冷却时间，之后放行一个探测请求
+
+logger = logging.getLogger(__name__)
+
+breaker = CircuitBreaker('deepseek', failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD,
+                         open_seconds=LLM_BREAKER_OPEN_SECONDS, latency_slo=LLM_LATENCY_SLO_SECONDS)
+_bulkhead = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_bulkhead_stats = {"in_flight": 0, "rejected": 0}
+_bulkhead_lock = threading.Lock()
+_client = None
+
+
+class LLMUnavailableError(Exception):
+    """大模型暂时无法给出回答 (未配置、熔断中、并发已满、超时或调用失败)，调用方应返回兜底建议"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
 
-    :param current_dishes: 当前已点菜品列表。
-    :param preferences: 用户偏好。
-    :param full_menu: 餐厅当前所有可用菜品的列表 (包含名称、分类和描述)。
-    :return: 大模型返回的建议文本，或者错误信息。
-    """
-    if full_menu is None:
-        full_menu = []
-    
-    print(f"准备向 DeepSeek 请求优化后的餐谱建议。当前菜品: {current_dishes}, 用户偏好: {preferences}")
 
-    if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == "sk-your-deepseek-api-key":
-        print("警告: DeepSeek API Key 未配置。")
-        return "抱歉，餐谱建议服务未正确配置API密钥。"
+def _openai():
+    """延迟导入 openai SDK (导入耗时较长)，首次调用模型或预热时才加载"""
+    import openai
+    return openai
 
-    # 1. 优化系统提示词 (System Prompt)
-    system_prompt = """
+
+def _get_client():
+    global _client
+    if _client is None:
+        # 重试由本模块按剩余时限控制，关闭 SDK 自带的重试
+        _client = _openai().OpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL, max_retries=0)
+    return _client
+
+
+def preload():
+    """预先加载 SDK 并创建客户端 (未配置 API Key 时跳过)"""
+    if is_configured():
+        _get_client()
+
+
+def _is_retryable(error):
+    openai = _openai()
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):  # APITimeoutError 是 APIConnectionError 的子类
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _call_with_deadline(messages, deadline):
+    """在截止时间前调用模型，按剩余时间设置每次尝试的超时，可重试错误最多重试 LLM_MAX_RETRIES 次"""
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            response = _get_client().chat.completions.create(
+                model="deepseek-chat",
+                messages=messages,
+                stream=False,
+                max_tokens=1000,
+                temperature=0.7,
+                timeout=remaining
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            attempt += 1
+            remaining = deadline - time.monotonic() - LLM_RETRY_BACKOFF_SECONDS
+            if attempt > LLM_MAX_RETRIES or not _is_retryable(e) or remaining < LLM_MIN_ATTEMPT_SECONDS:
+                raise
+            logger.warning(f"调用 DeepSeek API 失败 ({e.__class__.__name__})，{LLM_RETRY_BACKOFF_SECONDS} 秒后重试")
+            time.sleep(LLM_RETRY_BACKOFF_SECONDS)
+
+
+def get_resilience_stats():
+    """熔断器状态、调用延迟分位数和舱壁占用情况"""
+    with _bulkhead_lock:
+        bulkhead = {"max_concurrency": LLM_MAX_CONCURRENCY, **_bulkhead_stats}
+    return {"breaker": breaker.stats(), "bulkhead": bulkhead, "deadline_seconds": LLM_DEADLINE_SECONDS}
+
+SYSTEM_PROMPT = """
 你是一位顶级的中餐主厨和餐厅顾问。你的任务是帮助顾客搭配出一套完美、均衡且美味的餐点。
 你的回答必须遵循以下结构和要求：
 1.  **分析现状**: 首先，简要分析顾客已选菜品的口味特点（例如：这道菜是香辣开胃的）。如果顾客未选菜，则直接根据其偏好进行推荐。
@@ -36,13 +106,18 @@ def get_recipe_suggestion_from_qwen(current_dishes, preferences="", full_menu=No
 6.  **格式要求**: 请使用Markdown格式进行排版，让回答清晰易读。
 """
 
-    # 2. 构建包含完整菜单的用户指令 (User Prompt)
-    if not full_menu:
-        # 如果菜单为空，直接返回提示信息，避免无效调用
-        return "抱歉，餐厅今天没有可用的菜单，无法为您提供建议。"
-        
-    menu_list_str = "\n".join(f"- {item}" for item in full_menu)
-    user_prompt_content = f"这是我们餐厅今天的完整菜单：\n---\n{menu_list_str}\n---\n\n"
+
+def build_recipe_prompt(current_dishes, preferences="", full_menu=None, candidates_only=False):
+    """
+    构建发送给大模型的 (系统提示词, 用户提示词)。
+    :param candidates_only: full_menu 是否为预先筛选出的候选菜品 (紧凑格式: 菜名|分类|特征|描述)
+    """
+    menu_list_str = "\n".join(f"- {item}" for item in full_menu or [])
+    if candidates_only:
+        user_prompt_content = (f"这是我们餐厅今日菜单中与这位顾客最相关的候选菜品 (格式: 菜名|分类|口味特征|描述)：\n"
+                               f"---\n{menu_list_str}\n---\n\n")
+    else:
+        user_prompt_content = f"这是我们餐厅今天的完整菜单：\n---\n{menu_list_str}\n---\n\n"
 
     # 根据用户是否已点餐，组织不同的提问方式
     if not current_dishes:
@@ -55,37 +130,81 @@ def get_recipe_suggestion_from_qwen(current_dishes, preferences="", full_menu=No
         user_prompt_content += f"\n顾客的个人口味和要求是：'{preferences}'。\n"
     
     user_prompt_content += "\n请根据以上信息，为顾客提供搭配建议。"
+    return SYSTEM_PROMPT, user_prompt_content
+
+
+def is_configured():
+    """是否已配置大模型 API 密钥"""
+    return bool(DEEPSEEK_API_KEY) and DEEPSEEK_API_KEY != "sk-your-deepseek-api-key"
 
+
+def get_recipe_suggestion_from_qwen(current_dishes, preferences="", full_menu=None, candidates_only=False,
+                                   deadline_seconds=LLM_DEADLINE_SECONDS):
+    """
+    从 DeepSeek 大模型获取基于本店菜单的、经过优化的餐谱搭配建议。
+
+    :param current_dishes: 当前已点菜品列表。
+    :param preferences: 用户偏好。
+    :param full_menu: 餐厅当前所有可用菜品的列表 (包含名称、分类和描述)，或预先筛选出的候选菜品。
+    :param candidates_only: full_menu 是否为预先筛选出的候选菜品。
+    :param deadline_seconds: 本次请求的总时限 (含重试)。
+    :return: 大模型返回的建议文本。
+    :raises LLMUnavailableError: 未配置、熔断中、并发已满、超时或调用失败时，由调用方返回兜底建议。
+    """
+    if full_menu is None:
+        full_menu = []
+    
+    logger.info(f"准备向 DeepSeek 请求优化后的餐谱建议。当前菜品: {current_dishes}, 用户偏好: {preferences}")
+
+    if not is_configured():
+        logger.warning("DeepSeek API Key 未配置。")
+        raise LLMUnavailableError('not_configured', "餐谱建议服务未配置API密钥")
+
+    if not full_menu:
+        # 如果菜单为空，直接返回提示信息，避免无效调用
+        return "抱歉，餐厅今天没有可用的菜单，无法为您提供建议。"
+
+    system_prompt, user_prompt_content = build_recipe_prompt(current_dishes, preferences, full_menu, candidates_only)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt_content}
+    ]
+
+    if not _bulkhead.acquire(blocking=False):
+        with _bulkhead_lock:
+            _bulkhead_stats["rejected"] += 1
+        raise LLMUnavailableError('bulkhead_full', "餐谱建议服务繁忙")
     try:
-        client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL)
+        try:
+            breaker.before_call()
+        except CircuitOpenError as e:
+            raise LLMUnavailableError('circuit_open', str(e)) from e
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt_content}
-        ]
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
-            stream=False,
-            max_tokens=1000,
-            temperature=0.7
-        )
-
-        suggestion = response.choices[0].message.content
+        with _bulkhead_lock:
+            _bulkhead_stats["in_flight"] += 1
+        started = time.monotonic()
+        try:
+            suggestion = _call_with_deadline(messages, started + deadline_seconds)
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            breaker.record_failure(elapsed)
+            if isinstance(e, _openai().APIConnectionError):
+                logger.error(f"无法连接到 DeepSeek API 或请求超时 ({elapsed:.1f}s): {e}")
+                raise LLMUnavailableError('timeout_or_connection', "连接餐谱建议服务超时或失败") from e
+            logger.error(f"调用 DeepSeek API 时发生错误: {e}")
+            raise LLMUnavailableError('error', "获取餐谱建议时出现错误") from e
+        finally:
+            with _bulkhead_lock:
+                _bulkhead_stats["in_flight"] -= 1
+        breaker.record_success(time.monotonic() - started)
         return suggestion
-
-    except APIConnectionError as e:
-        print(f"错误: 无法连接到 DeepSeek API: {e}")
-        return "抱歉，连接餐谱建议服务时出现网络问题，请稍后再试。"
-    except Exception as e:
-        print(f"错误: 调用 DeepSeek API 时发生未知错误: {e}")
-        return "抱歉，获取餐谱建议时出现内部错误，请稍后再试。"
+    finally:
+        _bulkhead.release()
 
 if __name__ == '__main__':
     print("测试菜单感知增强版的LLM服务模块...")
     
-    if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == "sk-your-deepseek-api-key":
+    if not is_configured():
         print("\n跳过API调用测试，因为DeepSeek API Key未设置。")
     else:
         # 模拟从数据库获取的完整菜单
@@ -105,8 +224,11 @@ if __name__ == '__main__':
         print(f"完整菜单: {len(mock_menu)} 道菜")
         print(f"已选菜品: {dishes1}")
         print(f"个人偏好: {prefs1}")
-        suggestion1 = get_recipe_suggestion_from_qwen(dishes1, prefs1, mock_menu)
-        print(f"\n模型返回的建议:\n{suggestion1}")
+        try:
+            suggestion1 = get_recipe_suggestion_from_qwen(dishes1, prefs1, mock_menu)
+            print(f"\n模型返回的建议:\n{suggestion1}")
+        except LLMUnavailableError as e:
+            print(f"\n模型不可用 ({e.reason}): {e}")
         
         # --- 测试场景2: 未点菜，只有偏好 ---
         dishes2 = []
@@ -115,6 +237,9 @@ if __name__ == '__main__':
         print(f"完整菜单: {len(mock_menu)} 道菜")
         print(f"已选菜品: (无)")
         print(f"个人偏好: {prefs2}")
-        suggestion2 = get_recipe_suggestion_from_qwen(dishes2, prefs2, mock_menu)
-        print(f"\n模型返回的建议:\n{suggestion2}")
+        try:
+            suggestion2 = get_recipe_suggestion_from_qwen(dishes2, prefs2, mock_menu)
+            print(f"\n模型返回的建议:\n{suggestion2}")
+        except LLMUnavailableError as e:
+            print(f"\n模型不可用 ({e.reason}): {e}")
 
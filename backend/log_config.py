@@ -0,0 +1,170 @@
+# backend/log_config.py
+# 非阻塞的结构化日志管道：请求线程只把日志记录放入有界队列，由后台监听线程统一格式化为 JSON 并写入控制台和文件
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+
+LOG_FILE = 'restaurant_app.log'
+LOG_QUEUE_SIZE = 10000     # 队列已满时直接丢弃新记录 (并计数)，绝不阻塞请求线程
+
+# 各 logger 的日志级别
+LOG_LEVELS = {
+    '': logging.INFO,
+    'werkzeug': logging.WARNING,
+    'backend.database': logging.INFO,
+}
+
+# 高频 INFO 日志的采样率 (0~1)，WARNING 及以上级别始终保留
+LOG_SAMPLE_RATES = {
+    'backend.database': 0.1,
+}
+
+# LogRecord 自带的属性，格式化时不作为附加字段输出
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为单行 JSON，logger.info(..., extra={...}) 中的附加字段会一并输出"""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "file": f"{record.filename}:{record.lineno}",
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """按 logger 名称对 INFO 及以下级别的记录采样"""
+
+    def __init__(self, sample_rates):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+    def _rate_for(self, name):
+        # 取最长匹配的 logger 前缀
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃记录并计数，而不是阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock_dropped = threading.Lock()
+
+    def prepare(self, record):
+        # 只在请求线程中合并消息参数和异常堆栈，格式化为 JSON 的工作留给监听线程
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock_dropped:
+                self.dropped += 1
+
+
+_listener = None
+_listener_pid = None
+_queue_handler = None
+_sampling_filter = None
+
+
+def configure_logging(log_file=LOG_FILE, levels=None, sample_rates=None, queue_size=LOG_QUEUE_SIZE):
+    """
+    配置根 logger：请求线程 -> 采样过滤 -> 有界队列 -> 监听线程 -> 控制台/文件 (JSON)。
+    每个工作进程处理首个请求时调用；重复调用不会重复添加 handler。
+    在已配置的父进程中 fork 出的子进程没有监听线程，此时只为子进程重新启动监听线程。
+    """
+    global _listener, _listener_pid, _queue_handler, _sampling_filter
+    if _listener is not None:
+        if _listener_pid != os.getpid():
+            _listener = logging.handlers.QueueListener(_listener.queue, *_listener.handlers,
+                                                       respect_handler_level=True)
+            _listener.start()
+            _listener_pid = os.getpid()
+        return _listener
+
+    formatter = JsonFormatter()
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _sampling_filter = SamplingFilter(sample_rates if sample_rates is not None else LOG_SAMPLE_RATES)
+    _queue_handler = BoundedQueueHandler(log_queue)
+    _queue_handler.addFilter(_sampling_filter)
+
+    for name, level in (levels if levels is not None else LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """停止监听线程 (会先写完队列中剩余的记录)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logging_stats():
+    """返回日志管道的队列深度、丢弃数和采样丢弃数"""
+    if _queue_handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queue_depth": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "sampled_out": _sampling_filter.sampled_out,
+    }
@@ -0,0 +1,139 @@
+# backend/menu_import.py
+# 菜品批量导入：解析 CSV / JSON 格式的批量新增或修改请求，并逐行做格式校验 (不访问数据库)。
+# 与分类、已有菜品相关的校验在 database.bulk_upsert_menu_items 中基于同一份快照完成
+import csv
+import io
+import math
+
+import backend.image_cache as image_cache
+
+MAX_BULK_ROWS = 5000
+
+# 可导入的字段；id 为空时按名称匹配已有菜品 (同一餐厅内菜品名称唯一)，匹配不到则新增
+BULK_FIELDS = ('id', 'name', 'description', 'price', 'category_id', 'category', 'image_url', 'is_available')
+NAME_MAX_LENGTH = 100
+IMAGE_URL_MAX_LENGTH = 255
+PRICE_LIMIT = 10 ** 8            # menu_items.price 为 DECIMAL(10,2)，价格必须小于该值
+
+_TRUE_VALUES = ('true', '1', 'yes', 'y', '是')
+_FALSE_VALUES = ('false', '0', 'no', 'n', '否')
+
+
+def parse_csv(text):
+    """
+    解析 CSV 文本 (首行为表头，列名见 BULK_FIELDS)。
+    空单元格表示不修改该字段，因此 CSV 无法把描述或图片清空，需要时请用 JSON。
+    :raises ValueError: 表头缺失或包含未知列
+    """
+    reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+    if not reader.fieldnames:
+        raise ValueError("CSV 缺少表头")
+    columns = [name.strip() for name in reader.fieldnames]
+    unknown = [name for name in columns if name not in BULK_FIELDS]
+    if unknown:
+        raise ValueError(f"未知的列: {', '.join(unknown)}. 可用的列为: {', '.join(BULK_FIELDS)}")
+    reader.fieldnames = columns
+    rows = []
+    for record in reader:
+        rows.append({key: value.strip() for key, value in record.items()
+                     if key is not None and value is not None and value.strip() != ''})
+        if len(rows) > MAX_BULK_ROWS:
+            raise ValueError(f"单次最多导入 {MAX_BULK_ROWS} 行")
+    return rows
+
+
+def parse_json(data):
+    """
+    解析 JSON 请求体：菜品对象列表，或 {"items": [...]}。
+    :raises ValueError: 结构无效
+    """
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise ValueError("请求体必须是菜品列表或 {\"items\": [...]}")
+    if len(data) > MAX_BULK_ROWS:
+        raise ValueError(f"单次最多导入 {MAX_BULK_ROWS} 行")
+    return data
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE_VALUES:
+        return True
+    if text in _FALSE_VALUES:
+        return False
+    raise ValueError("is_available 必须是布尔值 (true/false)")
+
+
+def _reject_bool(value):
+    # JSON 的 true/false 在 Python 中是 int 的子类，不能当作数字字段的值
+    if isinstance(value, bool):
+        raise TypeError
+    return value
+
+
+def normalize_row(raw):
+    """
+    校验并转换单行的字段类型，只保留提供了的字段 (未提供的字段在修改时保持原值)。
+    :return: (规范化后的字段字典, 错误信息列表)
+    """
+    if not isinstance(raw, dict):
+        return None, ["每一行必须是对象"]
+    errors = []
+    row = {}
+    unknown = [key for key in raw if key not in BULK_FIELDS]
+    if unknown:
+        errors.append(f"未知的字段: {', '.join(map(str, unknown))}")
+
+    if raw.get('id') is not None:
+        try:
+            row['id'] = int(_reject_bool(raw['id']))
+            if row['id'] <= 0:
+                raise ValueError
+        except (ValueError, TypeError):
+            errors.append("id 必须是正整数")
+    if 'name' in raw:
+        name = str(raw['name'] or '').strip()
+        if not name:
+            errors.append("菜品名称不能为空")
+        elif len(name) > NAME_MAX_LENGTH:
+            errors.append(f"菜品名称不能超过 {NAME_MAX_LENGTH} 个字符")
+        row['name'] = name
+    if 'description' in raw:
+        row['description'] = None if raw['description'] is None else str(raw['description'])
+    if 'price' in raw:
+        try:
+            row['price'] = round(float(_reject_bool(raw['price'])), 2)
+            if not math.isfinite(row['price']) or row['price'] <= 0:
+                raise ValueError
+            if row['price'] >= PRICE_LIMIT:
+                errors.append(f"价格必须小于 {PRICE_LIMIT}")
+        except (ValueError, TypeError):
+            errors.append("价格必须是正数")
+    if raw.get('category_id') is not None:
+        try:
+            row['category_id'] = int(_reject_bool(raw['category_id']))
+        except (ValueError, TypeError):
+            errors.append("分类ID必须是整数")
+    elif raw.get('category') is not None:
+        row['category'] = str(raw['category']).strip()
+    if 'image_url' in raw:
+        image_url = raw['image_url'] or None
+        if image_url is not None and len(str(image_url)) > IMAGE_URL_MAX_LENGTH:
+            errors.append(f"图片链接不能超过 {IMAGE_URL_MAX_LENGTH} 个字符")
+        elif image_url is not None:
+            try:
+                image_cache.validate_source_url(image_url)
+            except ValueError as e:
+                errors.append(str(e))
+        row['image_url'] = None if image_url is None else str(image_url)
+    if 'is_available' in raw:
+        try:
+            row['is_available'] = _parse_bool(raw['is_available'])
+        except ValueError as e:
+            errors.append(str(e))
+    if raw.get('id') is None and not row.get('name'):
+        errors.append("每一行必须提供 id 或菜品名称")
+    return row, errors
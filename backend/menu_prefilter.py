@@ -0,0 +1,226 @@
+# backend/menu_prefilter.py
+# 大模型调用前的候选菜品筛选：按关键词、分类、口味特征和搭配规则给菜品打分，只把前 K 个候选以紧凑格式放进提示词
+import threading
+
+import backend.database as db
+from backend.menu_search import menu_index, tokenize, tokenize_query
+
+PREFILTER_ENABLED = True       # 为 False 时发送完整菜单 (用于对比筛选前后的提示词大小和模型延迟)
+PREFILTER_TOP_K = 12           # 发送给模型的候选菜品数
+DESCRIPTION_MAX_CHARS = 24     # 紧凑编码中描述的最大字数
+
+# 菜品在一餐中的角色，按分类名称中的关键词判断
+COURSE_KEYWORDS = {
+    'cold': ('凉菜', '冷菜', '凉拌', '小菜'),
+    'hot': ('热菜', '炒菜', '主菜', '招牌', '川菜', '粤菜'),
+    'soup': ('汤', '羹'),
+    'staple': ('主食', '米饭', '面', '饭', '粥', '饺', '包子', '饼'),
+    'drink': ('饮品', '饮料', '茶', '果汁', '酒', '咖啡'),
+    'dessert': ('甜品', '甜点', '点心'),
+}
+
+# 口味/食材特征，按菜名和描述中的关键词判断
+FLAVOR_KEYWORDS = {
+    '辣': ('辣', '麻', '椒', '川', '湘'),
+    '酸': ('酸', '醋', '柠檬'),
+    '甜': ('甜', '糖', '蜜'),
+    '清淡': ('清淡', '清爽', '爽口', '清蒸', '白灼', '鲜美'),
+    '浓郁': ('红烧', '酱', '浓', '油', '炸', '焖', '卤'),
+    '解腻': ('解腻', '解辣', '解暑', '爽口', '凉', '冰'),
+    '肉': ('鸡', '鸭', '牛', '猪', '羊', '肉', '排骨'),
+    '海鲜': ('鱼', '虾', '蟹', '贝', '海鲜'),
+    '素': ('豆腐', '蔬', '青菜', '瓜', '菌', '菇', '茄', '素'),
+}
+
+# 否定说法 ("不要辣"、"不吃辣"、"解辣" 等)：偏好中出现时对该特征扣分，菜品描述中出现时不计入该特征
+NEGATION_PREFIXES = ('不要', '不吃', '不能吃', '别太', '不', '少', '忌', '解')
+
+# 搭配规则：已点菜品具有某特征时，对具备互补特征的菜品加分
+COMPLEMENT_RULES = {
+    '辣': ('解腻', '清淡', '甜'),
+    '浓郁': ('清淡', '解腻', '酸', '素'),
+    '肉': ('素',),
+    '海鲜': ('素', '清淡'),
+}
+
+# 打分权重
+PREFERENCE_TEXT_WEIGHT = 2.0      # 偏好文本与菜名/描述的词项重合
+PREFERENCE_FLAVOR_WEIGHT = 4.0    # 偏好中明确提到的口味/食材
+PREFERENCE_COURSE_WEIGHT = 5.0    # 偏好中明确提到的菜品类型 (例如 "来个汤")
+NEGATED_FLAVOR_PENALTY = 8.0
+COMPLEMENT_WEIGHT = 2.0
+MISSING_COURSE_WEIGHT = 3.0       # 已点菜品中缺少的汤/主食/凉菜
+SAME_COURSE_PENALTY = 1.0         # 与已点菜品同类型 (每道)
+
+
+class _Catalog:
+    """某个菜品目录版本的预计算结果：每道菜的特征和紧凑编码"""
+
+    __slots__ = ('version', 'dishes', 'by_name', 'full_menu')
+
+    def __init__(self, version, items):
+        self.version = version
+        self.dishes = [_features(item) for item in sorted(items, key=lambda i: (i.get('category_name') or '', i['name']))]
+        self.by_name = {dish['name']: dish for dish in self.dishes}
+        self.full_menu = [_encode_full(dish['item']) for dish in self.dishes]
+
+
+def _match_keywords(text, keyword_map):
+    return {tag for tag, keywords in keyword_map.items() if any(k in text for k in keywords)}
+
+
+def _features(item):
+    name = item['name']
+    category = item.get('category_name') or ''
+    text = f"{name} {item.get('description') or ''}"
+    tokens = {}
+    for token in tokenize(name):
+        tokens[token] = tokens.get(token, 0) + 3
+    for token in tokenize(item.get('description')):
+        tokens[token] = tokens.get(token, 0) + 1
+    courses = _match_keywords(category, COURSE_KEYWORDS) or _match_keywords(name, COURSE_KEYWORDS) or {'hot'}
+    flavors, _ = _flavor_mentions(text)
+    return {
+        'name': name,
+        'item': item,
+        'tokens': tokens,
+        'courses': courses,
+        'flavors': flavors,
+        'encoded': _encode_compact(item, flavors),
+    }
+
+
+def _encode_full(item):
+    """筛选前的完整编码 (与原先发送给模型的格式一致)"""
+    return f"{item['name']} (分类: {item.get('category_name')}, 描述: {item.get('description') or '无'})"
+
+
+def _encode_compact(item, flavors):
+    """紧凑编码：菜名|分类|特征|截断后的描述"""
+    description = (item.get('description') or '').strip()
+    if len(description) > DESCRIPTION_MAX_CHARS:
+        description = description[:DESCRIPTION_MAX_CHARS] + '…'
+    parts = [item['name'], item.get('category_name') or '未分类']
+    if flavors:
+        parts.append('/'.join(sorted(flavors)))
+    if description:
+        parts.append(description)
+    return '|'.join(parts)
+
+
+_cache_lock = threading.Lock()
+_catalogs = {}     # 租户ID -> _Catalog (只保留最新版本)
+
+
+def get_catalog():
+    """当前租户的菜品目录预计算结果，菜品变更 (目录版本号变化) 后重新计算"""
+    tenant_id = db.current_tenant_id()
+    version = menu_index.catalog_version()
+    catalog = _catalogs.get(tenant_id)
+    if catalog is not None and catalog.version == version:
+        return catalog
+    version, items = menu_index.snapshot()
+    catalog = _Catalog(version, items)
+    with _cache_lock:
+        _catalogs[tenant_id] = catalog
+    return catalog
+
+
+def _flavor_mentions(text):
+    """返回文本中 (肯定提到的口味特征, 被否定的口味特征)"""
+    positive, negative = set(), set()
+    for tag, keywords in FLAVOR_KEYWORDS.items():
+        for keyword in keywords:
+            start = text.find(keyword)
+            while start != -1:
+                prefix = text[max(0, start - 3):start]
+                if any(prefix.endswith(neg) for neg in NEGATION_PREFIXES):
+                    negative.add(tag)
+                else:
+                    positive.add(tag)
+                start = text.find(keyword, start + 1)
+    return positive - negative, negative
+
+
+def _preference_signals(preferences):
+    """从偏好文本中提取想要/不想要的口味，以及明确提到的菜品类型"""
+    wanted, unwanted = _flavor_mentions(preferences)
+    courses = _match_keywords(preferences, COURSE_KEYWORDS)
+    return wanted, unwanted, courses
+
+
+def select_candidates(current_dishes, preferences, top_k=PREFILTER_TOP_K):
+    """
+    为当前顾客挑选最相关的 top_k 个候选菜品 (不包含已点的菜)。
+    :return: (紧凑编码的候选列表, 完整菜单编码列表)
+    """
+    catalog = get_catalog()
+    preferences = preferences or ''
+    current_names = {str(name).strip() for name in current_dishes or []}
+
+    chosen_courses = {}
+    chosen_flavors = set()
+    for name in current_names:
+        dish = catalog.by_name.get(name)
+        courses = dish['courses'] if dish else _match_keywords(name, COURSE_KEYWORDS)
+        flavors = dish['flavors'] if dish else _flavor_mentions(name)[0]
+        for course in courses:
+            chosen_courses[course] = chosen_courses.get(course, 0) + 1
+        chosen_flavors |= flavors
+
+    wanted_flavors, unwanted_flavors, wanted_courses = _preference_signals(preferences)
+    preference_tokens = tokenize_query(preferences)
+    complement_flavors = set()
+    for flavor in chosen_flavors:
+        complement_flavors.update(COMPLEMENT_RULES.get(flavor, ()))
+    missing_courses = {'soup', 'staple', 'cold'} - set(chosen_courses) if current_names else set()
+
+    scored = []
+    for position, dish in enumerate(catalog.dishes):
+        if dish['name'] in current_names:
+            continue
+        score = 0.0
+        score += PREFERENCE_TEXT_WEIGHT * sum(dish['tokens'].get(token, 0) for token in preference_tokens) / 3
+        score += PREFERENCE_FLAVOR_WEIGHT * len(dish['flavors'] & wanted_flavors)
+        score -= NEGATED_FLAVOR_PENALTY * len(dish['flavors'] & unwanted_flavors)
+        score += PREFERENCE_COURSE_WEIGHT * len(dish['courses'] & wanted_courses)
+        score += COMPLEMENT_WEIGHT * len(dish['flavors'] & complement_flavors)
+        score += MISSING_COURSE_WEIGHT * len(dish['courses'] & missing_courses)
+        score -= SAME_COURSE_PENALTY * sum(chosen_courses.get(course, 0) for course in dish['courses'])
+        scored.append((-score, position, dish))
+
+    scored.sort(key=lambda entry: (entry[0], entry[1]))
+    candidates = [dish['encoded'] for _, _, dish in scored[:top_k]]
+    return candidates, catalog.full_menu
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    'prefiltered': {'requests': 0, 'prompt_chars': 0, 'full_menu_prompt_chars': 0, 'llm_ms': 0.0},
+    'full_menu': {'requests': 0, 'prompt_chars': 0, 'full_menu_prompt_chars': 0, 'llm_ms': 0.0},
+}
+
+
+def record_request(prefiltered, prompt_chars, full_menu_prompt_chars, llm_ms):
+    """记录一次大模型调用的提示词大小 (字符数) 和模型耗时"""
+    with _stats_lock:
+        bucket = _stats['prefiltered' if prefiltered else 'full_menu']
+        bucket['requests'] += 1
+        bucket['prompt_chars'] += prompt_chars
+        bucket['full_menu_prompt_chars'] += full_menu_prompt_chars
+        bucket['llm_ms'] += llm_ms
+
+
+def get_stats():
+    """按模式 (筛选/完整菜单) 汇总的平均提示词大小和平均模型耗时"""
+    with _stats_lock:
+        result = {'enabled': PREFILTER_ENABLED, 'top_k': PREFILTER_TOP_K}
+        for mode, bucket in _stats.items():
+            requests = bucket['requests']
+            result[mode] = {
+                'requests': requests,
+                'avg_prompt_chars': round(bucket['prompt_chars'] / requests, 1) if requests else None,
+                'avg_full_menu_prompt_chars': round(bucket['full_menu_prompt_chars'] / requests, 1) if requests else None,
+                'avg_llm_ms': round(bucket['llm_ms'] / requests, 1) if requests else None,
+            }
+    return result
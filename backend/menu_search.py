@@ -0,0 +1,289 @@
+# backend/menu_search.py
+# 菜品搜索：基于内存倒排索引，中文按字符 bigram 切分，英文/数字按单词切分
+import bisect
+import re
+import threading
+
+import backend.database as db
+import backend.menu_snapshot as menu_snapshot
+
+# 菜名命中的权重高于描述命中
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+_CJK_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+_WORD = re.compile(r'[0-9a-z]+')
+
+
+def tokenize(text):
+    """
+    将文本切分为检索词项。
+    中文连续片段输出单字和相邻两字 (bigram)，这样单字查询 ("辣") 与多字查询 ("鸡丁") 都能命中；
+    英文和数字按单词小写化。
+    """
+    if not text:
+        return []
+    text = str(text).lower()
+    tokens = []
+    for run in _CJK_RUN.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD.findall(text))
+    return tokens
+
+
+def tokenize_query(text):
+    """
+    将查询切分为词项：长度为 1 的中文片段用单字，其余中文片段只用 bigram (更有区分度)。
+    """
+    if not text:
+        return []
+    text = str(text).lower()
+    tokens = []
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD.findall(text))
+    # 保持顺序去重
+    return list(dict.fromkeys(tokens))
+
+
+class MenuSearchIndex:
+    """
+    菜品倒排索引 (仅收录可供应的菜品)。
+    - postings: 词项 -> {菜品ID: 权重}
+    - 分类过滤使用预先计算好的分类 -> 菜品ID集合
+    - 价格过滤使用按价格排序的 (price, id) 数组，二分查找得到候选集合
+    所有增删改都是增量的，只更新受影响菜品的词项。
+    version 在每次菜品变更后递增，供依赖菜品目录的缓存判断是否失效。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._version = 0
+        self._snapshot_generation = None   # 构建索引时所用共享菜单快照的代数
+        self._items = {}
+        self._doc_tokens = {}
+        self._postings = {}
+        self._by_category_id = {}
+        self._by_category_name = {}
+        self._by_price = []
+
+    def is_built(self):
+        return self._built
+
+    def build(self, items):
+        """根据完整菜品列表重建索引"""
+        with self._lock:
+            self._items.clear()
+            self._doc_tokens.clear()
+            self._postings.clear()
+            self._by_category_id.clear()
+            self._by_category_name.clear()
+            self._by_price = []
+            for item in items or []:
+                self._add(item)
+            self._built = True
+            self._version += 1
+
+    def ensure_built(self):
+        """
+        首次使用时加载全部可用菜品构建索引：优先读取共享菜单快照 (不访问数据库)，快照尚未发布时查询数据库。
+        快照被替换 (其他进程修改了菜单) 后按新快照重建，各进程的索引随快照一起切换版本
+        """
+        snapshot = menu_snapshot.fresh()
+        generation = snapshot.generation if snapshot is not None else None
+        if self._built and (generation is None or generation == self._snapshot_generation):
+            return
+        with self._lock:
+            if not self._built or (generation is not None and generation != self._snapshot_generation):
+                items = snapshot.items() if snapshot is not None else db.get_all_menu_items(include_unavailable=False)
+                self.build(items)
+                self._snapshot_generation = generation
+
+    def invalidate(self):
+        """丢弃当前索引，下次查询时重新构建 (例如分类名称变化后)"""
+        with self._lock:
+            self._built = False
+            self._version += 1
+
+    def upsert(self, item):
+        """新增或更新单个菜品；不可供应的菜品会从索引中移除"""
+        if not item:
+            return
+        with self._lock:
+            if not self._built:
+                return
+            self._remove(item['id'])
+            if item.get('is_available'):
+                self._add(item)
+            self._version += 1
+
+    def remove(self, item_id):
+        """从索引中移除单个菜品 (例如软删除后)"""
+        with self._lock:
+            if self._built:
+                self._remove(item_id)
+                self._version += 1
+
+    def catalog_version(self):
+        """当前菜品目录的版本号"""
+        self.ensure_built()
+        return self._version
+
+    def snapshot(self):
+        """返回 (目录版本号, 全部可供应菜品的副本列表)"""
+        self.ensure_built()
+        with self._lock:
+            return self._version, [dict(item) for item in self._items.values()]
+
+    def get_item(self, item_id):
+        """按ID获取索引中的菜品 (只包含可供应的菜品)，不存在时返回 None"""
+        self.ensure_built()
+        with self._lock:
+            item = self._items.get(item_id)
+            return dict(item) if item else None
+
+    def search(self, query, category=None, max_price=None, limit=20):
+        """
+        查询菜品，按相关度排序。
+        :param query: 查询文本 (为空时仅按过滤条件返回)
+        :param category: 分类ID (int) 或分类名称 (str)
+        :param max_price: 最高价格 (含)
+        :param limit: 最多返回条数
+        :return: (结果列表, 命中总数)
+        """
+        self.ensure_built()
+        tokens = tokenize_query(query)
+        with self._lock:
+            candidates = None
+            if category is not None:
+                if isinstance(category, int):
+                    candidates = set(self._by_category_id.get(category, ()))
+                else:
+                    candidates = set(self._by_category_name.get(category, ()))
+            if max_price is not None:
+                cut = bisect.bisect_right(self._by_price, (float(max_price), float('inf')))
+                price_ids = {item_id for _, item_id in self._by_price[:cut]}
+                candidates = price_ids if candidates is None else candidates & price_ids
+
+            if tokens:
+                scores = None
+                # 所有查询词项都必须命中 (AND)，从最短的倒排表开始求交集
+                for token in sorted(tokens, key=lambda t: len(self._postings.get(t, ()))):
+                    posting = self._postings.get(token)
+                    if not posting:
+                        return [], 0
+                    if scores is None:
+                        scores = {item_id: weight for item_id, weight in posting.items()
+                                  if candidates is None or item_id in candidates}
+                    else:
+                        scores = {item_id: score + posting[item_id] for item_id, score in scores.items()
+                                  if item_id in posting}
+                    if not scores:
+                        return [], 0
+                ranked = sorted(scores, key=lambda item_id: (-scores[item_id], self._items[item_id]['name']))
+            else:
+                pool = self._items.keys() if candidates is None else candidates
+                ranked = sorted(pool, key=lambda item_id: self._items[item_id]['name'])
+
+            total = len(ranked)
+            results = [dict(self._items[item_id]) for item_id in ranked[:limit]]
+        return results, total
+
+    # --- 内部方法 (调用方需持有锁) ---
+    def _add(self, item):
+        item_id = item['id']
+        weights = {}
+        for token in tokenize(item.get('name')):
+            weights[token] = weights.get(token, 0) + NAME_WEIGHT
+        for token in tokenize(item.get('description')):
+            weights[token] = weights.get(token, 0) + DESCRIPTION_WEIGHT
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[item_id] = weight
+
+        stored = dict(item)
+        self._items[item_id] = stored
+        self._doc_tokens[item_id] = set(weights)
+        if stored.get('category_id') is not None:
+            self._by_category_id.setdefault(stored['category_id'], set()).add(item_id)
+        if stored.get('category_name'):
+            self._by_category_name.setdefault(stored['category_name'], set()).add(item_id)
+        bisect.insort(self._by_price, (float(stored['price']), item_id))
+
+    def _remove(self, item_id):
+        stored = self._items.pop(item_id, None)
+        if stored is None:
+            return
+        for token in self._doc_tokens.pop(item_id, ()):
+            posting = self._postings.get(token)
+            if posting is not None:
+                posting.pop(item_id, None)
+                if not posting:
+                    del self._postings[token]
+        for index, key in ((self._by_category_id, stored.get('category_id')),
+                           (self._by_category_name, stored.get('category_name'))):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del index[key]
+        entry = (float(stored['price']), item_id)
+        pos = bisect.bisect_left(self._by_price, entry)
+        if pos < len(self._by_price) and self._by_price[pos] == entry:
+            del self._by_price[pos]
+
+
+class TenantMenuIndex:
+    """按租户 (餐厅) 分别维护索引，方法与 MenuSearchIndex 相同，作用于当前上下文的租户"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def for_tenant(self, tenant_id):
+        index = self._indexes.get(tenant_id)
+        if index is None:
+            with self._lock:
+                index = self._indexes.setdefault(tenant_id, MenuSearchIndex())
+        return index
+
+    def _current(self):
+        return self.for_tenant(db.current_tenant_id())
+
+    def is_built(self):
+        return self._current().is_built()
+
+    def build(self, items):
+        self._current().build(items)
+
+    def ensure_built(self):
+        self._current().ensure_built()
+
+    def invalidate(self):
+        self._current().invalidate()
+
+    def upsert(self, item):
+        self._current().upsert(item)
+
+    def remove(self, item_id):
+        self._current().remove(item_id)
+
+    def get_item(self, item_id):
+        return self._current().get_item(item_id)
+
+    def catalog_version(self):
+        return self._current().catalog_version()
+
+    def snapshot(self):
+        return self._current().snapshot()
+
+    def search(self, query, category=None, max_price=None, limit=20):
+        return self._current().search(query, category=category, max_price=max_price, limit=limit)
+
+
+# 进程内共享的索引实例 (每个租户一份)
+menu_index = TenantMenuIndex()
@@ -0,0 +1,315 @@
+# backend/menu_snapshot.py
+# 共享菜单快照：把每家餐厅当前的菜品和分类序列化一次，写成带版本头的只读快照文件，
+# 各工作进程用 mmap 映射同一个文件 (共享页缓存，不各自持有副本)，/api/menu 等接口直接返回其中预先序列化好的 JSON。
+# 菜单或分类变化时由写入方生成新文件并原子替换 (os.replace)，各进程每次访问时检查文件是否被替换，
+# 因此所有进程在同一时刻切换到新版本。只有一个进程 (持有文件锁) 负责定期检查菜单版本号并刷新快照，
+# 每轮检查后更新心跳文件；心跳和快照都过期时 (例如没有进程在刷新) 接口回退到数据库查询，不会一直返回旧菜单。
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+import backend.database as db
+
+try:
+    import fcntl  # 仅 POSIX 可用；不可用时 (例如 Windows 开发环境) 只在进程内加锁，按单进程运行
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 优先放在 /dev/shm (内存文件系统)，同一台机器上的所有工作进程共享
+MENU_SNAPSHOT_DIR = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                                 'restaurant_menu_snapshots')
+MENU_SNAPSHOT_REFRESH_SECONDS = 5     # 负责刷新的进程检查菜单版本号的间隔
+MENU_SNAPSHOT_MAX_STALENESS_SECONDS = MENU_SNAPSHOT_REFRESH_SECONDS * 3  # 超过该时间未确认的快照视为过期
+_HEARTBEAT_CHECK_SECONDS = 1          # 各进程读取心跳文件的最小间隔 (避免每个请求都 stat)
+
+# 文件格式 (小端):
+#   文件头: 魔数, 格式版本, 菜单版本号, 快照代数 (每次发布唯一), 发布时间, 段数
+#   段表: 每段 (段名, 文件内偏移, 长度)
+#   段: all / available / categories 为可直接返回的 JSON 数组；item_index 为按菜品ID排序的 (ID, 偏移, 长度) 数组，
+#       指向 all 段中每个菜品对象，按ID查询时在映射上二分查找，只解析命中的那一个菜品
+_MAGIC = b'MENUSNAP'
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sIQQdI')
+_SEGMENT = struct.Struct('<16sQQ')
+_INDEX_ENTRY = struct.Struct('<IQI')
+_SEGMENT_NAMES = ('all', 'available', 'categories', 'item_index')
+
+_map_lock = threading.Lock()
+_mapped = {}            # 租户ID -> (文件标识, MenuSnapshot)
+_publish_thread_lock = threading.Lock()
+_refresher = None
+_heartbeat = {"checked_at": 0.0, "fresh": False}
+
+
+def _json_default(value):
+    # 与 Flask jsonify 的输出保持一致 (Decimal 序列化为字符串)
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def _encode(value):
+    return json.dumps(value, default=_json_default, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _decode_item(data):
+    item = json.loads(data)
+    if item.get('price') is not None:
+        item['price'] = Decimal(item['price'])  # 与数据库查询结果一致，下单时参与金额计算
+    return item
+
+
+def snapshot_path(tenant_id):
+    return os.path.join(MENU_SNAPSHOT_DIR, f"menu-{tenant_id}.snap")
+
+
+class MenuSnapshot:
+    """映射到内存的只读快照"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, self.version, self.generation, self.published_at, segment_count = \
+            _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or format_version != _FORMAT_VERSION:
+            raise ValueError(f"无效的菜单快照文件: {path}")
+        self._segments = {}
+        for i in range(segment_count):
+            name, offset, length = _SEGMENT.unpack_from(self._mm, _HEADER.size + i * _SEGMENT.size)
+            self._segments[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+        self._index_offset, index_length = self._segments['item_index']
+        self._item_count = index_length // _INDEX_ENTRY.size
+
+    def segment(self, name):
+        """返回段内容 (预先序列化好的 JSON 数组)"""
+        offset, length = self._segments[name]
+        return self._mm[offset:offset + length]
+
+    def items(self, include_unavailable=False):
+        items = json.loads(self.segment('all' if include_unavailable else 'available'))
+        for item in items:
+            if item.get('price') is not None:
+                item['price'] = Decimal(item['price'])
+        return items
+
+    def categories(self):
+        return json.loads(self.segment('categories'))
+
+    def get_item(self, item_id):
+        """按ID查询菜品 (包括不可供应的菜品)，不存在时返回 None"""
+        lo, hi = 0, self._item_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id, offset, length = _INDEX_ENTRY.unpack_from(self._mm, self._index_offset + mid * _INDEX_ENTRY.size)
+            if mid_id < item_id:
+                lo = mid + 1
+            elif mid_id > item_id:
+                hi = mid
+            else:
+                return _decode_item(self._mm[offset:offset + length])
+        return None
+
+
+def current(tenant_id=None):
+    """
+    当前餐厅的快照；快照尚未发布时返回 None (调用方回退到数据库查询)。
+    每次调用检查文件是否已被替换 (一次 stat)，被替换时重新映射；旧映射在没有引用后由垃圾回收关闭。
+    """
+    tenant_id = db.current_tenant_id() if tenant_id is None else tenant_id
+    path = snapshot_path(tenant_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _mapped.get(tenant_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with _map_lock:
+        cached = _mapped.get(tenant_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        try:
+            snapshot = MenuSnapshot(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"映射餐厅 {tenant_id} 的菜单快照失败: {e}")
+            return None
+        _mapped[tenant_id] = (key, snapshot)
+        return snapshot
+
+
+def _heartbeat_path():
+    return os.path.join(MENU_SNAPSHOT_DIR, 'refresher.heartbeat')
+
+
+def _touch_heartbeat():
+    with open(_heartbeat_path(), 'a'):
+        pass
+    os.utime(_heartbeat_path())
+
+
+def _refresher_alive():
+    now = time.monotonic()
+    if now - _heartbeat["checked_at"] >= _HEARTBEAT_CHECK_SECONDS:
+        try:
+            age = time.time() - os.stat(_heartbeat_path()).st_mtime
+        except OSError:
+            age = None
+        _heartbeat["fresh"] = age is not None and age <= MENU_SNAPSHOT_MAX_STALENESS_SECONDS
+        _heartbeat["checked_at"] = now
+    return _heartbeat["fresh"]
+
+
+def fresh(tenant_id=None):
+    """
+    确认未过期的当前快照：刚发布不久，或刷新进程最近确认过菜单版本号；否则返回 None，由调用方回退到数据库查询。
+    对外提供菜单的接口应使用该函数，而不是 current()
+    """
+    snapshot = current(tenant_id)
+    if snapshot is None:
+        return None
+    if time.time() - snapshot.published_at <= MENU_SNAPSHOT_MAX_STALENESS_SECONDS or _refresher_alive():
+        return snapshot
+    return None
+
+
+def _build(version, generation, items, categories):
+    # 数组保持数据库查询的顺序 (按分类、名称)，ID 索引单独排序
+    item_blobs = [(item['id'], bool(item['is_available']), _encode(item)) for item in items]
+    data_start = _HEADER.size + _SEGMENT.size * len(_SEGMENT_NAMES)
+    body = bytearray()
+    segments = {}
+
+    def add_array(name, blobs):
+        start = len(body)
+        body.extend(b'[')
+        positions = []
+        for i, blob in enumerate(blobs):
+            if i:
+                body.extend(b',')
+            positions.append(data_start + len(body))
+            body.extend(blob)
+        body.extend(b']')
+        segments[name] = (data_start + start, len(body) - start)
+        return positions
+
+    positions = add_array('all', [blob for _, _, blob in item_blobs])
+    add_array('available', [blob for _, available, blob in item_blobs if available])
+    add_array('categories', [_encode(category) for category in categories])
+    index_start = len(body)
+    for item_id, position, length in sorted((item_id, position, len(blob))
+                                            for (item_id, _, blob), position in zip(item_blobs, positions)):
+        body.extend(_INDEX_ENTRY.pack(item_id, position, length))
+    segments['item_index'] = (data_start + index_start, len(body) - index_start)
+
+    header = bytearray(_HEADER.pack(_MAGIC, _FORMAT_VERSION, version, generation, time.time(), len(_SEGMENT_NAMES)))
+    for name in _SEGMENT_NAMES:
+        header.extend(_SEGMENT.pack(name.encode('ascii'), *segments[name]))
+    return bytes(header + body)
+
+
+@contextmanager
+def _publish_lock():
+    """发布互斥 (跨进程)：在锁内读取数据库，保证后发布的快照不会被先读取的旧数据覆盖"""
+    with _publish_thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(MENU_SNAPSHOT_DIR, 'publish.lock'), 'a+') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def publish(tenant_id=None):
+    """
+    从数据库读取餐厅当前的全部菜品和分类，生成新快照并原子替换旧文件。
+    应在修改提交之后、不在请求级会话中调用 (例如通过 db.fan_out 在工作线程中执行)，只读取已提交的数据。
+    :return: 新快照；数据库不可用时返回 None (保留旧快照)
+    """
+    tenant_id = db.current_tenant_id() if tenant_id is None else tenant_id
+    os.makedirs(MENU_SNAPSHOT_DIR, exist_ok=True)
+    with _publish_lock(), db.use_tenant(tenant_id):
+        started = time.monotonic()
+        # 先取版本号再读取数据：期间发生的变更会在下一次增量同步时再次下发，不会丢失
+        version = db.get_menu_version()
+        items = db.get_all_menu_items(include_unavailable=True, with_thumbnails=True)
+        categories = db.get_all_categories()
+        if version is None or items is None or categories is None:
+            logger.warning(f"读取餐厅 {tenant_id} 的菜单失败，保留旧的菜单快照")
+            return None
+        data = _build(version, time.time_ns(), items, categories)
+        path = snapshot_path(tenant_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    logger.info(f"已发布餐厅 {tenant_id} 的菜单快照: 版本 {version}, {len(items)} 个菜品, {len(data)} 字节, "
+                f"耗时 {(time.monotonic() - started) * 1000:.1f}ms")
+    return current(tenant_id)
+
+
+def ensure_published(tenant_id):
+    """快照不存在或版本号落后于数据库时重新发布"""
+    snapshot = current(tenant_id)
+    with db.use_tenant(tenant_id):
+        version = db.get_menu_version()
+    if snapshot is not None and (version is None or snapshot.version == version):
+        return snapshot
+    return publish(tenant_id)
+
+
+def _try_become_writer():
+    """尝试获取刷新进程的文件锁 (非阻塞)，成功时返回需要一直持有的锁文件；进程退出时锁自动释放，由其他进程接替"""
+    if fcntl is None:
+        return True
+    lock_file = open(os.path.join(MENU_SNAPSHOT_DIR, 'writer.lock'), 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _refresh_loop(interval):
+    writer_lock = None
+    while True:
+        time.sleep(interval)
+        try:
+            if writer_lock is None:
+                os.makedirs(MENU_SNAPSHOT_DIR, exist_ok=True)
+                writer_lock = _try_become_writer()
+                if writer_lock is None:
+                    continue
+                logger.info(f"进程 {os.getpid()} 负责刷新菜单快照")
+            for tenant_id in db.all_tenant_ids():
+                ensure_published(tenant_id)
+            _touch_heartbeat()
+        except Exception as e:
+            logger.error(f"刷新菜单快照失败: {e}", exc_info=True)
+
+
+def start_refresher(interval=MENU_SNAPSHOT_REFRESH_SECONDS):
+    """
+    启动后台刷新线程 (重复调用无副作用)。每个进程都启动 (应用在每个工作进程处理首个请求时调用)，
+    但只有拿到文件锁的一个进程实际检查数据库，用于发现不经过管理接口的菜单变化 (例如售罄自动下架)。
+    """
+    global _refresher
+    with _publish_thread_lock:
+        if _refresher is not None and _refresher.is_alive():
+            return  # fork 之前启动的线程不会出现在子进程中，此时需要重新启动
+        _refresher = threading.Thread(target=_refresh_loop, args=(interval,), name='menu-snapshot-refresher',
+                                      daemon=True)
+    _refresher.start()
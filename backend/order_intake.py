@@ -0,0 +1,521 @@
+# backend/order_intake.py
+# 高峰期下单排队模式：校验通过的订单先追加到本地持久化日志 (批量 fsync) 并立即确认，
+# 再由后台提交线程分批写入 MySQL。确认延迟只取决于本地磁盘，与数据库的提交延迟和锁竞争无关。
+# 每个工作进程写自己的日志文件 (order_intake.<pid>.log) 并在运行期间持有其文件锁；
+# 进程启动时以及运行期间定期接管已退出进程遗留的日志，把其中未提交的订单转入自己的日志后删除旧文件。
+# 是否启用排队下单保存在日志旁的开关文件中，同一主机上的所有工作进程读取同一个开关。
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+
+import backend.database as db
+import backend.recommender as recommender
+
+try:
+    import fcntl  # 仅 POSIX 可用；不可用时不加文件锁，按单进程运行
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INTAKE_ENABLED = False                 # 是否启用排队下单的默认值 (高峰期可由管理员在运行时开启，保存在开关文件中)
+INTAKE_LOG_PATH = 'order_intake.log'   # 订单日志文件名，每个进程实际写入 order_intake.<pid>.log
+INTAKE_FLAG_SUFFIX = '.enabled'        # 开关文件: order_intake.log.enabled，内容为 1 或 0，不存在时使用 INTAKE_ENABLED
+ORPHAN_SCAN_SECONDS = 30               # 提交线程接管已退出进程遗留日志的检查间隔
+FSYNC_WINDOW_SECONDS = 0.002           # 组提交窗口：同一窗口内的多个订单共用一次 fsync
+COMMIT_INTERVAL_SECONDS = 0.2          # 提交线程空闲时的轮询间隔
+COMMIT_BATCH_SIZE = 50                 # 每轮最多提交的订单数
+RETRY_BACKOFF_SECONDS = (0.5, 1, 2, 5, 10, 30)  # 数据库写入失败后的重试间隔 (逐次递增，最后一项封顶)
+COMPACT_MIN_BYTES = 1024 * 1024        # 日志中的订单全部提交后，超过该大小时截断日志
+MAX_RESULTS = 10000                    # 内存中保留的最近提交结果数 (更早的结果通过数据库查询)
+
+QUEUED = 'queued'
+COMMITTED = 'committed'
+REJECTED = 'rejected'
+
+
+class IntakeLog:
+    """
+    追加写的 JSON Lines 日志，每行一条记录：
+      {"op": "order", ...}                     - 已确认的订单
+      {"op": "done", "ref": ..., "order_id": ...} - 已写入数据库
+      {"op": "rejected", "ref": ..., "reason": ...} - 提交时被拒绝 (例如库存不足)
+    append(durable=True) 在记录落盘后才返回；并发写入由先到的线程统一 fsync (组提交)。
+    path 为日志文件名模板，open() 时按当前进程号确定实际文件 (见 process_log_path)。
+    """
+
+    def __init__(self, path, fsync_window=FSYNC_WINDOW_SECONDS):
+        self.base_path = path
+        self.path = None
+        self.fsync_window = fsync_window
+        self._cond = threading.Condition()
+        self._file = None
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self.fsyncs = 0
+
+    def open(self):
+        """
+        打开当前进程的日志并加锁 (持有到进程退出)，返回已有的全部记录 (用于重启后恢复)；
+        崩溃时写了一半的末行会被忽略
+        """
+        self.path = process_log_path(self.base_path, os.getpid())
+        self._file = open(self.path, 'ab')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return _read_records(self.path)
+
+    def claim_orphans(self):
+        """
+        接管已退出进程遗留的日志：对方进程退出后文件锁自动释放，能拿到锁的日志即为无主日志。
+        其中未提交的订单先写入本进程的日志并落盘，再删除旧文件；返回这些订单记录
+        """
+        claimed = []
+        for path in self.other_paths():
+            try:
+                orphan = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with orphan:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # 所属进程仍在运行
+                    try:
+                        if os.stat(path).st_ino != os.fstat(orphan.fileno()).st_ino:
+                            continue  # 等锁期间已被其他进程接管并删除
+                    except FileNotFoundError:
+                        continue
+                records = _read_records(path)
+                finished = {r['ref'] for r in records if r.get('op') in ('done', 'rejected')}
+                orders = [r for r in records if r.get('op') == 'order' and r['ref'] not in finished]
+                for record in orders:
+                    self.append(record, durable=False)
+                self.sync()
+                os.remove(path)
+            if orders:
+                logger.info(f"从遗留的订单日志 {path} 接管了 {len(orders)} 个待提交订单")
+            claimed.extend(orders)
+        return claimed
+
+    def other_paths(self):
+        """其他进程 (运行中或已退出) 的日志文件"""
+        root, ext = os.path.splitext(self.base_path)
+        candidates = sorted(set(glob.glob(f"{glob.escape(root)}.*{ext}")) | {self.base_path})
+        return [path for path in candidates if os.path.abspath(path) != os.path.abspath(self.path)]
+
+    def find_in_other_logs(self, ref):
+        """在其他进程的日志中查找订单参考号，返回该订单的下单记录和结束标记 (order, marker)，未找到时返回 None"""
+        needle = ref.encode('utf-8')
+        for path in self.other_paths():
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            if needle not in data:
+                continue
+            order = marker = None
+            for line in data.splitlines():
+                if needle not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('ref') != ref:
+                    continue
+                if record.get('op') == 'order':
+                    order = record
+                elif record.get('op') in ('done', 'rejected'):
+                    marker = record
+            if order is not None:
+                return order, marker
+        return None
+
+    def append(self, record, durable=True):
+        data = (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        with self._cond:
+            self._file.write(data)
+            self._file.flush()
+            self._written += 1
+            if durable:
+                self._wait_synced(self._written)
+
+    def sync(self):
+        """把此前写入的所有记录落盘"""
+        with self._cond:
+            self._wait_synced(self._written)
+
+    def truncate(self):
+        """清空日志 (调用方保证其中已没有未提交的订单)"""
+        with self._cond:
+            self._file.truncate(0)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def size(self):
+        with self._cond:
+            return self._file.tell() if self._file else 0
+
+    def close(self):
+        with self._cond:
+            if self._file:
+                self._file.close()  # 同时释放文件锁
+                self._file = None
+
+    def _wait_synced(self, seq):
+        # 调用方持有 self._cond
+        while self._synced < seq:
+            if self._syncing:
+                self._cond.wait()
+                continue
+            # 由当前线程负责本轮 fsync，先等待一个窗口收集其他线程的写入
+            self._syncing = True
+            self._cond.release()
+            try:
+                if self.fsync_window:
+                    time.sleep(self.fsync_window)
+                with self._cond:
+                    target = self._written
+                    fd = self._file.fileno()
+                os.fsync(fd)
+            finally:
+                self._cond.acquire()
+                self._syncing = False
+                self._cond.notify_all()
+            self._synced = max(self._synced, target)
+            self.fsyncs += 1
+
+
+def process_log_path(base_path, pid):
+    """进程 pid 的日志文件：order_intake.log -> order_intake.<pid>.log"""
+    root, ext = os.path.splitext(base_path)
+    return f"{root}.{pid}{ext}"
+
+
+def _read_records(path):
+    records = []
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"忽略订单日志 {path} 中不完整的记录")
+    return records
+
+
+class IntakeSwitch:
+    """
+    排队下单开关，保存在文件中，同一主机上的所有工作进程读取同一个开关。
+    每次读取只 stat 文件，修改时间变化后才重新读取内容；写入时原子替换文件。
+    """
+
+    def __init__(self, path, default=INTAKE_ENABLED):
+        self.path = path
+        self.default = default
+        self._lock = threading.Lock()
+        self._cached = (None, default)     # (文件修改时间, 开关值)
+
+    def get(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return self.default
+        with self._lock:
+            cached_mtime, value = self._cached
+            if mtime != cached_mtime:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    value = f.read().strip() == '1'
+                self._cached = (mtime, value)
+            return value
+
+    def set(self, enabled):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('1' if enabled else '0')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class _Pending:
+    __slots__ = ('record', 'durable', 'attempts', 'next_attempt_at')
+
+    def __init__(self, record, durable=False):
+        self.record = record
+        self.durable = durable
+        self.attempts = 0
+        self.next_attempt_at = 0.0
+
+
+class OrderIntake:
+    """
+    排队下单：submit() 写日志后立即返回订单参考号，后台线程调用 db.create_order 提交。
+    通过 orders.intake_ref 唯一键保证每个订单只写入一次 (重启后重放日志、写完成标记前崩溃等情况下也不会重复)。
+    """
+
+    def __init__(self, log_path=INTAKE_LOG_PATH):
+        self._switch = IntakeSwitch(f"{log_path}{INTAKE_FLAG_SUFFIX}")
+        self._log = IntakeLog(log_path)
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()      # ref -> _Pending (按确认顺序提交)
+        self._results = OrderedDict()      # ref -> 提交结果 (最近 MAX_RESULTS 条)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stats = {"accepted": 0, "committed": 0, "rejected": 0, "failed_attempts": 0, "recovered": 0}
+
+    @property
+    def enabled(self):
+        """是否启用排队下单 (所有工作进程共享)"""
+        return self._switch.get()
+
+    @enabled.setter
+    def enabled(self, value):
+        self._switch.set(bool(value))
+
+    def start(self):
+        """
+        打开本进程的日志、恢复本进程及已退出进程遗留的未提交订单并启动提交线程 (重复调用无副作用)。
+        应用在每个工作进程处理首个请求时调用。
+        """
+        with self._start_lock:
+            if self._started:
+                return
+            records = self._log.open()
+            finished = {r['ref'] for r in records if r.get('op') in ('done', 'rejected')}
+            records.extend(self._log.claim_orphans())
+            with self._lock:
+                for record in records:
+                    if record.get('op') == 'order' and record['ref'] not in finished:
+                        self._pending[record['ref']] = _Pending(record, durable=True)
+                self._stats["recovered"] = len(self._pending)
+            if self._pending:
+                logger.info(f"从订单日志恢复了 {len(self._pending)} 个待提交订单")
+            self._thread = threading.Thread(target=self._run, name='order-intake-committer', daemon=True)
+            self._thread.start()
+            self._started = True
+
+    def submit(self, user_id, customer_name, total_amount, items_data, payment_method=None,
+               delivery_address=None, notes=None):
+        """
+        确认一个已校验的订单：写入本地日志并落盘后返回参考号。
+        库存在提交到数据库时才扣减，库存不足的订单状态会变为 rejected。
+        """
+        self.start()
+        ref = uuid.uuid4().hex
+        record = {
+            "op": "order",
+            "ref": ref,
+            "tenant_id": db.current_tenant_id(),
+            "user_id": user_id,
+            "customer_name": customer_name,
+            "total_amount": str(total_amount),
+            "items": [{**item, 'unit_price': str(item['unit_price']), 'subtotal': str(item['subtotal'])}
+                      for item in items_data],
+            "payment_method": payment_method,
+            "delivery_address": delivery_address,
+            "notes": notes,
+            "queued_at": datetime.now().isoformat(timespec='seconds'),
+        }
+        pending = _Pending(record)
+        # 先登记再写日志，保证截断日志时不会漏掉正在写入的订单
+        with self._lock:
+            self._pending[ref] = pending
+        try:
+            self._log.append(record)
+        except Exception:
+            with self._lock:
+                self._pending.pop(ref, None)
+            raise
+        with self._lock:
+            pending.durable = True
+            self._stats["accepted"] += 1
+        self._wakeup.set()
+        return ref
+
+    def status(self, ref):
+        """
+        查询排队订单的状态，返回 dict (含 status、tenant_id、user_id) 或 None：
+        queued - 尚未写入数据库；committed - 已写入 (附 order_id)；rejected - 提交时被拒绝 (附 reason)
+        订单由其他工作进程受理时，从对方的日志中读取状态。
+        """
+        with self._lock:
+            pending = self._pending.get(ref)
+            if pending is not None:
+                return _queued_view(pending.record)
+            result = self._results.get(ref)
+            if result is not None:
+                return dict(result)
+        order_id = db.get_order_id_by_intake_ref(ref)
+        if order_id:
+            return {"ref": ref, "status": COMMITTED, "order_id": order_id, "tenant_id": db.current_tenant_id()}
+        found = self._log.find_in_other_logs(ref) if self._started else None
+        if found is None:
+            return None
+        order, marker = found
+        if marker is None or marker['op'] == 'done':
+            return _queued_view(order)   # 完成标记写入后数据库中即可查到，这里只可能是刚好提交的瞬间
+        return {"ref": ref, "status": REJECTED, "tenant_id": order['tenant_id'], "user_id": order['user_id'],
+                "reason": marker['reason'], "menu_item_id": marker.get('menu_item_id')}
+
+    def queued_orders_for_user(self, user_id):
+        """当前租户下该用户尚未写入数据库的订单"""
+        tenant_id = db.current_tenant_id()
+        with self._lock:
+            return [_queued_view(p.record) for p in self._pending.values()
+                    if p.record['tenant_id'] == tenant_id and p.record['user_id'] == user_id]
+
+    def drain(self):
+        """提交一批已落盘的订单；返回本轮处理的订单数"""
+        now = time.monotonic()
+        with self._lock:
+            batch = [p for p in self._pending.values() if p.durable and p.next_attempt_at <= now][:COMMIT_BATCH_SIZE]
+        processed = 0
+        for pending in batch:
+            if not self._commit_one(pending):
+                break  # 数据库不可用，本轮剩余订单稍后再试
+            processed += 1
+        if processed:
+            self._log.sync()
+            self._maybe_compact()
+        return processed
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result["enabled"] = self.enabled
+            result["queue_depth"] = len(self._pending)
+        result["log_bytes"] = self._log.size()
+        result["fsyncs"] = self._log.fsyncs
+        return result
+
+    def stop(self):
+        """停止提交线程，并尽量提交剩余订单 (未提交的订单留在日志中，下次启动时恢复)"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=COMMIT_INTERVAL_SECONDS * 5)
+        if self._started:
+            while self.drain():
+                pass
+            self._log.close()
+
+    def _commit_one(self, pending):
+        record = pending.record
+        ref = record['ref']
+        try:
+            with db.use_tenant(record['tenant_id']):
+                order_id = db.get_order_id_by_intake_ref(ref)
+                if not order_id:
+                    order_id = db.create_order(
+                        total_amount=Decimal(record['total_amount']),
+                        items_data=[{**item, 'unit_price': Decimal(item['unit_price']),
+                                     'subtotal': Decimal(item['subtotal'])} for item in record['items']],
+                        user_id=record['user_id'],
+                        customer_name=record['customer_name'],
+                        payment_method=record['payment_method'],
+                        delivery_address=record['delivery_address'],
+                        notes=record['notes'],
+                        intake_ref=ref,
+                    )
+                    if order_id:
+                        recommender.record_order(order_id, [item['menu_item_id'] for item in record['items']])
+        except db.InsufficientStockError as se:
+            self._finish(ref, {"op": "rejected", "ref": ref, "reason": "insufficient_stock",
+                               "menu_item_id": se.menu_item_id})
+            logger.info(f"排队订单 {ref} 因菜品ID {se.menu_item_id} 库存不足被拒绝")
+            return True
+        except Exception as e:
+            logger.error(f"提交排队订单 {ref} 时发生错误: {e}", exc_info=True)
+            order_id = None
+
+        if not order_id:
+            with self._lock:
+                pending.attempts += 1
+                backoff = RETRY_BACKOFF_SECONDS[min(pending.attempts, len(RETRY_BACKOFF_SECONDS)) - 1]
+                pending.next_attempt_at = time.monotonic() + backoff
+                self._stats["failed_attempts"] += 1
+            logger.warning(f"排队订单 {ref} 第 {pending.attempts} 次提交失败，{backoff} 秒后重试")
+            return False
+
+        self._finish(ref, {"op": "done", "ref": ref, "order_id": order_id})
+        return True
+
+    def _finish(self, ref, marker):
+        # 完成标记不单独 fsync：丢失时重启后会再次提交，由 intake_ref 唯一键去重
+        self._log.append(marker, durable=False)
+        with self._lock:
+            pending = self._pending.pop(ref, None)
+            record = pending.record if pending else {}
+            result = {"ref": ref, "tenant_id": record.get('tenant_id'), "user_id": record.get('user_id')}
+            if marker['op'] == 'done':
+                result.update(status=COMMITTED, order_id=marker['order_id'])
+                self._stats["committed"] += 1
+            else:
+                result.update(status=REJECTED, reason=marker['reason'], menu_item_id=marker.get('menu_item_id'))
+                self._stats["rejected"] += 1
+            self._results[ref] = result
+            while len(self._results) > MAX_RESULTS:
+                self._results.popitem(last=False)
+
+    def _claim_orphans(self):
+        """接管运行期间退出的其他进程遗留的日志 (其他进程不会重新启动时，订单不会滞留在旧日志中)"""
+        records = self._log.claim_orphans()
+        if not records:
+            return
+        with self._lock:
+            for record in records:
+                self._pending.setdefault(record['ref'], _Pending(record, durable=True))
+            self._stats["recovered"] += len(records)
+        self._wakeup.set()
+
+    def _maybe_compact(self):
+        with self._lock:
+            if self._pending or self._log.size() < COMPACT_MIN_BYTES:
+                return
+            self._log.truncate()
+
+    def _run(self):
+        next_orphan_scan = time.monotonic() + ORPHAN_SCAN_SECONDS
+        while not self._stopped.is_set():
+            self._wakeup.wait(COMMIT_INTERVAL_SECONDS)
+            self._wakeup.clear()
+            try:
+                if time.monotonic() >= next_orphan_scan:
+                    next_orphan_scan = time.monotonic() + ORPHAN_SCAN_SECONDS
+                    self._claim_orphans()
+                while self.drain() and not self._stopped.is_set():
+                    pass
+            except Exception as e:
+                logger.error(f"排队订单提交线程出错: {e}", exc_info=True)
+
+
+def _queued_view(record):
+    return {
+        "ref": record['ref'],
+        "status": QUEUED,
+        "tenant_id": record['tenant_id'],
+        "user_id": record['user_id'],
+        "total_amount": record['total_amount'],
+        "items": record['items'],
+        "queued_at": record['queued_at'],
+    }
+
+
+order_intake = OrderIntake()
+atexit.register(order_intake.stop)
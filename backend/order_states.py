@@ -0,0 +1,53 @@
+# backend/order_states.py
+# 订单状态机：集中声明订单状态 (status) 和支付状态 (payment_status) 的合法转换。
+# 数据库层据此生成条件更新 (UPDATE ... WHERE status IN (合法的前驱状态))，受影响行数即转换结果
+
+# 订单状态: 当前状态 -> 可转换到的状态
+ORDER_STATUS_TRANSITIONS = {
+    'pending': ('confirmed', 'cancelled'),
+    'confirmed': ('preparing', 'cancelled'),
+    'preparing': ('completed', 'delivered', 'cancelled'),
+    'completed': ('delivered',),
+    'delivered': (),
+    'cancelled': (),
+}
+ORDER_STATUSES = tuple(ORDER_STATUS_TRANSITIONS)
+
+# 支付状态: 当前状态 -> 可转换到的状态
+PAYMENT_STATUS_TRANSITIONS = {
+    'unpaid': ('paid', 'failed'),
+    'failed': ('paid',),
+    'paid': ('refunded',),
+    'refunded': (),
+}
+PAYMENT_STATUSES = tuple(PAYMENT_STATUS_TRANSITIONS)
+
+# 转换到某个支付状态时，订单本身不能处于这些状态 (例如已取消的订单不能再支付)
+PAYMENT_BLOCKING_ORDER_STATUSES = {
+    'paid': ('cancelled',),
+}
+
+# 转换结果
+APPLIED = 'applied'          # 已转换
+UNCHANGED = 'unchanged'      # 订单已处于目标状态 (重复请求)，视为成功
+NOT_FOUND = 'not_found'      # 订单不存在 (或不属于当前餐厅)
+FORBIDDEN = 'forbidden'      # 订单不属于指定用户
+INVALID = 'invalid'          # 当前状态不允许转换到目标状态
+
+_FIELDS = {
+    'status': ORDER_STATUS_TRANSITIONS,
+    'payment_status': PAYMENT_STATUS_TRANSITIONS,
+}
+
+
+def allowed_sources(field, target):
+    """
+    返回可以转换到 target 的所有前驱状态。
+    :param field: 'status' 或 'payment_status'
+    :raises ValueError: target 不是合法状态
+    """
+    transitions = _FIELDS[field]
+    if target not in transitions:
+        raise ValueError(f"无效的{'订单' if field == 'status' else '支付'}状态: {target}. "
+                         f"合法状态为: {', '.join(transitions)}")
+    return tuple(source for source, targets in transitions.items() if target in targets)
@@ -0,0 +1,205 @@
+# backend/profiler.py
+# 按需请求剖析：管理员开启后，带 X-Profile 请求头的请求或按比例抽样的请求在采样剖析器下运行，
+# 记录调用栈 (折叠栈格式，可直接生成火焰图) 和经 execute_query 执行的 SQL 及耗时，结果保存在有界环形缓冲区中。
+# 未开启时请求路径上只有一次布尔判断，execute_query 只多一次 ContextVar 读取
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+
+PROFILE_HEADER = 'X-Profile'          # 带该请求头 (值非空) 的请求在开启期间一定被剖析
+PROFILE_BUFFER_SIZE = 50              # 环形缓冲区保留的剖析结果数
+PROFILE_SAMPLE_INTERVAL = 0.005       # 调用栈采样间隔 (秒)
+PROFILE_MAX_STACK_DEPTH = 64
+PROFILE_MAX_SQL_STATEMENTS = 200      # 每个请求最多记录的 SQL 条数
+PROFILE_DEFAULT_ARM_SECONDS = 15 * 60 # 开启后自动关闭的时间，避免忘记关闭
+PROFILE_EXCLUDED_PREFIXES = ('/api/admin/profiles', '/healthz', '/readyz')
+
+_current_profile = ContextVar('current_profile', default=None)
+
+
+class Profile:
+    """单个请求的剖析结果"""
+
+    def __init__(self, method, path, reason, thread_id):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.reason = reason              # 'header' 或 'sampled'
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+        self.status = None
+        self.finished = False             # 结束后采样线程不再写入 stacks (由 RequestProfiler._lock 保护)
+        self.samples = 0
+        self.stacks = {}                  # 折叠栈 "根;...;叶" -> 采样次数
+        self.sql = []                     # [{"sql", "ms", "rows"}]
+        self.sql_total_ms = 0.0
+        self.sql_dropped = 0
+
+    def add_sample(self, frame):
+        names = []
+        while frame is not None and len(names) < PROFILE_MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        stack = ';'.join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def add_sql(self, query, elapsed_seconds, rows=None):
+        elapsed_ms = elapsed_seconds * 1000
+        self.sql_total_ms += elapsed_ms
+        if len(self.sql) >= PROFILE_MAX_SQL_STATEMENTS:
+            self.sql_dropped += 1
+            return
+        self.sql.append({"sql": ' '.join(query.split()), "ms": round(elapsed_ms, 2), "rows": rows})
+
+    def finish(self, status):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 2)
+        self.status = status
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "samples": self.samples,
+            "sql_count": len(self.sql) + self.sql_dropped,
+            "sql_total_ms": round(self.sql_total_ms, 2),
+        }
+
+    def to_dict(self):
+        return {
+            **self.summary(),
+            "sample_interval_ms": PROFILE_SAMPLE_INTERVAL * 1000,
+            "stacks": self.stacks,
+            "sql": self.sql,
+            "sql_dropped": self.sql_dropped,
+        }
+
+    def collapsed(self):
+        """折叠栈文本 (每行 "帧;帧;帧 次数")，可直接交给 flamegraph.pl / speedscope"""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+class RequestProfiler:
+    """管理开关配置、采样线程和环形缓冲区"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.armed = False                # 请求路径上唯一的判断，未开启时不做任何其他工作
+        self._armed_until = 0.0
+        self._sample_rate = 0.0
+        self._path_prefix = None
+        self._active = {}                 # 线程ID -> Profile
+        self._results = deque(maxlen=PROFILE_BUFFER_SIZE)
+        self._sampler = None
+
+    def configure(self, enabled, sample_rate=0.0, path_prefix=None, arm_seconds=PROFILE_DEFAULT_ARM_SECONDS):
+        """开启/关闭剖析。sample_rate 为 0~1 的抽样比例；path_prefix 限定只剖析该前缀的路径"""
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate 必须在 0 到 1 之间")
+        if arm_seconds <= 0:
+            raise ValueError("arm_seconds 必须为正数")
+        with self._lock:
+            self._sample_rate = float(sample_rate)
+            self._path_prefix = path_prefix or None
+            self._armed_until = time.monotonic() + arm_seconds if enabled else 0.0
+            self.armed = bool(enabled)
+
+    def config(self):
+        with self._lock:
+            remaining = max(0.0, self._armed_until - time.monotonic()) if self.armed else 0.0
+            return {
+                "enabled": self.armed,
+                "sample_rate": self._sample_rate,
+                "path_prefix": self._path_prefix,
+                "remaining_seconds": round(remaining),
+                "header": PROFILE_HEADER,
+                "buffer_size": PROFILE_BUFFER_SIZE,
+            }
+
+    def start_request(self, method, path, header_value):
+        """请求开始时调用 (仅在 armed 时)，被选中时返回 Profile 并开始采样，否则返回 None"""
+        if time.monotonic() > self._armed_until:
+            self.armed = False
+            return None
+        if path.startswith(PROFILE_EXCLUDED_PREFIXES):
+            return None
+        if self._path_prefix and not path.startswith(self._path_prefix):
+            return None
+        if header_value:
+            reason = 'header'
+        elif self._sample_rate and random.random() < self._sample_rate:
+            reason = 'sampled'
+        else:
+            return None
+
+        profile = Profile(method, path, reason, threading.get_ident())
+        with self._lock:
+            self._active[profile.thread_id] = profile
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name='request-profiler', daemon=True)
+                self._sampler.start()
+        profile.context_token = _current_profile.set(profile)
+        return profile
+
+    def finish_request(self, profile, status):
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+            profile.finished = True
+        _current_profile.reset(profile.context_token)
+        profile.finish(status)
+        with self._lock:
+            self._results.append(profile)
+
+    def _sample_loop(self):
+        # 没有正在剖析的请求时退出，下次有请求被选中时重新启动
+        while True:
+            time.sleep(PROFILE_SAMPLE_INTERVAL)
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                active = list(self._active.items())
+            frames = sys._current_frames()
+            # 在锁内写入并跳过已结束的请求：结束后的 stacks 不再变化，读取结果时无需再加锁
+            with self._lock:
+                for thread_id, profile in active:
+                    frame = frames.get(thread_id)
+                    if frame is not None and not profile.finished:
+                        profile.add_sample(frame)
+            del frames
+
+    def list(self):
+        with self._lock:
+            return [profile.summary() for profile in reversed(self._results)]
+
+    def get(self, profile_id):
+        with self._lock:
+            for profile in self._results:
+                if profile.id == profile_id:
+                    return profile
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+def current_profile():
+    """当前请求正在进行的剖析 (未被剖析时为 None)，供 execute_query 记录 SQL"""
+    return _current_profile.get()
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,140 @@
+# backend/rate_limit.py
+# 高开销接口的限流 (按用户/IP 的令牌桶) 与全局准入控制 (超载时直接返回 429，而不是排队到超时)
+# 大模型调用的并发上限 (舱壁) 见 llm_service
+import math
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import request, jsonify, g
+
+import backend.database as db
+
+# 每个路由的令牌桶预算: (桶容量, 每秒补充的令牌数)
+RATE_LIMITS = {
+    'login': (10, 10 / 60),               # 突发 10 次，之后每分钟 10 次
+    'register': (5, 5 / 3600),            # 突发 5 次，之后每小时 5 次
+    'recipe_suggestion': (5, 5 / 60),     # 突发 5 次，之后每分钟 5 次
+}
+
+# 多个 worker 进程共享限流状态时，指定一个本机 SQLite 文件路径；为 None 时仅在进程内存中计数
+RATE_LIMIT_SHARED_DB_PATH = None
+
+# 准入控制阈值
+ADMISSION_MAX_DB_WAITERS = 20       # 数据库连接池排队超过该值时拒绝新的高开销请求
+ADMISSION_RETRY_AFTER_SECONDS = 1   # 准入拒绝时建议客户端等待的秒数
+
+
+def _refill(tokens, updated_at, capacity, refill_rate, now):
+    """计算令牌桶补充后的令牌数，返回 (是否放行, 新令牌数, 需等待秒数)"""
+    tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0
+    return False, tokens, (1 - tokens) / refill_rate
+
+
+class MemoryBucketStore:
+    """进程内的令牌桶存储"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def consume(self, key, capacity, refill_rate):
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            allowed, tokens, retry_after = _refill(tokens, updated_at, capacity, refill_rate, now)
+            self._buckets[key] = (tokens, now)
+            # 防止无限增长：一小时未活动的桶早已补满，可以直接丢弃 (再次出现时视为满桶)
+            if len(self._buckets) > 100000:
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < 3600}
+        return allowed, retry_after
+
+
+class SQLiteBucketStore:
+    """基于本机 SQLite 文件的令牌桶存储，可在同一主机的多个 worker 进程之间共享"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key, capacity, refill_rate):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            allowed, tokens, retry_after = _refill(tokens, updated_at, capacity, refill_rate, now)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+
+bucket_store = SQLiteBucketStore(RATE_LIMIT_SHARED_DB_PATH) if RATE_LIMIT_SHARED_DB_PATH else MemoryBucketStore()
+
+def too_many_requests(message, retry_after=ADMISSION_RETRY_AFTER_SECONDS):
+    """429 响应，附带 Retry-After (秒)"""
+    response = jsonify({"error": message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _client_identity():
+    """已登录用户按 (餐厅, 用户ID) 限流，否则按客户端IP"""
+    current_user = g.get('current_user')
+    if current_user:
+        return f"user:{db.current_tenant_id()}:{current_user['id']}"
+    return f"ip:{request.remote_addr}"
+
+
+def rate_limited(route_name):
+    """装饰器：按 RATE_LIMITS[route_name] 的预算对每个客户端限流"""
+    capacity, refill_rate = RATE_LIMITS[route_name]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = f"{route_name}:{_client_identity()}"
+            try:
+                allowed, retry_after = bucket_store.consume(key, capacity, refill_rate)
+            except sqlite3.Error:
+                # 限流存储异常时放行，不影响正常业务
+                allowed, retry_after = True, 0
+            if not allowed:
+                return too_many_requests("请求过于频繁，请稍后再试", retry_after)
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+def admission_controlled():
+    """
+    装饰器：全局准入控制。
+    数据库连接池排队过长时，直接返回 429 + Retry-After。
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if db.get_pool_stats()['waiting'] >= ADMISSION_MAX_DB_WAITERS:
+                return too_many_requests("服务器繁忙，请稍后再试", ADMISSION_RETRY_AFTER_SECONDS)
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
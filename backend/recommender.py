@@ -0,0 +1,384 @@
+# backend/recommender.py
+# 基于订单共现的菜品推荐 ("常与之搭配")：统计同一订单中菜品两两同时出现的次数，按余弦相似度归一化，
+# 随新订单增量更新，启动时加载压缩快照后只需补齐快照之后的订单。
+# 多进程部署时由持有文件锁的一个进程定期从数据库完整重建模型并保存快照 (包含其他进程受理和取消的订单)，
+# 其他进程在快照更新后重新加载；各进程还会定期从数据库补齐快照之后的新订单
+import atexit
+import gzip
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import backend.database as db
+from backend.menu_search import menu_index
+
+try:
+    import fcntl  # 仅 POSIX 可用；不可用时按单进程运行 (本进程负责重建)
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDER_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                        'recommender_snapshots')
+REBUILD_INTERVAL_SECONDS = 300      # 负责重建的进程每隔该时间从数据库完整重建模型并保存快照
+CATCH_UP_INTERVAL_SECONDS = 30      # 各进程从数据库补齐新订单、检查快照是否更新的间隔
+CATCH_UP_BATCH_SIZE = 1000          # 启动补齐时每批读取的订单数
+MAX_ITEMS_PER_ORDER = 50            # 单个订单最多参与统计的菜品数 (防止超大订单产生过多配对)
+RECENT_ORDER_IDS = 10000            # 记住最近计入的订单ID，补齐查询与增量更新同时看到同一订单时不重复计数
+DEFAULT_LIMIT = 5
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+class CoOccurrenceModel:
+    """
+    单个租户的稀疏共现矩阵：
+    - item_counts[i]: 包含菜品 i 的订单数
+    - pairs[i][j]: 同时包含 i 和 j 的订单数 (对称存储，i != j)
+    相似度 sim(i, j) = pairs[i][j] / sqrt(item_counts[i] * item_counts[j])
+    last_order_id 是从数据库连续读到的最后一个订单ID；本进程增量计入的订单只记在最近订单ID集合中，
+    不推进该位置，其他进程受理的更小ID的订单仍会在补齐时读到
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.item_counts = {}
+        self.pairs = {}
+        self.order_count = 0
+        self.last_order_id = 0
+        self._recent_ids = set()
+        self._recent_order = deque()
+
+    def add_order(self, order_id, item_ids):
+        """把一个订单计入矩阵 (最近已计入过的订单忽略)"""
+        items = sorted(set(item_ids))[:MAX_ITEMS_PER_ORDER]
+        if not items:
+            return
+        with self._lock:
+            if order_id:
+                if order_id in self._recent_ids:
+                    return
+                self._recent_ids.add(order_id)
+                self._recent_order.append(order_id)
+                if len(self._recent_order) > RECENT_ORDER_IDS:
+                    self._recent_ids.discard(self._recent_order.popleft())
+            self.order_count += 1
+            self._apply(items, 1)
+
+    def advance(self, order_id):
+        """从数据库补齐到 order_id 为止 (含) 的全部订单后推进读取位置"""
+        with self._lock:
+            self.last_order_id = max(self.last_order_id, order_id)
+
+    def contains(self, order_id):
+        """订单是否已计入本模型 (数据库读取位置之内，或本进程最近增量计入)"""
+        with self._lock:
+            return order_id <= self.last_order_id or order_id in self._recent_ids
+
+    def remove_order(self, item_ids):
+        """从矩阵中扣除一个已计入的订单 (订单被取消时)"""
+        items = sorted(set(item_ids))[:MAX_ITEMS_PER_ORDER]
+        if not items:
+            return
+        with self._lock:
+            self.order_count = max(0, self.order_count - 1)
+            self._apply(items, -1)
+
+    def _apply(self, items, delta):
+        # 调用方持有 self._lock；计数减到 0 时删除条目，保持矩阵稀疏
+        for i in items:
+            count = self.item_counts.get(i, 0) + delta
+            if count > 0:
+                self.item_counts[i] = count
+            else:
+                self.item_counts.pop(i, None)
+        for index, i in enumerate(items):
+            for j in items[index + 1:]:
+                for a, b in ((i, j), (j, i)):
+                    row = self.pairs.setdefault(a, {})
+                    count = row.get(b, 0) + delta
+                    if count > 0:
+                        row[b] = count
+                    else:
+                        row.pop(b, None)
+                        if not row:
+                            del self.pairs[a]
+
+    def recommend(self, item_ids, limit=DEFAULT_LIMIT, exclude=()):
+        """
+        对输入菜品的相似度求和，返回 [(菜品ID, 得分), ...]。
+        没有任何共现数据时返回空列表。
+        """
+        inputs = set(item_ids)
+        excluded = inputs | set(exclude)
+        scores = {}
+        with self._lock:
+            for i in inputs:
+                count_i = self.item_counts.get(i)
+                if not count_i:
+                    continue
+                for j, together in self.pairs.get(i, {}).items():
+                    if j in excluded or j not in self.item_counts:
+                        continue
+                    scores[j] = scores.get(j, 0.0) + together / math.sqrt(count_i * self.item_counts[j])
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [(item_id, round(score, 4)) for item_id, score in ranked[:limit]]
+
+    def popular(self, limit=DEFAULT_LIMIT, exclude=()):
+        """按点单次数排序的热门菜品 [(菜品ID, 点单订单占比), ...]"""
+        excluded = set(exclude)
+        with self._lock:
+            total = self.order_count or 1
+            ranked = sorted(((i, n) for i, n in self.item_counts.items() if i not in excluded),
+                            key=lambda kv: (-kv[1], kv[0]))
+        return [(item_id, round(n / total, 4)) for item_id, n in ranked[:limit]]
+
+    def to_snapshot(self):
+        """紧凑快照：只保存 i < j 的上三角配对"""
+        with self._lock:
+            pairs = [[i, j, n] for i, row in self.pairs.items() for j, n in row.items() if i < j]
+            return {
+                "format": SNAPSHOT_FORMAT_VERSION,
+                "order_count": self.order_count,
+                "last_order_id": self.last_order_id,
+                "item_counts": [[i, n] for i, n in self.item_counts.items()],
+                "pairs": pairs,
+            }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        model = cls()
+        model.order_count = snapshot['order_count']
+        model.last_order_id = snapshot['last_order_id']
+        model.item_counts = {i: n for i, n in snapshot['item_counts']}
+        for i, j, n in snapshot['pairs']:
+            model.pairs.setdefault(i, {})[j] = n
+            model.pairs.setdefault(j, {})[i] = n
+        return model
+
+    def stats(self):
+        with self._lock:
+            return {
+                "orders": self.order_count,
+                "items": len(self.item_counts),
+                "pairs": sum(len(row) for row in self.pairs.values()) // 2,
+                "last_order_id": self.last_order_id,
+            }
+
+
+def _snapshot_path(tenant_id):
+    return os.path.join(RECOMMENDER_SNAPSHOT_DIR, f"tenant_{tenant_id}.json.gz")
+
+
+def _load_snapshot(tenant_id):
+    path = _snapshot_path(tenant_id)
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"推荐模型快照 {path} 无法读取，将从订单数据重建: {e}")
+        return None
+    if snapshot.get('format') != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return CoOccurrenceModel.from_snapshot(snapshot)
+
+
+def _snapshot_mtime(tenant_id):
+    try:
+        return os.stat(_snapshot_path(tenant_id)).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _save_snapshot(tenant_id, model):
+    path = _snapshot_path(tenant_id)
+    os.makedirs(RECOMMENDER_SNAPSHOT_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(model.to_snapshot(), f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+_models_lock = threading.Lock()
+_models = {}     # 租户ID -> CoOccurrenceModel
+_loaded_mtimes = {}   # 租户ID -> 当前模型所基于的快照文件修改时间
+
+
+def _catch_up(model):
+    """把快照之后 (或从零开始) 的订单计入模型"""
+    while True:
+        batch = db.get_order_item_sets(model.last_order_id, CATCH_UP_BATCH_SIZE)
+        for order_id, item_ids in batch:
+            model.add_order(order_id, item_ids)
+        if batch:
+            model.advance(batch[-1][0])
+        if len(batch) < CATCH_UP_BATCH_SIZE:
+            return
+
+
+def get_model():
+    """当前租户的模型；首次使用时加载快照并补齐之后的订单"""
+    tenant_id = db.current_tenant_id()
+    model = _models.get(tenant_id)
+    if model is not None:
+        return model
+    with _models_lock:
+        model = _models.get(tenant_id)
+        if model is None:
+            mtime = _snapshot_mtime(tenant_id)
+            model = _load_snapshot(tenant_id) or CoOccurrenceModel()
+            _catch_up(model)
+            _models[tenant_id] = model
+            _loaded_mtimes[tenant_id] = mtime
+            # 上面补齐之后、模型登记之前提交的订单既不在补齐结果中，record_order 也跳过了，
+            # 登记后从已读到的最后一个订单再补一次 (与增量更新重叠的订单由 add_order 去重)
+            _catch_up(model)
+            logger.info(f"餐厅 {tenant_id} 的推荐模型已就绪: {model.stats()}")
+            _ensure_maintenance_thread()
+    return model
+
+
+def record_order(order_id, item_ids):
+    """新订单创建成功后增量更新当前租户的模型 (模型尚未加载时跳过，加载时会从数据库补齐)"""
+    model = _models.get(db.current_tenant_id())
+    if model is not None:
+        model.add_order(order_id, item_ids)
+
+
+def record_cancellation(order_id):
+    """
+    订单被取消后从当前租户的模型中扣除该订单。
+    模型尚未加载时跳过 (加载时不会统计已取消的订单)；尚未计入本进程模型的订单 (例如其他进程刚受理的订单) 同样跳过，
+    补齐时不会读到已取消的订单。其他进程中的模型在下一次重建后反映这次取消
+    """
+    model = _models.get(db.current_tenant_id())
+    if model is None or not model.contains(order_id):
+        return
+    item_ids = db.get_order_item_ids(order_id)
+    if item_ids:
+        model.remove_order(item_ids)
+
+
+def recommend(item_ids, limit=DEFAULT_LIMIT):
+    """
+    "常与之搭配" 推荐，只返回当前可供应的菜品。
+    :return: (推荐列表 [{id, name, price, category_name, score}], 来源 'co_occurrence' / 'popular')
+    """
+    model = get_model()
+    source = 'co_occurrence'
+    # 多取一些候选，过滤掉已下架的菜品后仍能凑够 limit 个
+    ranked = model.recommend(item_ids, limit=limit * 3)
+    if not ranked:
+        source = 'popular'
+        ranked = model.popular(limit=limit * 3, exclude=item_ids)
+
+    results = []
+    for item_id, score in ranked:
+        item = menu_index.get_item(item_id)
+        if not item:
+            continue
+        results.append({
+            "id": item_id,
+            "name": item['name'],
+            "price": item['price'],
+            "category_name": item.get('category_name'),
+            "score": score,
+        })
+        if len(results) >= limit:
+            break
+    return results, source
+
+
+def rebuild(tenant_id):
+    """从数据库完整重建一个租户的模型 (不含已取消的订单)，保存快照并替换本进程中的模型"""
+    model = CoOccurrenceModel()
+    with db.use_tenant(tenant_id):
+        _catch_up(model)
+    _save_snapshot(tenant_id, model)
+    with _models_lock:
+        _models[tenant_id] = model
+        _loaded_mtimes[tenant_id] = _snapshot_mtime(tenant_id)
+    logger.info(f"已重建餐厅 {tenant_id} 的推荐模型: {model.stats()}")
+    return model
+
+
+def _reload_if_changed(tenant_id):
+    """快照被负责重建的进程更新后重新加载，并补齐快照之后的订单"""
+    mtime = _snapshot_mtime(tenant_id)
+    if mtime is None or mtime == _loaded_mtimes.get(tenant_id):
+        return
+    model = _load_snapshot(tenant_id)
+    if model is None:
+        return
+    with db.use_tenant(tenant_id):
+        _catch_up(model)
+    with _models_lock:
+        _models[tenant_id] = model
+        _loaded_mtimes[tenant_id] = mtime
+
+
+def get_stats():
+    with _models_lock:
+        return {str(tenant_id): model.stats() for tenant_id, model in _models.items()}
+
+
+_maintenance_thread = None
+_maintenance_lock = threading.Lock()
+_stop_event = threading.Event()
+
+
+def _try_become_builder():
+    """尝试获取重建进程的文件锁 (非阻塞)，成功时返回需要一直持有的锁文件；进程退出时锁自动释放，由其他进程接替"""
+    if fcntl is None:
+        return True
+    lock_file = open(os.path.join(RECOMMENDER_SNAPSHOT_DIR, 'builder.lock'), 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _maintenance_loop():
+    builder_lock = None
+    while not _stop_event.wait(CATCH_UP_INTERVAL_SECONDS):
+        try:
+            if builder_lock is None:
+                os.makedirs(RECOMMENDER_SNAPSHOT_DIR, exist_ok=True)
+                builder_lock = _try_become_builder()
+                if builder_lock is not None:
+                    logger.info(f"进程 {os.getpid()} 负责重建推荐模型快照")
+            for tenant_id in db.all_tenant_ids():
+                if builder_lock is not None:
+                    mtime = _snapshot_mtime(tenant_id)
+                    if mtime is None or time.time() - mtime >= REBUILD_INTERVAL_SECONDS:
+                        rebuild(tenant_id)
+                        continue
+                else:
+                    _reload_if_changed(tenant_id)
+                model = _models.get(tenant_id)
+                if model is not None:
+                    with db.use_tenant(tenant_id):
+                        _catch_up(model)
+        except Exception as e:
+            logger.error(f"维护推荐模型失败: {e}", exc_info=True)
+
+
+def _ensure_maintenance_thread():
+    global _maintenance_thread
+    with _maintenance_lock:
+        if _maintenance_thread is not None and _maintenance_thread.is_alive():
+            return  # fork 之前启动的线程不会出现在子进程中，此时需要重新启动
+        _maintenance_thread = threading.Thread(target=_maintenance_loop, name='recommender-maintenance', daemon=True)
+        _maintenance_thread.start()
+
+
+atexit.register(_stop_event.set)
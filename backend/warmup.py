@@ -0,0 +1,159 @@
+# backend/warmup.py
+# 启动预热：进程开始接收请求后在后台线程中预先打开各分片的连接池、加载菜单索引等缓存，
+# 完成前 /readyz 返回 503，负载均衡器据此在预热结束后才把流量导入新实例。
+# 同时记录导入耗时、预热各步骤耗时和首个快速请求的到达时间，用于衡量冷启动
+import logging
+import threading
+import time
+
+import backend.database as db
+import backend.llm_service as llm
+import backend.menu_prefilter as menu_prefilter
+import backend.menu_snapshot as menu_snapshot
+import backend.recommender as recommender
+from backend.menu_search import menu_index
+
+logger = logging.getLogger(__name__)
+
+FAST_REQUEST_MS = 50        # 耗时低于该值的请求视为 "快速请求"
+PROBE_PATHS = ('/healthz', '/readyz')   # 探针请求不计入首个请求统计
+RETRY_BACKOFF_SECONDS = (1, 2, 5, 10, 30)  # 预热失败后的重试间隔 (逐次递增，最后一项封顶)，直到成功为止
+
+_started_at = time.monotonic()
+_lock = threading.Lock()
+_state = {
+    "status": "pending",        # pending -> warming -> ready (失败时为 failed 并稍后重试，期间 /readyz 返回 503)
+    "import_ms": None,
+    "steps": {},                # 已完成的步骤名 -> 耗时 (毫秒)，重试时跳过
+    "ready_after_ms": None,     # 进程启动后多久完成预热
+    "error": None,              # 最近一次失败的原因
+    "attempts": 0,              # 已执行的预热轮数
+    "first_request": None,      # 首个请求: {"after_ms", "duration_ms"}
+    "first_fast_request": None, # 首个快速请求: {"after_ms", "duration_ms", "path"}
+}
+_thread = None
+
+
+def _elapsed_ms(since):
+    return round((time.monotonic() - since) * 1000, 1)
+
+
+def record_import_time(import_started):
+    """记录应用模块的导入耗时 (app.py 导入完成时调用)，之后的耗时都从应用开始导入时算起"""
+    global _started_at
+    with _lock:
+        _started_at = import_started
+        _state["import_ms"] = _elapsed_ms(import_started)
+
+
+def record_request(path, duration_seconds):
+    """记录请求耗时，用于计算启动后首个快速请求的时间"""
+    if _state["first_fast_request"] is not None or path in PROBE_PATHS:
+        return
+    entry = {"after_ms": _elapsed_ms(_started_at), "duration_ms": round(duration_seconds * 1000, 1), "path": path}
+    with _lock:
+        if _state["first_request"] is None:
+            _state["first_request"] = entry
+        if _state["first_fast_request"] is None and entry["duration_ms"] < FAST_REQUEST_MS:
+            _state["first_fast_request"] = entry
+            logger.info(f"启动后 {entry['after_ms']}ms 处理了首个快速请求 {path} ({entry['duration_ms']}ms)")
+
+
+def _step(name, func):
+    if name in _state["steps"]:
+        return  # 上一轮已完成
+    started = time.monotonic()
+    func()
+    with _lock:
+        _state["steps"][name] = _elapsed_ms(started)
+
+
+def _open_pools():
+    """创建每个分片的连接池 (mysql-connector 在创建连接池时打开全部连接)，并用一次查询确认可用"""
+    for shard_name, tenant_ids in db.shard_tenants().items():
+        with db.use_tenant(tenant_ids[0]):
+            if db.execute_query("SELECT 1 AS ok", fetch_one=True) is None:
+                raise RuntimeError(f"无法连接分片 {shard_name} 的数据库")
+
+
+def _publish_menu_snapshots():
+    """确保每家餐厅的共享菜单快照存在且是最新版本 (其他进程已发布时直接复用)"""
+    for tenant_id in db.all_tenant_ids():
+        menu_snapshot.ensure_published(tenant_id)
+
+
+def _prime_menu_caches():
+    """为每家餐厅构建菜单搜索索引和大模型候选菜品目录，并预先执行菜单/分类查询"""
+    for tenant_id in db.all_tenant_ids():
+        with db.use_tenant(tenant_id):
+            menu_index.ensure_built()
+            menu_prefilter.get_catalog()
+            db.get_all_menu_items(include_unavailable=False, with_thumbnails=True)
+            db.get_all_categories()
+
+
+def _prime_recommender():
+    for tenant_id in db.all_tenant_ids():
+        with db.use_tenant(tenant_id):
+            recommender.get_model()
+
+
+def _warm(extra_steps):
+    _step("db_pools", _open_pools)
+    _step("menu_snapshots", _publish_menu_snapshots)
+    _step("menu_caches", _prime_menu_caches)
+    _step("recommender", _prime_recommender)
+    for name, func in extra_steps:
+        _step(name, func)
+
+
+def _run(extra_steps):
+    # 失败 (例如数据库暂时不可用) 时按退避间隔重试，已完成的步骤不再重复执行
+    while True:
+        with _lock:
+            _state["status"] = "warming"
+            _state["attempts"] += 1
+            attempt = _state["attempts"]
+        try:
+            _warm(extra_steps)
+            break
+        except Exception as e:
+            backoff = RETRY_BACKOFF_SECONDS[min(attempt, len(RETRY_BACKOFF_SECONDS)) - 1]
+            logger.error(f"启动预热第 {attempt} 次失败，{backoff} 秒后重试: {e}", exc_info=True)
+            with _lock:
+                _state["status"] = "failed"
+                _state["error"] = str(e)
+            time.sleep(backoff)
+    with _lock:
+        _state["status"] = "ready"
+        _state["error"] = None
+        _state["ready_after_ms"] = _elapsed_ms(_started_at)
+    logger.info(f"启动预热完成，进程启动后 {_state['ready_after_ms']}ms 就绪: {_state['steps']}")
+
+    # 大模型 SDK 导入较慢且不影响核心功能，就绪后再在后台加载
+    try:
+        started = time.monotonic()
+        llm.preload()
+        with _lock:
+            _state["steps"]["llm_sdk_after_ready"] = _elapsed_ms(started)
+    except Exception as e:
+        logger.warning(f"预加载大模型 SDK 失败 (首次调用时重试): {e}")
+
+
+def start(extra_steps=()):
+    """在后台线程中执行预热 (重复调用无副作用)；extra_steps 为额外的 (步骤名, 函数) 列表"""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, args=(list(extra_steps),), name='warmup', daemon=True)
+    _thread.start()
+
+
+def is_ready():
+    return _state["status"] == "ready"
+
+
+def get_state():
+    with _lock:
+        return {**_state, "steps": dict(_state["steps"]), "uptime_ms": _elapsed_ms(_started_at)}
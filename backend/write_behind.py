@@ -0,0 +1,150 @@
+# backend/write_behind.py
+# 非关键写操作的写后缓冲 (write-behind)：同一键的多次更新在内存中合并，由后台线程按间隔或数量阈值批量写入
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+import backend.database as db
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = 2.0   # 定时刷新间隔
+MAX_PENDING_KEYS = 500         # 待写入键数达到该值时立即刷新
+FLUSH_BATCH_SIZE = 500         # 单条多行语句最多包含的键数
+
+
+def _last_write_wins(old, new):
+    return new
+
+
+class WriteBehindBuffer:
+    """
+    按 (类别, 键) 合并的写后缓冲。
+    每个类别注册一个批量写入函数 flush_fn(dict[key] -> value) -> bool；
+    写入失败的数据会合并回缓冲区，在下一轮重试 (不会覆盖期间产生的更新)。
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL_SECONDS, max_pending=MAX_PENDING_KEYS):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._writers = {}
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stats = {
+            "flushes": 0,
+            "flushed_keys": 0,
+            "coalesced_updates": 0,
+            "failed_flushes": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+
+    def register(self, kind, flush_fn, merge_fn=_last_write_wins):
+        """注册一个写入类别"""
+        with self._lock:
+            self._writers[kind] = (flush_fn, merge_fn)
+            self._pending.setdefault(kind, {})
+
+    def put(self, kind, key, value):
+        """记录一次更新 (立即返回，不访问数据库)"""
+        _, merge_fn = self._writers[kind]
+        with self._lock:
+            pending = self._pending[kind]
+            if key in pending:
+                pending[key] = merge_fn(pending[key], value)
+                self._stats["coalesced_updates"] += 1
+            else:
+                pending[key] = value
+            depth = sum(len(p) for p in self._pending.values())
+        self._ensure_started()
+        if depth >= self.max_pending:
+            self._wakeup.set()
+
+    def flush(self):
+        """把当前缓冲的所有更新写入数据库"""
+        with self._flush_lock:
+            with self._lock:
+                batches = {kind: pending for kind, pending in self._pending.items() if pending}
+                for kind in batches:
+                    self._pending[kind] = {}
+            for kind, pending in batches.items():
+                flush_fn, merge_fn = self._writers[kind]
+                items = list(pending.items())
+                for start in range(0, len(items), FLUSH_BATCH_SIZE):
+                    chunk = dict(items[start:start + FLUSH_BATCH_SIZE])
+                    started = time.perf_counter()
+                    try:
+                        ok = flush_fn(chunk)
+                    except Exception as e:
+                        logger.error(f"写后缓冲刷新 '{kind}' 失败: {e}", exc_info=True)
+                        ok = False
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    with self._lock:
+                        self._stats["last_flush_ms"] = round(elapsed_ms, 3)
+                        self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], round(elapsed_ms, 3))
+                        if ok:
+                            self._stats["flushes"] += 1
+                            self._stats["flushed_keys"] += len(chunk)
+                        else:
+                            self._stats["failed_flushes"] += 1
+                            current = self._pending[kind]
+                            for key, value in chunk.items():
+                                # 期间产生的新值优先
+                                current[key] = merge_fn(value, current[key]) if key in current else value
+
+    def stats(self):
+        """返回队列深度与刷新耗时等指标"""
+        with self._lock:
+            result = dict(self._stats)
+            result["queue_depth"] = {kind: len(pending) for kind, pending in self._pending.items()}
+        return result
+
+    def stop(self):
+        """停止后台线程并把剩余数据全部写入 (进程退出时自动调用)"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+def _flush_last_logins(last_logins):
+    """按租户分组写入 (键为 (tenant_id, user_id))，每组路由到该租户所在分片"""
+    by_tenant = {}
+    for (tenant_id, user_id), login_time in last_logins.items():
+        by_tenant.setdefault(tenant_id, {})[user_id] = login_time
+    ok = True
+    for tenant_id, batch in by_tenant.items():
+        with db.use_tenant(tenant_id):
+            ok = db.update_users_last_login_batch(batch) and ok
+    return ok
+
+
+write_buffer = WriteBehindBuffer()
+write_buffer.register('last_login', _flush_last_logins)
+atexit.register(write_buffer.stop)
+
+
+def record_last_login(user_id):
+    """记录当前租户下用户的登录时间 (异步批量写入 users.last_login)"""
+    write_buffer.put('last_login', (db.current_tenant_id(), user_id), datetime.now())
@@ -7,42 +7,104 @@ USE restaurant_db;
 -- 用户表 (核心表，用于存储用户信息和角色)
 CREATE TABLE IF NOT EXISTS users (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    username VARCHAR(50) NOT NULL UNIQUE,         -- 用户名，唯一
+    tenant_id INT NOT NULL DEFAULT 1,             -- 所属餐厅 (租户)ID，见 backend/db_config.py 中的 TENANT_SHARDS
+    username VARCHAR(50) NOT NULL,                -- 用户名，同一餐厅内唯一
     password_hash VARCHAR(255) NOT NULL,          -- 哈希后的密码
     role VARCHAR(20) DEFAULT 'customer' CHECK (role IN ('customer', 'admin', 'staff')), -- 角色: customer, admin, staff
     full_name VARCHAR(100),                       -- 真实姓名
-    phone VARCHAR(20) UNIQUE,                     -- 电话号码，唯一 (可选)
-    email VARCHAR(100) UNIQUE,                    -- 邮箱，唯一 (可选)
+    phone VARCHAR(20),                            -- 电话号码，同一餐厅内唯一 (可选)
+    email VARCHAR(100),                           -- 邮箱，同一餐厅内唯一 (可选)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- 注册时间
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, -- 信息更新时间
-    last_login TIMESTAMP NULL                     -- 上次登录时间
+    last_login TIMESTAMP NULL,                    -- 上次登录时间
+    tokens_valid_after DOUBLE NULL,               -- 访问令牌吊销截止时间 (Unix 时间戳)：签发不晚于该时间的访问令牌全部失效
+    UNIQUE KEY uk_users_tenant_username (tenant_id, username),
+    UNIQUE KEY uk_users_tenant_phone (tenant_id, phone),
+    UNIQUE KEY uk_users_tenant_email (tenant_id, email)
+);
+
+-- 刷新令牌表 (只保存令牌的 SHA-256 哈希；每次刷新都会轮换，同一登录会话的令牌属于同一个 family)
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    token_hash CHAR(64) NOT NULL UNIQUE,          -- 刷新令牌的 SHA-256 哈希
+    family_id CHAR(32) NOT NULL,                  -- 令牌族ID (检测到重放时整族吊销)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP NULL,                    -- 已使用或已吊销的时间
+    INDEX idx_refresh_tokens_family (family_id),
+    INDEX idx_refresh_tokens_user (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- 已吊销的访问令牌 (登出)。所有工作进程在校验访问令牌时查询，访问令牌过期后由归档任务清理
+CREATE TABLE IF NOT EXISTS revoked_access_tokens (
+    jti CHAR(32) PRIMARY KEY,                     -- 访问令牌ID
+    user_id INT NOT NULL,
+    expires_at TIMESTAMP NOT NULL,                -- 访问令牌的过期时间
+    INDEX idx_revoked_access_tokens_expires (expires_at),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
 -- 分类表 (用于菜品分类)
 CREATE TABLE IF NOT EXISTS categories (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    name VARCHAR(50) NOT NULL UNIQUE,             -- 分类名称
+    tenant_id INT NOT NULL DEFAULT 1,             -- 所属餐厅 (租户)ID
+    name VARCHAR(50) NOT NULL,                    -- 分类名称，同一餐厅内唯一
     description TEXT,                             -- 分类描述
-    display_order INT DEFAULT 0                   -- 显示顺序 (用于前端排序)
+    display_order INT DEFAULT 0,                  -- 显示顺序 (用于前端排序)
+    UNIQUE KEY uk_categories_tenant_name (tenant_id, name)
 );
 
 -- 菜品表
 CREATE TABLE IF NOT EXISTS menu_items (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    name VARCHAR(100) NOT NULL UNIQUE,            -- 菜品名称
+    tenant_id INT NOT NULL DEFAULT 1,             -- 所属餐厅 (租户)ID
+    name VARCHAR(100) NOT NULL,                   -- 菜品名称，同一餐厅内唯一
     description TEXT,                             -- 描述
     price DECIMAL(10, 2) NOT NULL,                -- 价格
     category_id INT,                              -- 外键，关联 categories 表
     image_url VARCHAR(255),                       -- 图片链接 (可选)
     is_available BOOLEAN DEFAULT TRUE,            -- 是否可供应
+    auto_disabled BOOLEAN DEFAULT FALSE,          -- 是否因库存售罄被系统自动下架 (补货或订单取消后自动恢复)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uk_menu_items_tenant_name (tenant_id, name),
     FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE SET NULL -- 如果分类被删除，菜品分类ID置空
 );
 
+-- 菜品库存分片表 (限量菜品的库存拆分为多行计数器，下单时随机扣减一个分片，避免热点行锁)
+-- 没有分片行的菜品表示不限量
+CREATE TABLE IF NOT EXISTS menu_item_stock_shards (
+    menu_item_id INT NOT NULL,
+    shard_id INT NOT NULL,
+    quantity INT NOT NULL DEFAULT 0 CHECK (quantity >= 0),
+    PRIMARY KEY (menu_item_id, shard_id),
+    FOREIGN KEY (menu_item_id) REFERENCES menu_items(id) ON DELETE CASCADE
+);
+
+-- 菜单变更日志 (由下方触发器写入)：菜品/分类每次新增、修改、下架或删除都追加一行，
+-- 自增ID即菜单目录版本号，客户端通过 /api/menu/changes?since=<版本号> 只拉取该版本之后变化的菜品和分类
+CREATE TABLE IF NOT EXISTS menu_changes (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tenant_id INT NOT NULL,
+    entity VARCHAR(10) NOT NULL,                  -- 'item' 或 'category'
+    entity_id INT NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_menu_changes_tenant (tenant_id, id),
+    INDEX idx_menu_changes_time (changed_at)      -- 供清理任务删除过期记录
+);
+
+-- 每家餐厅已清理到的变更日志版本号：早于该版本的客户端无法增量同步，需要全量刷新
+CREATE TABLE IF NOT EXISTS menu_change_watermarks (
+    tenant_id INT PRIMARY KEY,
+    pruned_through BIGINT NOT NULL DEFAULT 0
+);
+
 -- 订单表 (核心表，关联用户)
 CREATE TABLE IF NOT EXISTS orders (
     id INT AUTO_INCREMENT PRIMARY KEY,
+    tenant_id INT NOT NULL DEFAULT 1,             -- 所属餐厅 (租户)ID
     user_id INT NULL,                             -- 外键，关联 users 表 (允许匿名用户下单，所以为NULL)
     customer_name VARCHAR(100),                   -- 顾客名称 (主要用于匿名用户或备用)
     order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- 下单时间
@@ -50,11 +112,22 @@ CREATE TABLE IF NOT EXISTS orders (
     status VARCHAR(20) DEFAULT 'pending' CHECK (status IN ('pending', 'confirmed', 'preparing', 'completed', 'cancelled', 'delivered')), -- 订单状态
     payment_method VARCHAR(50),                   -- 支付方式
     payment_status VARCHAR(20) DEFAULT 'unpaid' CHECK (payment_status IN ('unpaid', 'paid', 'failed', 'refunded')), -- 支付状态
+    paid_at TIMESTAMP NULL,                       -- 支付成功时间
     delivery_address TEXT,                        -- 配送地址 (如果需要外送)
     notes TEXT,                                   -- 订单备注
+    intake_ref CHAR(32) NULL,                     -- 排队下单的订单参考号 (直接下单时为 NULL)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL -- 如果用户被删除，订单中的user_id置空
+    UNIQUE KEY uk_orders_intake_ref (intake_ref), -- 保证同一排队订单只写入一次
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL, -- 如果用户被删除，订单中的user_id置空
+    INDEX idx_orders_status_time (status, order_time), -- 供归档任务按状态和下单时间查找终态历史订单
+    INDEX idx_orders_tenant_time (tenant_id, order_time), -- 按餐厅分页查询订单、按下单时间范围搜索
+    -- 管理员订单搜索 (见 database.search_orders_admin)，每种搜索条件都有以 tenant_id 开头的索引支撑
+    INDEX idx_orders_tenant_user_time (tenant_id, user_id, order_time),        -- 按手机号/用户名找到用户后取订单
+    INDEX idx_orders_tenant_customer (tenant_id, customer_name, order_time),   -- 顾客名前缀
+    INDEX idx_orders_tenant_payment_time (tenant_id, payment_status, order_time), -- 支付状态 (+ 时间范围)
+    INDEX idx_orders_tenant_status_time (tenant_id, status, order_time),       -- 订单状态 (+ 时间范围)
+    INDEX idx_orders_tenant_amount (tenant_id, total_amount)                   -- 只按金额范围搜索
 );
 
 -- 订单详情表 (一个订单可以包含多个菜品)
@@ -83,6 +156,23 @@ CREATE TABLE IF NOT EXISTS order_status_history (
     FOREIGN KEY (changed_by_user_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
+-- 历史订单归档表 (结构与近期表一致，但不带外键；由 backend/archiver.py 定时迁移终态历史订单)
+-- 近期表只保留最近的订单，管理员列表和统计查询因此不再扫描多年的历史数据
+CREATE TABLE IF NOT EXISTS orders_archive LIKE orders;
+CREATE TABLE IF NOT EXISTS order_items_archive LIKE order_items;
+CREATE TABLE IF NOT EXISTS order_status_history_archive LIKE order_status_history;
+
+-- 幂等键表 (可选，用于在多进程/重启后重放下单、支付等请求的响应)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    idempotency_key VARCHAR(255) PRIMARY KEY,     -- 用户ID:方法:路径:客户端提供的键
+    request_fingerprint CHAR(64) NOT NULL,        -- 请求体的 SHA-256
+    status_code INT NOT NULL,                     -- 首次请求的响应状态码
+    response_body TEXT NOT NULL,                  -- 首次请求的响应体 (JSON)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,                -- 过期时间
+    INDEX idx_idempotency_expires (expires_at)
+);
+
 -- 示例：会话变量，用于触发器中获取当前操作用户ID (需要在应用层面设置)
 -- SET @current_user_id = 1; -- 假设当前操作用户是ID为1的管理员
 
@@ -103,6 +193,56 @@ END //
 DELIMITER ;
 
 
+-- 触发器：菜品或分类变化时写入菜单变更日志 (只在对客户端可见的字段变化时记录，库存计数变化不记录)
+DELIMITER //
+CREATE TRIGGER IF NOT EXISTS after_menu_item_insert
+AFTER INSERT ON menu_items
+FOR EACH ROW
+BEGIN
+    INSERT INTO menu_changes (tenant_id, entity, entity_id) VALUES (NEW.tenant_id, 'item', NEW.id);
+END //
+
+CREATE TRIGGER IF NOT EXISTS after_menu_item_update
+AFTER UPDATE ON menu_items
+FOR EACH ROW
+BEGIN
+    IF NOT (OLD.name <=> NEW.name AND OLD.description <=> NEW.description AND OLD.price <=> NEW.price
+            AND OLD.category_id <=> NEW.category_id AND OLD.image_url <=> NEW.image_url
+            AND OLD.is_available <=> NEW.is_available) THEN
+        INSERT INTO menu_changes (tenant_id, entity, entity_id) VALUES (NEW.tenant_id, 'item', NEW.id);
+    END IF;
+END //
+
+CREATE TRIGGER IF NOT EXISTS after_menu_item_delete
+AFTER DELETE ON menu_items
+FOR EACH ROW
+BEGIN
+    INSERT INTO menu_changes (tenant_id, entity, entity_id) VALUES (OLD.tenant_id, 'item', OLD.id);
+END //
+
+CREATE TRIGGER IF NOT EXISTS after_category_insert
+AFTER INSERT ON categories
+FOR EACH ROW
+BEGIN
+    INSERT INTO menu_changes (tenant_id, entity, entity_id) VALUES (NEW.tenant_id, 'category', NEW.id);
+END //
+
+CREATE TRIGGER IF NOT EXISTS after_category_update
+AFTER UPDATE ON categories
+FOR EACH ROW
+BEGIN
+    INSERT INTO menu_changes (tenant_id, entity, entity_id) VALUES (NEW.tenant_id, 'category', NEW.id);
+END //
+
+CREATE TRIGGER IF NOT EXISTS after_category_delete
+AFTER DELETE ON categories
+FOR EACH ROW
+BEGIN
+    INSERT INTO menu_changes (tenant_id, entity, entity_id) VALUES (OLD.tenant_id, 'category', OLD.id);
+END //
+DELIMITER ;
+
+
 -- --- 插入初始数据 ---
 
 -- 插入分类数据
@@ -139,11 +279,20 @@ COMMIT;
 
 -- 注意：开发初期，如果需要完全重置数据库和表，可以取消以下注释并执行
 SET FOREIGN_KEY_CHECKS = 0;
+DROP TABLE IF EXISTS idempotency_keys;
+DROP TABLE IF EXISTS order_status_history_archive;
+DROP TABLE IF EXISTS order_items_archive;
+DROP TABLE IF EXISTS orders_archive;
 DROP TABLE IF EXISTS order_status_history;
 DROP TABLE IF EXISTS order_items;
 DROP TABLE IF EXISTS orders;
+DROP TABLE IF EXISTS menu_item_stock_shards;
+DROP TABLE IF EXISTS menu_change_watermarks;
+DROP TABLE IF EXISTS menu_changes;
 DROP TABLE IF EXISTS menu_items;
 DROP TABLE IF EXISTS categories;
+DROP TABLE IF EXISTS revoked_access_tokens;
+DROP TABLE IF EXISTS refresh_tokens;
 DROP TABLE IF EXISTS users;
 SET FOREIGN_KEY_CHECKS = 1;
 DROP DATABASE IF EXISTS restaurant_db;
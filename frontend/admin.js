@@ -29,6 +29,7 @@ let allCategoriesCache = [];
 let currentEditingItemId = null;
 let ordersCurrentPage = 1; // MODIFIED: 移到全局，方便各函数访问
 const ORDERS_PER_PAGE_ADMIN = 10;
+let orderDetailsCache = new Map(); // 当前页订单的详情 (批量预取)，查看详情时无需再逐个请求
 function formatPrice(value) {
     const num = parseFloat(value);
     return isNaN(num) ? '0.00' : num.toFixed(2);
@@ -167,6 +168,26 @@ function getAuthToken() {
     return localStorage.getItem('accessToken');
 }
 
+async function refreshAccessToken() {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (!refreshToken) return false;
+    try {
+        const response = await fetch(`${API_BASE_URL}/auth/refresh`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: refreshToken }),
+        });
+        if (!response.ok) return false;
+        const result = await response.json();
+        localStorage.setItem('accessToken', result.access_token);
+        localStorage.setItem('refreshToken', result.refresh_token);
+        return true;
+    } catch (error) {
+        console.error('刷新令牌失败:', error);
+        return false;
+    }
+}
+
 async function fetchWithAuth(url, options = {}) {
     const token = getAuthToken();
     const headers = {
@@ -176,10 +197,17 @@ async function fetchWithAuth(url, options = {}) {
     if (token) {
         headers['Authorization'] = `Bearer ${token}`;
     }
-    const response = await fetch(url, { ...options, headers });
+    let response = await fetch(url, { ...options, headers });
+
+    // 访问令牌过期时先尝试用刷新令牌换取新令牌，并重发原请求
+    if (response.status === 401 && await refreshAccessToken()) {
+        headers['Authorization'] = `Bearer ${getAuthToken()}`;
+        response = await fetch(url, { ...options, headers });
+    }
 
     if (response.status === 401) { 
         localStorage.removeItem('accessToken');
+        localStorage.removeItem('refreshToken');
         localStorage.removeItem('currentUser');
         currentAdmin = null;
         showAdminModal('会话已过期', '您的登录已过期，请重新登录。', [{ text: '去登录', class: 'button-primary', action: () => window.location.href = 'index.html#login' }]); // MODIFIED: 跳转到登录页并带上hash
@@ -228,7 +256,15 @@ async function checkAdminAuthAndInit() {
 }
 
 function adminLogout() {
+    const refreshToken = localStorage.getItem('refreshToken');
+    fetch(`${API_BASE_URL}/auth/logout`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${getAuthToken()}` },
+        body: JSON.stringify({ refresh_token: refreshToken }),
+        keepalive: true,
+    }).catch(error => console.error('登出请求失败:', error));
     localStorage.removeItem('accessToken');
+    localStorage.removeItem('refreshToken');
     localStorage.removeItem('currentUser');
     currentAdmin = null;
     window.location.href = 'index.html';
@@ -631,6 +667,7 @@ async function fetchAllOrdersAdmin(page = 1, status = '') {
         const data = await response.json();
         renderOrderManagementTable(data.orders);
         renderOrderPagination(data.total_orders, data.page, data.per_page);
+        prefetchOrderDetails(data.orders);
     } catch (error) {
         console.error('获取所有订单失败 (admin):', error);
         if(container) {
@@ -776,18 +813,36 @@ function renderOrderPagination(totalOrders, currentPage, perPage) {
     }
 }
 
+// 一次请求批量获取当前页所有订单的详情
+async function prefetchOrderDetails(orders) {
+    orderDetailsCache = new Map();
+    const ids = (orders || []).map(order => order && order.id).filter(id => typeof id !== 'undefined');
+    if (ids.length === 0) return;
+    try {
+        const response = await fetchWithAuth(`${API_BASE_URL}/orders/details?ids=${ids.join(',')}`);
+        if (!response.ok) return;
+        const data = await response.json();
+        (data.orders || []).forEach(order => orderDetailsCache.set(order.id, order));
+    } catch (error) {
+        console.warn('批量预取订单详情失败，查看详情时将单独请求:', error);
+    }
+}
+
 async function showOrderDetailsModal(orderId) {
     if (typeof orderId === 'undefined' || orderId === null) { // MODIFIED: 检查 orderId
         showAdminModal('错误', '无效的订单ID。');
         return;
     }
     try {
-        const response = await fetchWithAuth(`${API_BASE_URL}/orders/${orderId}`); 
-        if (!response.ok) {
-            const errorResult = await response.json().catch(() => ({ error: `HTTP error ${response.status}` }));
-            throw new Error(errorResult.error || `获取订单详情失败: ${response.statusText}`);
+        let orderDetails = orderDetailsCache.get(orderId);
+        if (!orderDetails) {
+            const response = await fetchWithAuth(`${API_BASE_URL}/orders/${orderId}`); 
+            if (!response.ok) {
+                const errorResult = await response.json().catch(() => ({ error: `HTTP error ${response.status}` }));
+                throw new Error(errorResult.error || `获取订单详情失败: ${response.statusText}`);
+            }
+            orderDetails = await response.json();
         }
-        const orderDetails = await response.json();
         
         // MODIFIED: 增加对 orderDetails 及其属性的防御性检查
         if (!orderDetails || typeof orderDetails.id === 'undefined') {
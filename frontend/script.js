@@ -45,6 +45,10 @@ let cart = []; // 购物车状态
 let currentUser = null; // 当前登录用户信息 { id, username, role, access_token, full_name }
 let myOrdersCurrentPage = 1;
 const MY_ORDERS_PER_PAGE = 5;
+let myOrderDetailsCache = new Map(); // 当前页历史订单的详情 (批量预取)
+let menuItemsCache = []; // 当前显示的菜单
+let menuVersion = null; // 菜单版本号 (来自 X-Menu-Version 响应头)，用于增量同步
+const MENU_SYNC_INTERVAL_MS = 60 * 1000; // 菜单增量同步间隔
 
 
 // --- 辅助函数 ---
@@ -77,15 +81,43 @@ function getAuthToken() {
 }
 
 // 保存Token和用户信息
-function saveAuthData(token, user) {
+function saveAuthData(token, user, refreshToken) {
     localStorage.setItem('accessToken', token);
     localStorage.setItem('currentUser', JSON.stringify(user)); // 保存整个用户信息对象
+    if (refreshToken) {
+        localStorage.setItem('refreshToken', refreshToken);
+    }
     currentUser = user; // 更新全局变量
 }
 
+// 使用刷新令牌换取新的访问令牌 (无需重新输入密码)，成功返回 true
+async function refreshAccessToken() {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (!refreshToken) return false;
+    try {
+        const response = await fetch(`${API_BASE_URL}/auth/refresh`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: refreshToken }),
+        });
+        if (!response.ok) {
+            localStorage.removeItem('refreshToken');
+            return false;
+        }
+        const result = await response.json();
+        localStorage.setItem('accessToken', result.access_token);
+        localStorage.setItem('refreshToken', result.refresh_token);
+        return true;
+    } catch (error) {
+        console.error('刷新令牌失败:', error);
+        return false;
+    }
+}
+
 // 清除Token和用户信息
 function clearAuthData() {
     localStorage.removeItem('accessToken');
+    localStorage.removeItem('refreshToken');
     localStorage.removeItem('currentUser');
     currentUser = null; // 清除全局变量
 }
@@ -101,6 +133,11 @@ async function fetchWithAuth(url, options = {}) {
         headers['Authorization'] = `Bearer ${token}`;
     }
     const response = await fetch(url, { ...options, headers });
+    // 访问令牌过期时尝试刷新一次，并重发原请求
+    if (response.status === 401 && token && await refreshAccessToken()) {
+        headers['Authorization'] = `Bearer ${getAuthToken()}`;
+        return fetch(url, { ...options, headers });
+    }
     return response;
 }
 
@@ -220,7 +257,7 @@ async function handleLogin(event) {
         });
         const result = await response.json();
         if (response.ok) {
-            saveAuthData(result.access_token, result.user); // 保存Token和用户信息
+            saveAuthData(result.access_token, result.user, result.refresh_token); // 保存Token和用户信息
             showModal('登录成功！');
             closeAuthModal('loginModal');
             updateLoginStateUI();
@@ -240,6 +277,14 @@ async function handleLogin(event) {
 }
 
 function handleLogout() {
+    // 通知后端吊销令牌 (失败不影响本地登出)
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (getAuthToken()) {
+        fetchWithAuth(`${API_BASE_URL}/auth/logout`, {
+            method: 'POST',
+            body: JSON.stringify({ refresh_token: refreshToken }),
+        }).catch(error => console.error('登出请求失败:', error));
+    }
     clearAuthData(); // 清除Token和用户信息
     showModal('您已成功登出。');
     updateLoginStateUI();
@@ -283,7 +328,10 @@ async function fetchMenu() {
         const response = await fetch(`${API_BASE_URL}/menu`); 
         if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
         const menu = await response.json();
-        renderMenu(menu);
+        const version = response.headers.get('X-Menu-Version');
+        menuVersion = version !== null ? version : null;
+        menuItemsCache = menu || [];
+        renderMenu(menuItemsCache);
     } catch (error) {
         console.error('获取菜单失败:', error);
         menuItemsDiv.innerHTML = '<p class="text-red-500 col-span-full">加载菜单失败，请稍后再试。</p>';
@@ -291,6 +339,35 @@ async function fetchMenu() {
     }
 }
 
+// 增量同步菜单：只拉取上次同步之后变化的菜品，没有变化时服务器返回 304 (无响应体)
+async function syncMenuChanges() {
+    if (menuVersion === null) return;
+    try {
+        const response = await fetch(`${API_BASE_URL}/menu/changes?since=${menuVersion}`);
+        if (response.status === 304) return;
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const changes = await response.json();
+        if (changes.full_resync) {
+            await fetchMenu();
+            return;
+        }
+        const removedIds = new Set(changes.removed_item_ids || []);
+        const changedItems = new Map((changes.items || []).map(item => [item.id, item]));
+        const merged = [];
+        menuItemsCache.forEach(item => {
+            if (removedIds.has(item.id)) return;
+            merged.push(changedItems.has(item.id) ? changedItems.get(item.id) : item);
+            changedItems.delete(item.id);
+        });
+        changedItems.forEach(item => merged.push(item)); // 新上架的菜品
+        menuItemsCache = merged;
+        menuVersion = String(changes.version);
+        renderMenu(menuItemsCache);
+    } catch (error) {
+        console.warn('菜单增量同步失败，将在下次同步时重试:', error);
+    }
+}
+
 function renderMenu(menu) {
     menuItemsDiv.innerHTML = '';
     if (!menu || menu.length === 0) {
@@ -303,10 +380,15 @@ function renderMenu(menu) {
             return; 
         }
 
+        // 优先使用后端缩略图代理 (固定尺寸、长期缓存)，没有时回退到原图地址
+        const imageSrc = item.thumbnail_url
+            ? API_BASE_URL.replace(/\/api$/, '') + item.thumbnail_url
+            : (item.image_url || 'https://placehold.co/400x300/E2E8F0/A0AEC0?text=菜品图片');
+
         const itemDiv = document.createElement('div');
         itemDiv.className = 'menu-item'; 
         itemDiv.innerHTML = `
-            <img src="${item.image_url || 'https://placehold.co/400x300/E2E8F0/A0AEC0?text=菜品图片'}" alt="${item.name}" onerror="this.onerror=null;this.src='https://placehold.co/400x300/E2E8F0/A0AEC0?text=图片加载失败';">
+            <img src="${imageSrc}" alt="${item.name}" width="400" height="300" loading="lazy" onerror="this.onerror=null;this.src='https://placehold.co/400x300/E2E8F0/A0AEC0?text=图片加载失败';">
             <div class="flex-grow flex flex-col p-1">
                 <h3 class="menu-item-name mb-1">${item.name}</h3>
                 <p class="menu-item-category">${item.category_name || '未分类'}</p>
@@ -483,6 +565,7 @@ async function fetchMyOrders(page = 1) {
             const data = await response.json();
             renderMyOrders(data.orders);
             renderMyOrdersPagination(data.total_orders, data.page, data.per_page);
+            prefetchMyOrderDetails(data.orders);
         } else if (response.status === 401) {
             showModal('会话已过期或无效，请重新登录查看订单。', true);
             handleLogout();
@@ -598,62 +681,80 @@ function translatePaymentStatus(status) {
     return map[status] || status;
 }
 
+// 一次请求批量获取当前页所有历史订单的详情
+async function prefetchMyOrderDetails(orders) {
+    myOrderDetailsCache = new Map();
+    const ids = (orders || []).map(order => order && order.id).filter(id => typeof id !== 'undefined');
+    if (ids.length === 0) return;
+    try {
+        const response = await fetchWithAuth(`${API_BASE_URL}/orders/details?ids=${ids.join(',')}`);
+        if (!response.ok) return;
+        const data = await response.json();
+        (data.orders || []).forEach(order => myOrderDetailsCache.set(order.id, order));
+    } catch (error) {
+        console.warn('批量预取订单详情失败，查看详情时将单独请求:', error);
+    }
+}
+
 async function fetchAndShowOrderDetails(orderId) {
     try {
-        const response = await fetchWithAuth(`${API_BASE_URL}/orders/${orderId}`);
-        if (response.ok) {
-            const orderDetails = await response.json();
-            if (!orderDetails || typeof orderDetails.id === 'undefined') {
-                showModal('无法获取有效的订单详情数据。', true);
+        let orderDetails = myOrderDetailsCache.get(orderId);
+        if (!orderDetails) {
+            const response = await fetchWithAuth(`${API_BASE_URL}/orders/${orderId}`);
+            if (!response.ok) {
+                const errorResult = await response.json();
+                showModal(`获取订单详情失败: ${errorResult.error || response.statusText}`, true);
                 return;
             }
+            orderDetails = await response.json();
+        }
+        if (!orderDetails || typeof orderDetails.id === 'undefined') {
+            showModal('无法获取有效的订单详情数据。', true);
+            return;
+        }
 
-         // 新增价格格式化函数
-            const formatPrice = (value) => {
-                const num = parseFloat(value);
-                return isNaN(num) ? '0.00' : num.toFixed(2);
-            };
-              let detailsHtml = `
-                <div class="space-y-3 text-left">
-                    <h4 class="text-xl font-semibold mb-3 text-purple-600">订单 #${orderDetails.id} 详情</h4>
-                    <div class="grid grid-cols-2 gap-2">
-                        <p><strong>下单时间:</strong></p><p>${new Date(orderDetails.order_time).toLocaleString('zh-CN')}</p>
-                        <p><strong>总金额:</strong></p><p>¥${parseFloat(orderDetails.total_amount).toFixed(2)}</p>
-                        <p><strong>订单状态:</strong></p><p>${translateOrderStatus(orderDetails.status)}</p>
-                        <p><strong>支付状态:</strong></p><p>${translatePaymentStatus(orderDetails.payment_status)}</p>
-            ${orderDetails.user_full_name ? 
-                `<p><strong>顾客:</strong></p><p>${orderDetails.user_full_name} (${orderDetails.user_username || 'N/A'})</p>` : 
-                `<p><strong>顾客:</strong></p><p>${orderDetails.customer_name || '匿名用户'}</p>`}
-            ${orderDetails.delivery_address ? `<p><strong>配送地址:</strong></p><p>${orderDetails.delivery_address}</p>` : ''}
-            ${orderDetails.notes ? `<p><strong>备注:</strong></p><p>${orderDetails.notes}</p>` : ''}
-                    </div>
-                    <h5 class="text-md font-semibold mt-3 mb-1">订单项目:</h5>
-                    <ul class="list-disc pl-5 text-sm space-y-2">`;
-            if (orderDetails.items && Array.isArray(orderDetails.items)) {
-                orderDetails.items.forEach(item => {
-                    // 添加字段有效性检查
-                    const itemName = item.item_name || '未知商品';
-                    const quantity = item.quantity || 0;
-                    const unitPrice = formatPrice(item.unit_price);
-                    const subtotal = formatPrice(item.subtotal);
-
-                    detailsHtml += `<li>${itemName} x ${quantity} (单价: ¥${unitPrice}) - 小计: ¥${subtotal}`;
-                    if(item.special_requests) detailsHtml += `<br><small class="text-gray-600">特殊要求: ${item.special_requests}</small>`;
-                    detailsHtml += `</li>`;
-                });
-            } else {
-                detailsHtml += `<li>无订单项目信息</li>`;
-            }
-            detailsHtml += `</ul></div>`;
-
-            modalMessageText.innerHTML = detailsHtml;
-            modalMessageText.style.textAlign = 'left';  // 强制左对齐
-            modalMessageText.style.color = '#1e293b';   // 恢复默认文字颜色
-            messageModal.style.display = 'flex';        // 确保模态框显示
+     // 新增价格格式化函数
+        const formatPrice = (value) => {
+            const num = parseFloat(value);
+            return isNaN(num) ? '0.00' : num.toFixed(2);
+        };
+          let detailsHtml = `
+            <div class="space-y-3 text-left">
+                <h4 class="text-xl font-semibold mb-3 text-purple-600">订单 #${orderDetails.id} 详情</h4>
+                <div class="grid grid-cols-2 gap-2">
+                    <p><strong>下单时间:</strong></p><p>${new Date(orderDetails.order_time).toLocaleString('zh-CN')}</p>
+                    <p><strong>总金额:</strong></p><p>¥${parseFloat(orderDetails.total_amount).toFixed(2)}</p>
+                    <p><strong>订单状态:</strong></p><p>${translateOrderStatus(orderDetails.status)}</p>
+                    <p><strong>支付状态:</strong></p><p>${translatePaymentStatus(orderDetails.payment_status)}</p>
+        ${orderDetails.user_full_name ? 
+            `<p><strong>顾客:</strong></p><p>${orderDetails.user_full_name} (${orderDetails.user_username || 'N/A'})</p>` : 
+            `<p><strong>顾客:</strong></p><p>${orderDetails.customer_name || '匿名用户'}</p>`}
+        ${orderDetails.delivery_address ? `<p><strong>配送地址:</strong></p><p>${orderDetails.delivery_address}</p>` : ''}
+        ${orderDetails.notes ? `<p><strong>备注:</strong></p><p>${orderDetails.notes}</p>` : ''}
+                </div>
+                <h5 class="text-md font-semibold mt-3 mb-1">订单项目:</h5>
+                <ul class="list-disc pl-5 text-sm space-y-2">`;
+        if (orderDetails.items && Array.isArray(orderDetails.items)) {
+            orderDetails.items.forEach(item => {
+                // 添加字段有效性检查
+                const itemName = item.item_name || '未知商品';
+                const quantity = item.quantity || 0;
+                const unitPrice = formatPrice(item.unit_price);
+                const subtotal = formatPrice(item.subtotal);
+
+                detailsHtml += `<li>${itemName} x ${quantity} (单价: ¥${unitPrice}) - 小计: ¥${subtotal}`;
+                if(item.special_requests) detailsHtml += `<br><small class="text-gray-600">特殊要求: ${item.special_requests}</small>`;
+                detailsHtml += `</li>`;
+            });
         } else {
-            const errorResult = await response.json();
-            showModal(`获取订单详情失败: ${errorResult.error || response.statusText}`, true);
+            detailsHtml += `<li>无订单项目信息</li>`;
         }
+        detailsHtml += `</ul></div>`;
+
+        modalMessageText.innerHTML = detailsHtml;
+        modalMessageText.style.textAlign = 'left';  // 强制左对齐
+        modalMessageText.style.color = '#1e293b';   // 恢复默认文字颜色
+        messageModal.style.display = 'flex';        // 确保模态框显示
     } catch (error) {
         showModal(`获取订单详情请求失败: ${error.message}`, true);
     }
@@ -743,6 +844,7 @@ async function fetchRecipeSuggestion() {
 document.addEventListener('DOMContentLoaded', () => {
     fetchUserProfileOnLoad(); 
     fetchMenu();
+    setInterval(syncMenuChanges, MENU_SYNC_INTERVAL_MS); // 定期增量同步菜单 (价格、上下架)
     renderCart();
 
     if (loginForm) loginForm.addEventListener('submit', handleLogin);
@@ -0,0 +1,6 @@
+# tests/conftest.py
+# 让测试可以按 backend.xxx 导入后端模块 (与 python -m backend.benchmarks 等用法一致)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
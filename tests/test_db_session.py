@@ -0,0 +1,109 @@
+# tests/test_db_session.py
+# 请求级数据库会话: db.transaction() 内的多个数据库函数只从连接池取一次连接，事务外每个函数各取一次，
+# checkouts 统计从连接池取连接的次数 (X-DB-Checkouts 响应头的来源)。
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("bcrypt")
+
+import backend.database as db
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=()):
+        self.connection.statements.append(query)
+
+    def fetchone(self):
+        return {'id': 1}
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self.pool.returned += 1
+
+
+class FakePool:
+    def __init__(self):
+        self.connections = []
+        self.returned = 0
+
+    def checkout(self, shard_name):
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    fake_pool = FakePool()
+    monkeypatch.setattr(db, "_checkout_connection", fake_pool.checkout)
+    token = db.begin_session()
+    yield fake_pool
+    db.end_session(token)
+
+
+def _lookup():
+    return db.execute_query("SELECT id FROM menu_items WHERE id = %s", (1,), fetch_one=True)
+
+
+def test_each_helper_checks_out_outside_a_transaction(pool):
+    assert _lookup() == {'id': 1}
+    assert _lookup() == {'id': 1}
+    assert db.current_session().checkouts == 2
+    assert pool.returned == 2   # 事务外用完立即归还连接池
+
+
+def test_transaction_reuses_one_connection(pool):
+    with db.transaction():
+        for _ in range(5):
+            assert _lookup() == {'id': 1}
+        assert pool.returned == 0
+    assert db.current_session().checkouts == 1
+    assert pool.returned == 1
+    assert pool.connections[0].commits == 1
+
+
+def test_return_inside_transaction_commits(pool):
+    def route():
+        with db.transaction():
+            if _lookup():
+                return 'found'
+        return 'missing'
+
+    assert route() == 'found'
+    assert pool.connections[0].commits == 1
+    assert db.current_session().checkouts == 1
+
+
+def test_exception_inside_transaction_rolls_back(pool):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            _lookup()
+            raise RuntimeError("boom")
+    connection = pool.connections[0]
+    assert connection.commits == 0 and connection.rollbacks > 0
+    assert pool.returned == 1
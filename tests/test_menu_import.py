@@ -0,0 +1,195 @@
+# tests/test_menu_import.py
+# 菜品批量导入: CSV / JSON 解析、逐行类型校验 (含 DECIMAL(10,2) 价格上限)，
+# 以及 1000 行导入只用少量多行语句写入 (假游标，不需要数据库)。
+import json
+import math
+import time
+
+import pytest
+
+import backend.menu_import as menu_import
+
+
+def _normalize(raw):
+    return menu_import.normalize_row(raw)
+
+
+# --- CSV / JSON 解析 ---
+def test_csv_and_json_inputs_normalize_to_the_same_rows():
+    csv_text = ("﻿name,price,category,is_available,description\n"
+                "宫保鸡丁, 28.5 ,热菜,是,\n"
+                "凉拌黄瓜,12,凉菜,false,清爽\n")
+    json_rows = [
+        {"name": "宫保鸡丁", "price": 28.5, "category": "热菜", "is_available": True},
+        {"name": "凉拌黄瓜", "price": "12", "category": "凉菜", "is_available": "false", "description": "清爽"},
+    ]
+    from_csv = [_normalize(raw) for raw in menu_import.parse_csv(csv_text)]
+    from_json = [_normalize(raw) for raw in menu_import.parse_json({"items": json_rows})]
+    assert from_csv == from_json
+    assert from_csv[0] == ({'name': '宫保鸡丁', 'price': 28.5, 'category': '热菜', 'is_available': True}, [])
+
+
+def test_csv_empty_cells_leave_fields_unchanged():
+    rows = menu_import.parse_csv("id,name,price,image_url\n7,,30,\n")
+    assert rows == [{'id': '7', 'price': '30'}]
+    assert _normalize(rows[0]) == ({'id': 7, 'price': 30.0}, [])
+
+
+def test_csv_rejects_missing_header_and_unknown_columns():
+    with pytest.raises(ValueError, match="表头"):
+        menu_import.parse_csv("")
+    with pytest.raises(ValueError, match="未知的列: colour"):
+        menu_import.parse_csv("name,colour\n宫保鸡丁,red\n")
+
+
+def test_json_accepts_list_or_items_object_only():
+    assert menu_import.parse_json([{"name": "a"}]) == [{"name": "a"}]
+    assert menu_import.parse_json({"items": []}) == []
+    for invalid in ({"rows": []}, "name,price", 42, None):
+        with pytest.raises(ValueError):
+            menu_import.parse_json(invalid)
+
+
+def test_row_limit_applies_to_both_formats():
+    limit = menu_import.MAX_BULK_ROWS
+    assert len(menu_import.parse_json([{}] * limit)) == limit
+    with pytest.raises(ValueError, match=str(limit)):
+        menu_import.parse_json([{}] * (limit + 1))
+    with pytest.raises(ValueError, match=str(limit)):
+        menu_import.parse_csv("name\n" + "\n".join(f"菜品{i}" for i in range(limit + 1)))
+
+
+# --- 逐行类型校验 ---
+@pytest.mark.parametrize('raw, message', [
+    ("宫保鸡丁", "每一行必须是对象"),
+    ({"price": 10}, "每一行必须提供 id 或菜品名称"),
+    ({"id": 0, "price": 10}, "id 必须是正整数"),
+    ({"id": "abc"}, "id 必须是正整数"),
+    ({"id": True}, "id 必须是正整数"),
+    ({"name": "   "}, "菜品名称不能为空"),
+    ({"name": "菜" * (menu_import.NAME_MAX_LENGTH + 1)}, f"菜品名称不能超过 {menu_import.NAME_MAX_LENGTH} 个字符"),
+    ({"name": "a", "price": "free"}, "价格必须是正数"),
+    ({"name": "a", "price": -1}, "价格必须是正数"),
+    ({"name": "a", "price": 0.001}, "价格必须是正数"),
+    ({"name": "a", "price": "nan"}, "价格必须是正数"),
+    ({"name": "a", "price": "inf"}, "价格必须是正数"),
+    ({"name": "a", "price": True}, "价格必须是正数"),
+    ({"name": "a", "category_id": "热菜"}, "分类ID必须是整数"),
+    ({"name": "a", "category_id": False}, "分类ID必须是整数"),
+    ({"name": "a", "is_available": "maybe"}, "is_available 必须是布尔值 (true/false)"),
+    ({"name": "a", "image_url": "ftp://example.com/a.jpg"}, "图片链接只支持 http/https 协议"),
+    ({"name": "a", "image_url": "http://127.0.0.1/a.jpg"}, "图片链接不能指向本机或内网地址"),
+    ({"name": "a", "image_url": "https://example.com/" + "a" * menu_import.IMAGE_URL_MAX_LENGTH},
+     f"图片链接不能超过 {menu_import.IMAGE_URL_MAX_LENGTH} 个字符"),
+    ({"name": "a", "colour": "red"}, "未知的字段: colour"),
+])
+def test_invalid_rows_report_errors(raw, message):
+    _, errors = _normalize(raw)
+    assert message in errors
+
+
+def test_price_must_fit_decimal_10_2():
+    limit = menu_import.PRICE_LIMIT
+    assert _normalize({"name": "a", "price": "99999999.99"}) == ({'name': 'a', 'price': 99999999.99}, [])
+    for price in (limit, "100000000.00", "99999999.995", 1e12):
+        _, errors = _normalize({"name": "a", "price": price})
+        assert errors == [f"价格必须小于 {limit}"], price
+
+
+def test_values_are_converted_to_column_types():
+    row, errors = _normalize({"id": "12", "price": "9.999", "category_id": "3", "is_available": "N",
+                              "description": None, "image_url": ""})
+    assert errors == []
+    assert row == {'id': 12, 'price': 10.0, 'category_id': 3, 'is_available': False,
+                   'description': None, 'image_url': None}
+
+
+def test_category_id_takes_precedence_over_category_name():
+    row, _ = _normalize({"name": "a", "category_id": 2, "category": "热菜"})
+    assert row == {'name': 'a', 'category_id': 2}
+
+
+# --- 1000 行导入 ---
+class _FakeBulkCursor:
+    def __init__(self, existing, categories):
+        self.existing = existing
+        self.categories = categories
+        self.statements = []
+        self.inserted = {}
+        self._rows = []
+
+    def execute(self, query, params=()):
+        sql = " ".join(query.split())
+        self.statements.append(sql)
+        if sql.startswith("SELECT id, name, description, price"):
+            self._rows = [dict(item) for item in self.existing]
+        elif sql.startswith("SELECT id, name FROM categories"):
+            self._rows = [dict(category) for category in self.categories]
+        elif sql.startswith("INSERT INTO menu_items"):
+            for offset in range(0, len(params), 9):
+                item_id, _, name = params[offset:offset + 3]
+                self.inserted[name] = item_id or 10000 + len(self.inserted)
+        elif sql.startswith("SELECT id, name FROM menu_items"):
+            self._rows = [{'id': self.inserted[name], 'name': name} for name in params[1:]]
+        else:
+            raise AssertionError(f"不支持的语句: {sql}")
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class _FakeBulkConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.committed = False
+
+    def cursor(self, dictionary=False):
+        return self._cursor
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def test_import_of_1000_rows_uses_batched_statements(monkeypatch):
+    pytest.importorskip("mysql.connector")
+    pytest.importorskip("bcrypt")
+    import backend.database as db
+
+    existing = [{'id': i, 'name': f"菜品{i}", 'description': '', 'price': 10, 'category_id': 1,
+                 'image_url': None, 'is_available': True, 'auto_disabled': False} for i in range(1, 501)]
+    cursor = _FakeBulkCursor(existing, [{'id': 1, 'name': '热菜'}])
+    connection = _FakeBulkConnection(cursor)
+    monkeypatch.setattr(db, "_checkout_connection", lambda shard_name: connection)
+
+    # 前 500 行修改已有菜品的价格，后 500 行新增
+    payload = json.dumps([{"name": f"菜品{i}", "price": 12, "category": "热菜"} for i in range(1, 1001)])
+    started = time.perf_counter()
+    rows = []
+    for number, raw in enumerate(menu_import.parse_json(json.loads(payload)), start=1):
+        row, errors = menu_import.normalize_row(raw)
+        assert errors == []
+        rows.append({"row": number, **row})
+    result = db.bulk_upsert_menu_items(rows)
+    elapsed = time.perf_counter() - started
+
+    assert result["applied"] and connection.committed
+    assert (len(result["updated"]), len(result["created"]), result["errors"]) == (500, 500, [])
+    assert all(entry['id'] for entry in result["created"])
+    inserts = [sql for sql in cursor.statements if sql.startswith("INSERT INTO menu_items")]
+    assert len(inserts) == math.ceil(1000 / db.MENU_BULK_STATEMENT_ROWS)
+    # 锁定读取菜品 + 分类 + 多行写入 + 按名称查回新增ID，语句数与行数无关
+    assert len(cursor.statements) == 2 + len(inserts) + math.ceil(500 / db.MENU_BULK_STATEMENT_ROWS)
+    # 解析、校验和生成语句都在内存中完成，1000 行远低于 1 秒
+    assert elapsed < 1.0, f"1000 行导入耗时 {elapsed:.3f}s"
@@ -0,0 +1,109 @@
+# tests/test_order_search_plan.py
+# 管理员订单搜索: 每种条件组合选用的 FORCE INDEX 必须存在于 database_setup.sql 的 orders 表中，
+# 且以 tenant_id 开头、覆盖驱动条件的列 (索引改名或删列后 FORCE INDEX 会直接报错)。
+import itertools
+import os
+import re
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("bcrypt")
+
+import backend.database as db
+
+SETUP_SQL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database_setup.sql')
+
+CRITERIA_VALUES = {
+    'customer': '张',
+    'phone': '13800000000',
+    'date_from': '2024-01-01',
+    'date_to': '2024-02-01',
+    'min_amount': 10,
+    'max_amount': 100,
+    'payment_status': 'paid',
+    'status': 'completed',
+}
+
+
+def _orders_indexes():
+    """解析 orders 表的索引: 索引名 -> 列名列表"""
+    with open(SETUP_SQL, encoding='utf-8') as f:
+        sql = f.read()
+    table = re.search(r"CREATE TABLE IF NOT EXISTS orders \((.*?)\n\);", sql, re.S).group(1)
+    return {name: [column.strip() for column in columns.split(',')]
+            for name, columns in re.findall(r"INDEX (\w+) \(([^)]*)\)", table)}
+
+
+ORDERS_INDEXES = _orders_indexes()
+
+
+def _search(monkeypatch, criteria):
+    """用假的 execute_query 执行一次搜索，返回 (结果, 执行过的 SQL 列表)"""
+    queries = []
+
+    def fake_execute_query(query, params=None, fetch_one=False, fetch_all=False, **kwargs):
+        queries.append(query)
+        if 'FROM users WHERE tenant_id = %s AND phone' in query:
+            return {'id': 7}
+        if 'FROM users WHERE tenant_id = %s AND username LIKE' in query:
+            return [{'id': 3}, {'id': 4}]
+        if 'COUNT(*)' in query:
+            return {'total_orders': 0}
+        return [] if fetch_all else None
+
+    monkeypatch.setattr(db, "execute_query", fake_execute_query)
+    return db.search_orders_admin(criteria, explain=True), queries
+
+
+def _combinations():
+    keys = list(CRITERIA_VALUES)
+    for size in range(len(keys) + 1):
+        for combo in itertools.combinations(keys, size):
+            yield {key: CRITERIA_VALUES[key] for key in combo}
+
+
+def test_schema_has_tenant_leading_search_indexes():
+    assert ORDERS_INDEXES['idx_orders_tenant_time'] == ['tenant_id', 'order_time']
+    for name, columns in ORDERS_INDEXES.items():
+        if name.startswith('idx_orders_tenant_'):
+            assert columns[0] == 'tenant_id', name
+
+
+@pytest.mark.parametrize('criteria', list(_combinations()), ids=lambda c: '+'.join(c) or 'none')
+def test_every_combination_forces_an_existing_index(monkeypatch, criteria):
+    result, queries = _search(monkeypatch, criteria)
+    forced = {name for query in queries for name in re.findall(r"FORCE INDEX \((\w+)\)", query)}
+    assert forced, "订单搜索没有固定执行计划"
+    for name in forced:
+        assert name in ORDERS_INDEXES, f"FORCE INDEX 使用了 database_setup.sql 中不存在的索引 {name}"
+        assert ORDERS_INDEXES[name][0] == 'tenant_id'
+    for name in result['plan']['index'].split(' + '):
+        assert name in forced
+
+
+@pytest.mark.parametrize('criteria, expected', [
+    ({}, 'idx_orders_tenant_time'),
+    ({'date_from': '2024-01-01'}, 'idx_orders_tenant_time'),
+    ({'date_to': '2024-02-01', 'min_amount': 10}, 'idx_orders_tenant_time'),
+    ({'min_amount': 10}, 'idx_orders_tenant_amount'),
+    ({'min_amount': 10, 'max_amount': 100}, 'idx_orders_tenant_amount'),
+    ({'status': 'completed', 'min_amount': 10}, 'idx_orders_tenant_status_time'),
+    ({'payment_status': 'paid', 'status': 'completed'}, 'idx_orders_tenant_payment_time'),
+    ({'phone': '13800000000', 'status': 'completed'}, 'idx_orders_tenant_user_time'),
+    ({'phone': '13800000000', 'customer': '张'}, 'idx_orders_tenant_user_time'),
+    ({'customer': '张', 'payment_status': 'paid'}, 'idx_orders_tenant_customer + idx_orders_tenant_user_time'),
+])
+def test_plan_picks_expected_index(monkeypatch, criteria, expected):
+    result, _ = _search(monkeypatch, criteria)
+    assert result['plan']['index'] == expected
+
+
+@pytest.mark.parametrize('key, column', [
+    ('payment_status', 'payment_status'),
+    ('status', 'status'),
+    ('min_amount', 'total_amount'),
+])
+def test_driving_index_covers_the_equality_or_range_column(key, column):
+    index = db._plan_order_search({key: CRITERIA_VALUES[key]})
+    assert ORDERS_INDEXES[index][1] == column
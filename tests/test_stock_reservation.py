@@ -0,0 +1,275 @@
+# tests/test_stock_reservation.py
+# 分片库存扣减: 用内存中的假数据库模拟 menu_item_stock_shards 的行锁 (读已提交语义) 和事务回滚，
+# 验证快速路径、跨分片扣减、库存不足、售罄下架，以及并发下单不会超卖。
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("bcrypt")
+
+import backend.database as db
+
+LOCK_WAIT_SECONDS = 5
+
+
+class FakeStore:
+    """一个餐厅分片的库存数据: 分片行、菜品上架状态和已提交的订单"""
+
+    def __init__(self, stock):
+        self.shards = {}              # (menu_item_id, shard_id) -> quantity
+        self.available = {}           # menu_item_id -> is_available
+        self.orders = {}              # order_id -> [(menu_item_id, quantity)]
+        self.statements = []
+        self._locks = {}              # (menu_item_id, shard_id) -> 持有行锁的事务
+        self._cond = threading.Condition()
+        self._next_order_id = 0
+        for menu_item_id, quantities in stock.items():
+            for shard_id, quantity in enumerate(quantities):
+                self.shards[(menu_item_id, shard_id)] = quantity
+            self.available[menu_item_id] = True
+
+    def remaining(self, menu_item_id):
+        return sum(q for (item_id, _), q in self.shards.items() if item_id == menu_item_id)
+
+    def sold(self, menu_item_id):
+        return sum(q for items in self.orders.values() for item_id, q in items if item_id == menu_item_id)
+
+    def next_order_id(self):
+        with self._cond:
+            self._next_order_id += 1
+            return self._next_order_id
+
+    def lock(self, txn, key):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._locks.get(key) in (None, txn), LOCK_WAIT_SECONDS):
+                raise db.Error("Lock wait timeout exceeded")
+            self._locks[key] = txn
+
+    def unlock(self, txn, key):
+        with self._cond:
+            if self._locks.get(key) is txn:
+                del self._locks[key]
+                self._cond.notify_all()
+
+    def release_all(self, txn):
+        with self._cond:
+            for key in [key for key, owner in self._locks.items() if owner is txn]:
+                del self._locks[key]
+            self._cond.notify_all()
+
+
+class FakeConnection:
+    def __init__(self, store):
+        self.store = store
+        self.in_transaction = False
+        self.held = set()
+        self.undo = []
+        self.order_items = []
+        self.order_id = None
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self)
+
+    def commit(self):
+        if self.order_id is not None:
+            self.store.orders[self.order_id] = self.order_items
+        self._finish()
+
+    def rollback(self):
+        for key, quantity in reversed(self.undo):
+            self.store.shards[key] = quantity
+        self._finish()
+
+    def _finish(self):
+        self.store.release_all(self)
+        self.held.clear()
+        self.undo = []
+        self.order_items = []
+        self.order_id = None
+        self.in_transaction = False
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.conn = connection
+        self.store = connection.store
+        self.rowcount = 0
+        self.lastrowid = None
+        self._rows = []
+
+    def execute(self, query, params=()):
+        sql = " ".join(query.split())
+        self.store.statements.append(sql)
+        if sql.startswith("SET TRANSACTION"):
+            assert not self.conn.in_transaction, "事务开始后不能再修改隔离级别"
+            return
+        self.conn.in_transaction = True
+        store = self.store
+        if sql.startswith("INSERT INTO orders"):
+            self.lastrowid = self.conn.order_id = store.next_order_id()
+        elif sql.startswith("SELECT shard_id, quantity FROM menu_item_stock_shards") and "FOR UPDATE" in sql:
+            keys = self._shard_keys(params[0])
+            for key in keys:
+                self._lock(key)
+            self._rows = [(key[1], store.shards[key]) for key in keys]
+        elif sql.startswith("SELECT shard_id, quantity FROM menu_item_stock_shards"):
+            self._rows = [(key[1], store.shards[key]) for key in self._shard_keys(params[0])]
+        elif sql.startswith("UPDATE menu_item_stock_shards SET quantity = quantity - %s") and "quantity >= %s" in sql:
+            quantity, menu_item_id, shard_id, _ = params
+            key = (menu_item_id, shard_id)
+            already_held = key in self.conn.held
+            self._lock(key)
+            if store.shards[key] >= quantity:
+                self._take(key, quantity)
+                self.rowcount = 1
+            else:
+                # 读已提交: 未命中条件的行在判断后即释放锁
+                self.rowcount = 0
+                if not already_held:
+                    self.conn.held.discard(key)
+                    store.unlock(self.conn, key)
+        elif sql.startswith("UPDATE menu_item_stock_shards SET quantity = quantity - %s"):
+            quantity, menu_item_id, shard_id = params
+            key = (menu_item_id, shard_id)
+            self._lock(key)
+            self._take(key, quantity)
+            self.rowcount = 1
+        elif sql.startswith("SELECT quantity FROM menu_item_stock_shards"):
+            self._rows = [(store.shards[(params[0], params[1])],)]
+        elif sql.startswith("SELECT 1 FROM menu_item_stock_shards") and "LOCK IN SHARE MODE" in sql:
+            keys = self._shard_keys(params[0])
+            for key in keys:
+                self._lock(key)
+            self._rows = [(1,)] if any(store.shards[key] > 0 for key in keys) else []
+        elif sql.startswith("UPDATE menu_items SET is_available = FALSE"):
+            self.rowcount = int(store.available[params[0]])
+            store.available[params[0]] = False
+        else:
+            raise AssertionError(f"假数据库不支持的语句: {sql}")
+
+    def executemany(self, query, rows):
+        assert " ".join(query.split()).startswith("INSERT INTO order_items")
+        self.conn.order_items = [(row[1], row[2]) for row in rows]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        pass
+
+    def _shard_keys(self, menu_item_id):
+        return sorted(key for key in self.store.shards if key[0] == menu_item_id)
+
+    def _lock(self, key):
+        self.store.lock(self.conn, key)
+        self.conn.held.add(key)
+
+    def _take(self, key, quantity):
+        self.conn.undo.append((key, self.store.shards[key]))
+        self.store.shards[key] -= quantity
+        assert self.store.shards[key] >= 0, "分片库存被扣成负数"
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(stock):
+        store = FakeStore(stock)
+        monkeypatch.setattr(db, "_checkout_connection", lambda shard_name: FakeConnection(store))
+        return store
+    return install
+
+
+def _order(*items):
+    data = [{'menu_item_id': item_id, 'quantity': quantity, 'unit_price': 10, 'subtotal': 10 * quantity}
+            for item_id, quantity in items]
+    return db.create_order(sum(item['subtotal'] for item in data), data)
+
+
+def test_single_shard_fast_path(fake_db):
+    store = fake_db({1: [5, 5, 5, 5]})
+    assert _order((1, 3)) is not None
+    assert store.remaining(1) == 17
+    assert sorted(store.shards.values()) == [2, 5, 5, 5]   # 只扣了一个分片
+    assert not any("FOR UPDATE" in sql for sql in store.statements)
+    assert store.available[1] is True
+
+
+def test_spreads_across_shards_when_no_single_shard_suffices(fake_db):
+    store = fake_db({1: [2, 2, 2, 2]})
+    assert _order((1, 5)) is not None
+    assert store.remaining(1) == 3
+    assert [store.shards[(1, shard_id)] for shard_id in range(4)] == [0, 0, 1, 2]   # 按分片顺序扣减
+    assert any("FOR UPDATE" in sql for sql in store.statements)
+    assert store.available[1] is True
+
+
+def test_insufficient_stock_rolls_back_whole_order(fake_db):
+    store = fake_db({1: [3, 3], 2: [1, 1]})
+    with pytest.raises(db.InsufficientStockError) as excinfo:
+        _order((1, 2), (2, 3))
+    assert (excinfo.value.menu_item_id, excinfo.value.requested, excinfo.value.available) == (2, 3, 2)
+    assert store.remaining(1) == 6   # 已扣减的菜品1随事务回滚
+    assert store.orders == {}
+
+
+def test_quantities_of_same_item_are_combined(fake_db):
+    store = fake_db({1: [2, 2]})
+    with pytest.raises(db.InsufficientStockError):
+        _order((1, 3), (1, 2))
+    assert store.remaining(1) == 4
+
+
+def test_sold_out_only_when_every_shard_is_empty(fake_db):
+    store = fake_db({1: [1, 1]})
+    assert _order((1, 1)) is not None
+    assert store.available[1] is True    # 一个分片扣到 0，另一个还有库存
+    assert _order((1, 1)) is not None
+    assert store.remaining(1) == 0
+    assert store.available[1] is False
+
+
+def test_sold_out_after_spreading_across_shards(fake_db):
+    store = fake_db({1: [1, 1, 1]})
+    assert _order((1, 3)) is not None
+    assert store.available[1] is False
+
+
+def test_items_without_stock_rows_are_unlimited(fake_db):
+    store = fake_db({1: [1]})
+    assert _order((99, 1000), (1, 1)) is not None
+    assert store.available[1] is False
+
+
+def test_concurrent_orders_never_oversell(fake_db):
+    store = fake_db({1: [3] * 8, 2: [2] * 8})
+    requests = [((1, 1 + n % 3), (2, 1)) if n % 2 else ((1, 1 + n % 3),) for n in range(60)]
+    outcomes = []
+
+    def place(items):
+        try:
+            outcomes.append(_order(*items))
+        except db.InsufficientStockError:
+            outcomes.append('insufficient')
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(place, requests))
+
+    # 没有因锁等待或死锁失败的订单，只有成功或库存不足
+    assert None not in outcomes
+    assert store.sold(1) + store.remaining(1) == 24
+    assert store.sold(2) + store.remaining(2) == 16
+    assert all(quantity >= 0 for quantity in store.shards.values())
+    assert len(store.orders) == sum(1 for outcome in outcomes if outcome != 'insufficient')
+    for menu_item_id in (1, 2):
+        assert store.available[menu_item_id] == (store.remaining(menu_item_id) > 0)